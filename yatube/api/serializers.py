@@ -0,0 +1,77 @@
+"""Компактная сериализация строк .values() без создания моделей.
+
+Публичное имя поля отображается на путь в ORM; клиент может запросить
+только нужные поля (?fields=id,text), и в SELECT попадут только они.
+"""
+from django.core.files.storage import default_storage
+
+POST_FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'pub_date': 'pub_date',
+    'author': 'author__username',
+    'group': 'group__slug',
+    'image': 'image',
+}
+# comments_count меняется вместе с поколением поста, а не лент, поэтому
+# отдаётся только в карточке поста, где ETag учитывает комментарии
+POST_DETAIL_FIELDS = {**POST_FIELDS, 'comments_count': 'comments_count'}
+COMMENT_FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'created': 'created',
+    'author': 'author__username',
+    'parent': 'parent_id',
+    'depth': 'depth',
+}
+
+
+def _datetime(value):
+    return value.isoformat()
+
+
+def _image(name):
+    return default_storage.url(name) if name else None
+
+
+CONVERTERS = {
+    'pub_date': _datetime,
+    'created': _datetime,
+    'image': _image,
+}
+
+
+class FieldsError(ValueError):
+    pass
+
+
+def parse_fields(value, available):
+    """Имена полей из параметра ?fields=a,b; пустой - все поля."""
+    if not value:
+        return tuple(available)
+    names = tuple(dict.fromkeys(
+        name.strip() for name in value.split(',') if name.strip()))
+    unknown = [name for name in names if name not in available]
+    if unknown or not names:
+        raise FieldsError('Неизвестные поля: {}. Доступны: {}.'.format(
+            ', '.join(unknown), ', '.join(available)))
+    return names
+
+
+def select(queryset, fields, available, extra=()):
+    """queryset.values() только с нужными колонками; extra - поля,
+    необходимые помимо запрошенных (например, ключ курсора)."""
+    lookups = dict.fromkeys([available[name] for name in fields])
+    lookups.update(dict.fromkeys(extra))
+    return queryset.values(*lookups)
+
+
+def serialize(row, fields, available):
+    result = {}
+    for name in fields:
+        value = row[available[name]]
+        converter = CONVERTERS.get(name)
+        result[name] = (converter(value)
+                        if converter is not None and value is not None
+                        else value)
+    return result
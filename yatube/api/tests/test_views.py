@@ -0,0 +1,140 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post, User
+
+
+class ApiViewsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Группа', slug='api-group',
+                                         description='Описание')
+        cls.posts = [
+            Post.objects.create(text=f'Пост {number}', author=cls.author,
+                                group=cls.group if number % 2 else None)
+            for number in range(5)
+        ]
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_pages_follow_cursor(self):
+        """Страницы по limit связаны ссылками next/previous и вместе
+        дают всю ленту в порядке (pub_date, id) по убыванию."""
+        url = reverse('api:index') + '?limit=2'
+        ids = []
+        while url:
+            data = self.client.get(url).json()
+            ids.extend(post['id'] for post in data['results'])
+            url = data['next']
+        self.assertEqual(ids, [post.id for post in reversed(self.posts)])
+
+    def test_sparse_fields(self):
+        """В ответе и в SELECT только запрошенные поля."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('api:index'),
+                                       {'fields': 'id,author'})
+        self.assertEqual(response.json()['results'][0],
+                         {'id': self.posts[-1].id, 'author': 'author'})
+        select = queries.captured_queries[-1]['sql']
+        self.assertNotIn('"text"', select)
+        response = self.client.get(reverse('api:index'),
+                                   {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', response.json()['detail'])
+
+    def test_endpoints(self):
+        reverse_args = {
+            'api:group_posts': ['api-group'],
+            'api:profile_posts': ['author'],
+        }
+        expected = {
+            'api:group_posts': [self.posts[3].id, self.posts[1].id],
+            'api:profile_posts': [post.id for post in reversed(self.posts)],
+        }
+        for name, args in reverse_args.items():
+            with self.subTest(name=name):
+                response = self.client.get(reverse(name, args=args),
+                                           {'fields': 'id'})
+                self.assertEqual(
+                    [post['id'] for post in response.json()['results']],
+                    expected[name])
+        response = self.client.get(
+            reverse('api:group_posts', args=['missing']))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {'detail': 'Не найдено.'})
+
+    def test_follow_feed(self):
+        url = reverse('api:follow_posts')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.client.force_login(self.reader)
+        response = self.client.get(url, {'fields': 'id'})
+        self.assertEqual(len(response.json()['results']), 5)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+
+    def test_post_detail(self):
+        post = self.posts[0]
+        comments = [Comment.objects.create(post=post, author=self.reader,
+                                           text=f'Комментарий {number}')
+                    for number in range(3)]
+        data = self.client.get(
+            reverse('api:post_detail', args=[post.id]),
+            {'limit': 2, 'comment_fields': 'id,author'}).json()
+        self.assertEqual(data['post']['comments_count'], 3)
+        self.assertEqual(data['comments']['results'], [
+            {'id': comments[2].id, 'author': 'reader'},
+            {'id': comments[1].id, 'author': 'reader'},
+        ])
+        self.assertIsNotNone(data['comments']['next'])
+        response = self.client.get(reverse('api:post_detail', args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(CONDITIONAL_GET=True)
+    def test_not_modified(self):
+        """Совпавший ETag - 304 без запроса страницы; новый пост и
+        правка поста меняют ETag."""
+        url = reverse('api:index')
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(len(queries), 1)
+
+        self.posts[1].text = 'Исправленный пост'
+        self.posts[1].save()
+        edited = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(edited.status_code, 200)
+        Post.objects.create(text='Новый пост', author=self.author)
+        created = self.client.get(url, HTTP_IF_NONE_MATCH=edited['ETag'])
+        self.assertEqual(created.status_code, 200)
+        self.assertEqual(created.json()['results'][0]['text'], 'Новый пост')
+
+    @override_settings(CONDITIONAL_GET=True)
+    def test_comment_changes_detail_etag(self):
+        url = reverse('api:post_detail', args=[self.posts[0].id])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Comment.objects.create(post=self.posts[0], author=self.reader,
+                               text='Новый')
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_bad_requests(self):
+        url = reverse('api:index')
+        for params in ({'cursor': 'broken'}, {'limit': 0},
+                       {'limit': 'many'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(url, params).status_code,
+                                 400)
+        self.assertEqual(self.client.post(url).status_code, 405)
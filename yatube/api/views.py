@@ -0,0 +1,204 @@
+"""Версионированный JSON API только для чтения (v1).
+
+Ленты отдаются страницами по курсору (?cursor=, ?limit=) с выбором
+полей (?fields=). Каждый ответ несёт сильный ETag, который вычисляется
+до основного запроса: из последнего (pub_date, id) ленты - один
+запрос по индексу - и поколения ленты в posts.feed_cache, которое
+сдвигают сигналы при правке и удалении постов. Если копия клиента
+свежая, возвращается 304 без выборки страницы. Как и страницы сайта,
+ETag выдаётся, только когда поколения общие для всех процессов (см.
+posts.conditional).
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import (get_conditional_response,
+                                patch_cache_control, patch_vary_headers)
+from django.utils.http import urlencode
+
+from posts import conditional, feed_cache
+from posts.feeds import follow_feed
+from posts.models import Comment, Group, Post, User
+from posts.paginators import CursorPaginator, InvalidCursor
+
+from . import serializers
+
+API_VERSION = 'v1'
+POST_ORDERING = ('-pub_date', '-id')
+FOLLOW_ORDERING = ('-feed_pub_date', '-feed_post_id')
+COMMENT_ORDERING = ('-created', '-id')
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def error_response(message, status):
+    return JsonResponse({'detail': message}, status=status,
+                        json_dumps_params={'ensure_ascii': False})
+
+
+def api_view(view):
+    """Только GET/HEAD; ошибки - JSON вместо HTML-страниц сайта."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            response = error_response('Метод не поддерживается.', 405)
+            response['Allow'] = 'GET, HEAD'
+            return response
+        try:
+            return view(request, *args, **kwargs)
+        except Http404:
+            return error_response('Не найдено.', 404)
+        except InvalidCursor:
+            return error_response('Неверный курсор.', 400)
+        except serializers.FieldsError as error:
+            return error_response(str(error), 400)
+        except ApiError as error:
+            return error_response(str(error), error.status)
+    return wrapper
+
+
+def page_size(request):
+    value = request.GET.get('limit')
+    if value is None:
+        return settings.PAG_NUM
+    try:
+        limit = int(value)
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= settings.API_MAX_PAGE_SIZE:
+        raise ApiError('limit должен быть от 1 до '
+                       f'{settings.API_MAX_PAGE_SIZE}.')
+    return limit
+
+
+def make_etag(request, *parts):
+    """Сильный ETag представления: версия API, путь, параметры запроса
+    и переданные части (поколения, последняя запись)."""
+    query = sorted(request.GET.lists())
+    raw = '|'.join(map(str, (API_VERSION, request.path, query, *parts)))
+    return '"{}"'.format(hashlib.md5(raw.encode()).hexdigest())
+
+
+def latest(queryset, ordering):
+    """Ключ последней записи ленты: один запрос по индексу."""
+    return queryset.order_by(*ordering).values_list(
+        *(name.lstrip('-') for name in ordering)).first()
+
+
+def check_etag(request, scope, queryset, ordering):
+    """ETag ответа и ответ 304, если у клиента актуальная копия, иначе
+    (etag, None). Без условных запросов - (None, None)."""
+    if not conditional.enabled():
+        return None, None
+    etag = make_etag(request, scope, *feed_cache.generations([scope]),
+                     latest(queryset, ordering))
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response['ETag'] = etag
+    return etag, response
+
+
+def json_response(request, data, etag, private=False):
+    response = JsonResponse(data, json_dumps_params={'ensure_ascii': False})
+    if etag is not None:
+        response['ETag'] = etag
+    # Кэшировать можно, но перед использованием - сверить ETag
+    patch_cache_control(response, no_cache=True, private=private,
+                        public=not private)
+    if private:
+        patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def page_link(request, cursor):
+    if cursor is None:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return request.build_absolute_uri(
+        f'{request.path}?{urlencode(sorted(params.items()))}')
+
+
+def paginate(request, queryset, ordering, available, fields_param='fields'):
+    """Страница строк queryset по курсору в виде словаря ответа."""
+    fields = serializers.parse_fields(request.GET.get(fields_param),
+                                      available)
+    rows = serializers.select(queryset, fields, available,
+                              extra=[name.lstrip('-') for name in ordering])
+    page = CursorPaginator(rows, page_size(request), ordering).page(
+        request.GET.get('cursor') or None)
+    return {
+        'results': [serializers.serialize(row, fields, available)
+                    for row in page],
+        'next': page_link(request, page.next_cursor),
+        'previous': page_link(request, page.previous_cursor),
+    }
+
+
+def feed_response(request, queryset, scope, ordering=POST_ORDERING,
+                  private=False):
+    etag, response = check_etag(request, scope, queryset, ordering)
+    if response is not None:
+        return response
+    data = paginate(request, queryset, ordering, serializers.POST_FIELDS)
+    return json_response(request, data, etag, private)
+
+
+@api_view
+def index(request):
+    return feed_response(request, Post.objects.all(), 'all')
+
+
+@api_view
+def group_posts(request, slug):
+    group_id = get_object_or_404(
+        Group.objects.values_list('id', flat=True), slug=slug)
+    return feed_response(request, Post.objects.filter(group_id=group_id),
+                         f'group:{group_id}')
+
+
+@api_view
+def profile_posts(request, username):
+    author_id = get_object_or_404(
+        User.objects.values_list('id', flat=True), username=username)
+    return feed_response(request, Post.objects.filter(author_id=author_id),
+                         f'author:{author_id}')
+
+
+@api_view
+def follow_posts(request):
+    if not request.user.is_authenticated:
+        raise ApiError('Нужна авторизация.', status=401)
+    return feed_response(request, follow_feed(request.user),
+                         f'follow:{request.user.id}',
+                         ordering=FOLLOW_ORDERING, private=True)
+
+
+@api_view
+def post_detail(request, post_id):
+    """Пост и страница его комментариев (?cursor= листает комментарии,
+    ?comment_fields= выбирает их поля)."""
+    comments = Comment.objects.filter(post_id=post_id)
+    scope = f'post:{post_id}'
+    etag, response = check_etag(request, scope, comments, COMMENT_ORDERING)
+    if response is not None:
+        return response
+    available = serializers.POST_DETAIL_FIELDS
+    fields = serializers.parse_fields(request.GET.get('fields'), available)
+    post = get_object_or_404(
+        serializers.select(Post.objects.all(), fields, available),
+        id=post_id)
+    data = {
+        'post': serializers.serialize(post, fields, available),
+        'comments': paginate(request, comments, COMMENT_ORDERING,
+                             serializers.COMMENT_FIELDS,
+                             fields_param='comment_fields'),
+    }
+    return json_response(request, data, etag)
@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from .db import set_sqlite_pragmas
+        connection_created.connect(set_sqlite_pragmas,
+                                   dispatch_uid='core_sqlite_pragmas')
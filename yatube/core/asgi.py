@@ -0,0 +1,285 @@
+"""ASGI-обёртка над WSGI-приложением Django.
+
+Django 2.2 не умеет ни ASGI, ни асинхронных представлений, поэтому
+представления остаются синхронными и выполняются в пуле из ASGI_THREADS
+потоков, а в цикле событий делается всё, что зависит от скорости
+клиента: чтение тела запроса и отправка ответа. Поток занят только
+SQL и отрисовкой. Медленный клиент, который скачивает ленту минуту,
+держит корутину и буфер ответа, а не поток, как под WSGI-сервером.
+
+Ответ передаётся из потока в цикл по частям. Поток не ждёт клиента,
+пока неотправленного меньше ASGI_RESPONSE_BUFFER байт: обычный
+HttpResponse отдаётся сразу, а StreamingHttpResponse итерируется в том
+же потоке (там же его соединение с БД) и притормаживает, только когда
+клиент отстал на целый буфер.
+
+Тело запроса ограничено теми же пределами, что проверяет Django
+(DATA_UPLOAD_MAX_MEMORY_SIZE и IMAGE_UPLOAD_MAX_SIZE для картинки):
+большее не дочитывается и получает 413. Если представление упало, когда
+статус уже отправлен, соединение обрывается, а не завершается как
+полный ответ: клиент и прокси видят, что ответ неполный.
+"""
+import asyncio
+import logging
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class RequestTooLarge(Exception):
+    pass
+
+
+class ResponseAborted(Exception):
+    """Ответ прерван ошибкой после отправки статуса."""
+
+
+def body_limit(scope):
+    """Наибольший размер тела запроса в байтах или None."""
+    limit = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+    if limit is None:
+        return None
+    content_type = dict(scope.get('headers', ())).get(b'content-type', b'')
+    if content_type.startswith(b'multipart/form-data'):
+        # Файлы Django в DATA_UPLOAD_MAX_MEMORY_SIZE не считает, а
+        # единственный файл форм - картинка поста
+        limit += settings.IMAGE_UPLOAD_MAX_SIZE
+    return limit
+
+
+def wsgi_environ(scope, body):
+    """WSGI environ по scope запроса ASGI (PEP 3333)."""
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        # Строки environ - байты в latin-1, Django раскодирует их сам
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    server = scope.get('server') or ('localhost', 80)
+    environ['SERVER_NAME'] = server[0]
+    environ['SERVER_PORT'] = str(server[1] or 80)
+    client = scope.get('client')
+    if client:
+        environ['REMOTE_ADDR'] = client[0]
+        environ['REMOTE_PORT'] = str(client[1])
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_LENGTH', 'CONTENT_TYPE'):
+            name = f'HTTP_{name}'
+        value = value.decode('latin-1')
+        if name in environ:
+            value = f'{environ[name]},{value}'
+        environ[name] = value
+    return environ
+
+
+class ResponsePipe:
+    """Части ответа из потока представления в цикл событий.
+
+    put() вызывается в потоке и ждёт, пока неотправленного больше
+    limit байт; sent() и close() вызываются в цикле.
+    """
+
+    def __init__(self, loop, limit):
+        self.loop = loop
+        self.limit = limit
+        self.queue = asyncio.Queue()
+        self.unsent = 0
+        self.closed = False
+        self.failed = False
+        self._condition = threading.Condition()
+
+    def put(self, item):
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.closed or self.unsent < self.limit)
+            if self.closed:
+                raise ClientDisconnected
+            if isinstance(item, bytes):
+                self.unsent += len(item)
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+    def finish(self, failed=False):
+        """Конец ответа: вызывается потоком в любом случае, failed -
+        ответ не удалось получить целиком."""
+        self.failed = failed
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+
+    def sent(self, size):
+        with self._condition:
+            self.unsent -= size
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+class ASGIHandler:
+    """ASGI 3 приложение поверх WSGI-приложения.
+
+    mounts - приложения ASGI по префиксам пути, например потоки событий
+    live.sse под LIVE_URL; остальные запросы идут в wsgi_application.
+    """
+
+    def __init__(self, wsgi_application, mounts=None, threads=None):
+        self.wsgi_application = wsgi_application
+        self.mounts = sorted((mounts or {}).items(),
+                             key=lambda mount: len(mount[0]), reverse=True)
+        self.executor = ThreadPoolExecutor(
+            threads or settings.ASGI_THREADS, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        for prefix, application in self.mounts:
+            if scope.get('path', '').startswith(prefix):
+                await application(scope, receive, send)
+                return
+        if scope['type'] != 'http':
+            return
+        try:
+            body = await self.read_body(receive, body_limit(scope))
+        except ClientDisconnected:
+            return
+        except RequestTooLarge:
+            await send({'type': 'http.response.start', 'status': 413,
+                        'headers': [(b'content-type', b'text/plain'),
+                                    (b'connection', b'close')]})
+            await send({'type': 'http.response.body',
+                        'body': b'Request Entity Too Large'})
+            return
+        loop = asyncio.get_running_loop()
+        pipe = ResponsePipe(loop, settings.ASGI_RESPONSE_BUFFER)
+        worker = loop.run_in_executor(self.executor, self.run_wsgi,
+                                      wsgi_environ(scope, body), pipe)
+        disconnect = asyncio.ensure_future(
+            self.wait_disconnect(receive, pipe))
+        try:
+            await self.send_response(send, pipe)
+        finally:
+            pipe.close()
+            disconnect.cancel()
+            await worker
+            body.close()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, receive, limit=None):
+        """Тело запроса целиком: большое - во временном файле. Тело
+        больше limit байт не дочитывается: RequestTooLarge."""
+        body = tempfile.SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                raise ClientDisconnected
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if limit is not None and size > limit:
+                body.close()
+                raise RequestTooLarge
+            body.write(chunk)
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+        return body
+
+    def run_wsgi(self, environ, pipe):
+        """Выполняет запрос в потоке пула и передаёт ответ в pipe."""
+        response = None
+        failed = False
+        try:
+            def start_response(status, headers, exc_info=None):
+                pipe.put((int(status[:3]), [
+                    (name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in headers]))
+
+            response = self.wsgi_application(environ, start_response)
+            for chunk in response:
+                if chunk:
+                    pipe.put(chunk)
+        except ClientDisconnected:
+            pass
+        except Exception:
+            failed = True
+            logger.exception('Ошибка при обработке %s',
+                              environ.get('PATH_INFO'))
+        finally:
+            try:
+                # request_finished закрывает соединения с БД этого потока
+                if hasattr(response, 'close'):
+                    response.close()
+            except Exception:
+                failed = True
+                logger.exception('Ошибка при закрытии ответа %s',
+                                 environ.get('PATH_INFO'))
+            finally:
+                pipe.finish(failed)
+
+    async def send_response(self, send, pipe):
+        started = False
+        while True:
+            item = await pipe.queue.get()
+            if item is None:
+                break
+            if isinstance(item, tuple):
+                status, headers = item
+                await send({'type': 'http.response.start',
+                            'status': status, 'headers': headers})
+                started = True
+                continue
+            await send({'type': 'http.response.body', 'body': item,
+                        'more_body': True})
+            pipe.sent(len(item))
+        if pipe.closed:
+            return
+        if started and pipe.failed:
+            # Последнее сообщение с more_body=False выдало бы обрезанное
+            # тело за полный ответ: сервер ASGI обрывает соединение,
+            # если приложение завершилось исключением
+            raise ResponseAborted
+        if not started:
+            await send({'type': 'http.response.start', 'status': 500,
+                        'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def wait_disconnect(self, receive, pipe):
+        """Клиент ушёл: останавливает поток и отправку ответа."""
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                pipe.close()
+                pipe.queue.put_nowait(None)
+                return
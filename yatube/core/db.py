@@ -0,0 +1,82 @@
+"""SQLite в продакшене: прагмы соединений и реплики для чтения.
+
+Включается настройкой SQLITE_PRODUCTION (см. settings.py). Каждому
+новому соединению SQLite обработчик connection_created выставляет
+прагмы из SQLITE_PRAGMAS: журнал WAL (читатели не ждут писателя),
+synchronous=NORMAL (fsync только при checkpoint), кэш страниц и
+mmap. Соединениям реплик вместо смены журнала включается query_only.
+
+ReadReplicaRouter направляет чтение моделей лент на реплики из
+DATABASE_READ_REPLICAS, а запись - на основную БД. Внутри транзакции
+основной БД чтение тоже идёт в неё: реплика не видит незафиксированных
+записей, и, например, сигнал, читающий только что созданный пост,
+его бы не нашёл.
+"""
+import random
+
+from django.conf import settings
+from django.db import connections
+
+# Модели, чтение которых можно отдать реплике: всё, что выводят ленты
+REPLICA_MODELS = {
+    'auth.user',
+    'posts.post',
+    'posts.group',
+    'posts.comment',
+    'posts.feedentry',
+    'posts.userstats',
+    'posts.postscore',
+    'posts.groupscore',
+    'posts.recommendation',
+}
+
+
+def sqlite_pragmas(alias):
+    """Прагмы для нового соединения с базой alias."""
+    pragmas = dict(settings.SQLITE_PRAGMAS)
+    if alias in settings.DATABASE_READ_REPLICAS:
+        # Режим журнала меняет файл БД, а реплика открыта только для
+        # чтения; query_only защищает её от случайной записи
+        pragmas.pop('journal_mode', None)
+        pragmas['query_only'] = 'ON'
+    return pragmas
+
+
+def set_sqlite_pragmas(sender, connection, **kwargs):
+    """Обработчик connection_created."""
+    if connection.vendor != 'sqlite' or not settings.SQLITE_PRODUCTION:
+        return
+    # Сырое соединение sqlite3: прагмы не должны попадать в счётчики
+    # запросов и в connection.queries
+    for name, value in sqlite_pragmas(connection.alias).items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+class ReadReplicaRouter:
+    """Чтение лент - с реплик, запись и всё остальное - в default."""
+
+    primary = 'default'
+
+    def _replicas(self):
+        return settings.DATABASE_READ_REPLICAS
+
+    def db_for_read(self, model, **hints):
+        replicas = self._replicas()
+        if not replicas or model._meta.label_lower not in REPLICA_MODELS:
+            return self.primary
+        if connections[self.primary].in_atomic_block:
+            return self.primary
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return self.primary
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики - копии default: объекты из них можно связывать
+        databases = {self.primary, *self._replicas()}
+        if {obj1._state.db, obj2._state.db} <= databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in self._replicas()
@@ -0,0 +1,253 @@
+"""Метрики в текстовом формате Prometheus.
+
+Каждый поток пишет в собственный словарь (шард), поэтому запись метрики
+не берёт блокировок и не конкурирует с чтением: при выдаче /metrics
+шарды всех потоков копируются и складываются. Копирование словаря
+выполняется целиком в C под GIL; гистограмма, скопированная посреди
+наблюдения, может отстать на одно наблюдение, что для метрик
+несущественно. Шарды завершившихся потоков сливаются в общий словарь
+процесса, так что их число не растёт вместе с числом созданных потоков.
+
+При нескольких процессах (воркеры gunicorn) фоновый поток каждого
+процесса раз в METRICS_FLUSH_INTERVAL секунд атомарно сохраняет его
+снимок в METRICS_DIR/<pid>-<метка>.json; /metrics складывает снимки всех
+процессов. Случайная метка не даёт процессу с повторно выданным pid
+затереть снимок другого. Снимки, не обновлявшиеся METRICS_STALE_AFTER
+секунд, принадлежат завершившимся процессам и удаляются: их счётчики
+пропадают из суммы, как при перезапуске процесса.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+from django.conf import settings
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+GAUGE = 'gauge'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS = {
+    'yatube_http_requests_total': (
+        COUNTER, 'Обработанные запросы.', None),
+    'yatube_http_request_duration_seconds': (
+        HISTOGRAM, 'Время ответа представления.', LATENCY_BUCKETS),
+    'yatube_db_queries_total': (
+        COUNTER, 'SQL-запросы, выполненные представлением.', None),
+    'yatube_db_query_duration_seconds_total': (
+        COUNTER, 'Суммарное время SQL-запросов представления.', None),
+    'yatube_feed_cache_requests_total': (
+        COUNTER, 'Обращения к кэшу фрагментов лент.', None),
+    'yatube_thumbnail_render_seconds': (
+        HISTOGRAM, 'Время создания миниатюр картинки.', LATENCY_BUCKETS),
+}
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+# Поток -> его шард; значения завершившихся потоков - в _retired
+_shards = {}
+_retired = {}
+_shards_lock = threading.Lock()
+# Имя файла снимка и процесс, для которого запущен поток сохранения:
+# после fork и то, и другое создаётся заново
+_process = {'pid': None, 'name': None, 'flusher': None}
+
+
+def _prune():
+    """Сливает шарды завершившихся потоков в _retired. Вызывается под
+    _shards_lock; в шард мёртвого потока уже никто не пишет."""
+    for thread in [thread for thread in _shards if not thread.is_alive()]:
+        for key, value in _shards.pop(thread).items():
+            _merge(_retired, key, value)
+
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = {}
+        with _shards_lock:
+            _prune()
+            _shards[threading.current_thread()] = shard
+    return shard
+
+
+def inc(name, labels=(), value=1):
+    """Увеличивает счётчик; labels - кортеж пар (имя, значение)."""
+    shard = _shard()
+    key = (name, labels)
+    shard[key] = shard.get(key, 0) + value
+
+
+def observe(name, value, labels=()):
+    """Добавляет наблюдение в гистограмму."""
+    shard = _shard()
+    key = (name, labels)
+    buckets = METRICS[name][2]
+    # Счётчики корзин (последняя - +Inf), затем сумма и число наблюдений
+    entry = shard.get(key)
+    if entry is None:
+        entry = shard[key] = [0] * (len(buckets) + 3)
+    entry[bisect_left(buckets, value)] += 1
+    entry[-2] += value
+    entry[-1] += 1
+
+
+def _merge(total, key, value):
+    if isinstance(value, list):
+        current = total.get(key)
+        total[key] = (value[:] if current is None
+                      else [a + b for a, b in zip(current, value)])
+    else:
+        total[key] = total.get(key, 0) + value
+
+
+def local_snapshot():
+    """Метрики текущего процесса: {(имя, метки): значение}."""
+    with _shards_lock:
+        _prune()
+        shards = list(_shards.values())
+        total = {}
+        for key, value in _retired.items():
+            _merge(total, key, value)
+    for shard in shards:
+        for key, value in list(shard.items()):
+            _merge(total, key, value)
+    return total
+
+
+def _process_name():
+    pid = os.getpid()
+    if _process['pid'] != pid:
+        _process.update(pid=pid, name=f'{pid}-{uuid.uuid4().hex[:8]}')
+    return _process['name']
+
+
+def _path(name=None):
+    return os.path.join(settings.METRICS_DIR,
+                        f'{name or _process_name()}.json')
+
+
+def dump():
+    """Атомарно сохраняет снимок процесса в METRICS_DIR."""
+    if not settings.METRICS_DIR:
+        return
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    rows = [[name, [list(pair) for pair in labels], value]
+            for (name, labels), value in local_snapshot().items()]
+    descriptor, temporary = tempfile.mkstemp(dir=settings.METRICS_DIR,
+                                             suffix='.tmp')
+    with os.fdopen(descriptor, 'w') as output:
+        json.dump(rows, output)
+    os.replace(temporary, _path())
+
+
+def _flush_loop():
+    while True:
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+        try:
+            dump()
+        except OSError:
+            logger.exception('Не удалось сохранить метрики')
+
+
+def maybe_dump():
+    """Запускает в процессе поток, периодически сохраняющий снимок:
+    снимок простаивающего процесса тоже остаётся свежим."""
+    if not settings.METRICS_DIR:
+        return
+    name = _process_name()
+    if _process['flusher'] == name:
+        return
+    _process['flusher'] = name
+    threading.Thread(target=_flush_loop, name='metrics-flush',
+                     daemon=True).start()
+
+
+def collect():
+    """Метрики всех процессов: свой - из памяти, остальные - из
+    файлов METRICS_DIR."""
+    total = local_snapshot()
+    directory = settings.METRICS_DIR
+    if not directory or not os.path.isdir(directory):
+        return total
+    own = f'{_process_name()}.json'
+    stale = time.time() - settings.METRICS_STALE_AFTER
+    for name in os.listdir(directory):
+        if not name.endswith('.json') or name == own:
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) < stale:
+                os.remove(path)
+                continue
+            with open(path) as snapshot:
+                rows = json.load(snapshot)
+        except (OSError, ValueError):
+            continue
+        for metric, labels, value in rows:
+            _merge(total, (metric, tuple(map(tuple, labels))), value)
+    return total
+
+
+def _format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ''
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render(values, gauges=()):
+    """Текст в формате Prometheus. gauges - [(имя, справка, значение)]."""
+    by_name = {}
+    for (name, labels), value in values.items():
+        by_name.setdefault(name, []).append((labels, value))
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(by_name.get(name, ()),
+                                    key=lambda item: item[0]):
+            if kind != HISTOGRAM:
+                lines.append(f'{name}{_format_labels(labels)} '
+                             f'{_format_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), value):
+                cumulative += count
+                le = (('le', bound if bound == '+Inf' else repr(
+                    float(bound))),)
+                lines.append(f'{name}_bucket{_format_labels(labels, le)} '
+                             f'{cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} '
+                         f'{_format_number(value[-2])}')
+            lines.append(f'{name}_count{_format_labels(labels)} '
+                         f'{value[-1]}')
+    for name, help_text, value in gauges:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {GAUGE}')
+        lines.append(f'{name} {_format_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    with _shards_lock:
+        for shard in _shards.values():
+            shard.clear()
+        _retired.clear()
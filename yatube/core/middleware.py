@@ -0,0 +1,247 @@
+import logging
+import random
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from . import metrics, profiling
+from .query_budget import QueryBudgetExceeded, QueryCounter
+
+logger = logging.getLogger('core.query_budget')
+
+_END = object()
+
+
+class MeasuredContent:
+    """Тело потокового ответа, каждый кусок которого отдаётся внутри
+    замера middleware (measure()).
+
+    Тело StreamingHttpResponse выполняет запросы и отрисовку, когда
+    сервер читает ответ, уже после middleware. finish() вызывается,
+    когда тело прочитано до конца (ошибка дойдёт до сервера, как из
+    представления), или при response.close(), если клиент ушёл раньше.
+    """
+
+    def __init__(self, content, measure, finish):
+        self.content = content
+        self.measure = measure
+        self.finish = finish
+        self.finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.measure():
+            chunk = next(self.content, _END)
+        if chunk is _END:
+            self._finish()
+            raise StopIteration
+        return chunk
+
+    def close(self):
+        # Response.close() проглатывает исключения: сюда доходят
+        # только оборванные ответы
+        self._finish()
+
+    def _finish(self):
+        if not self.finished:
+            self.finished = True
+            self.finish()
+
+
+def finish_response(response, measure, finish):
+    """Вызывает finish() сразу, а для потокового ответа - после отдачи
+    тела внутри measure() (см. MeasuredContent)."""
+    if response.streaming:
+        # Сеттер добавит MeasuredContent в объекты, закрываемые
+        # response.close()
+        response.streaming_content = MeasuredContent(
+            response.streaming_content, measure, finish)
+    else:
+        finish()
+    return response
+
+
+class QueryBudgetMiddleware:
+    """Следит, чтобы представление укладывалось в settings.QUERY_BUDGET
+    запросов.
+
+    При превышении пишет предупреждение в лог или, если включён
+    QUERY_BUDGET_RAISE, выбрасывает QueryBudgetExceeded. Когда бюджет не
+    задан (None), middleware отключается.
+    """
+
+    def __init__(self, get_response):
+        if settings.QUERY_BUDGET is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.budget = settings.QUERY_BUDGET
+        self.raise_exception = settings.QUERY_BUDGET_RAISE
+
+    def __call__(self, request):
+        counter = QueryCounter()
+
+        def measure():
+            return connections['default'].execute_wrapper(counter)
+
+        with measure():
+            response = self.get_response(request)
+        return finish_response(response, measure,
+                               lambda: self.check(request, counter))
+
+    def check(self, request, counter):
+        if counter.count > self.budget:
+            message = (f'{request.method} {request.path}: выполнено '
+                       f'запросов {counter.count}, бюджет {self.budget}')
+            if self.raise_exception:
+                raise QueryBudgetExceeded(f'{message}\n{counter.report()}')
+            logger.warning(message)
+
+
+class ProfilingMiddleware:
+    """Замеряет время SQL, шаблонов, кэша и миниатюр в каждом запросе
+    и собирает статистику по представлениям (см. core.profiling).
+
+    Доля запросов settings.PROFILING_SAMPLE_RATE, а также запросы
+    персонала с заголовком X-Profile, дополнительно профилируются
+    cProfile; имя файла профиля возвращается в заголовке X-Profile.
+    Персоналу отдаётся заголовок Server-Timing с разбивкой времени.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        profiling.install()
+        self.get_response = get_response
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+
+    def __call__(self, request):
+        profile = profiling.RequestProfile()
+        recorder = profiling.QueryRecorder(profile)
+        profiler = None
+        if self.should_sample(request):
+            profiler = profiling.Profiler()
+
+        @contextmanager
+        def measure():
+            with profiling.activate(profile), ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(
+                        connections[alias].execute_wrapper(recorder))
+                if profiler is not None:
+                    stack.enter_context(profiler)
+                yield
+
+        with measure():
+            response = self.get_response(request)
+        match = request.resolver_match
+        view_name = match.view_name if match else 'unresolved'
+        profile_name = None
+        if profiler is not None:
+            profile_name = profiling.Profiler.filename(view_name)
+            response['X-Profile'] = profile_name
+
+        def finish():
+            total, sections = profiling.record(view_name, profile)
+            if profiler is not None:
+                profiler.save(profile_name)
+            return total, sections
+
+        if response.streaming:
+            # Заголовки уходят раньше тела, Server-Timing не отдаётся
+            return finish_response(response, measure, finish)
+        total, sections = finish()
+        if self.is_staff(request):
+            timings = [f'{name};dur={value:.2f}'
+                       for name, value in sections.items()]
+            timings.append(f'total;dur={total:.2f}')
+            response['Server-Timing'] = ', '.join(timings)
+        return response
+
+    def should_sample(self, request):
+        if 'HTTP_X_PROFILE' in request.META and self.is_staff(request):
+            return True
+        return self.sample_rate and random.random() < self.sample_rate
+
+    @staticmethod
+    def is_staff(request):
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_staff
+
+
+class _QueryTimer:
+    """execute_wrapper: число и суммарное время запросов; measure() -
+    время обработки запроса без ожидания клиента."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.elapsed = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+
+    @contextmanager
+    def measure(self):
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(
+                    connections[alias].execute_wrapper(self))
+            try:
+                yield
+            finally:
+                self.elapsed += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """Считает запросы, время ответа и SQL по представлениям для
+    /metrics (см. core.metrics).
+
+    Представления приложений из METRICS_NAMESPACES учитываются по имени
+    URL, остальные - под общими метками, чтобы число рядов не росло.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.namespaces = set(settings.METRICS_NAMESPACES)
+
+    def __call__(self, request):
+        timer = _QueryTimer()
+        with timer.measure():
+            response = self.get_response(request)
+        return finish_response(
+            response, timer.measure,
+            lambda: self.record(request, response, timer))
+
+    def record(self, request, response, timer):
+        view = self.view_label(request)
+        labels = (('view', view),)
+        metrics.inc('yatube_http_requests_total',
+                    (('view', view), ('method', request.method),
+                     ('status', str(response.status_code))))
+        metrics.observe('yatube_http_request_duration_seconds',
+                        timer.elapsed, labels)
+        metrics.inc('yatube_db_queries_total', labels, timer.count)
+        metrics.inc('yatube_db_query_duration_seconds_total', labels,
+                    timer.seconds)
+        metrics.maybe_dump()
+
+    def view_label(self, request):
+        match = request.resolver_match
+        if match is None:
+            return 'unresolved'
+        if match.namespace in self.namespaces:
+            return match.view_name
+        return 'other'
@@ -0,0 +1,322 @@
+"""Профилирование запросов: куда уходит время внутри представлений.
+
+Время запроса делится на разделы - SQL, отрисовка шаблона, кэш,
+миниатюры; остаток считается временем Python-кода представления.
+Разделы могут быть вложены (SQL внутри отрисовки шаблона), каждый
+учитывает только собственное время, поэтому сумма разделов не
+превышает длительности запроса.
+
+Замеры складываются в гистограммы по представлениям (aggregate()),
+которые периодически пишутся в ротируемый файл и отдаются страницей
+для персонала. Инструментирование стоит одного вызова perf_counter()
+на границу раздела и ничего не делает вне профилируемого запроса.
+"""
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+
+SQL = 'sql'
+TEMPLATE = 'template'
+CACHE = 'cache'
+THUMBNAIL = 'thumbnail'
+SECTIONS = (SQL, TEMPLATE, CACHE, THUMBNAIL)
+
+# Верхние границы корзин гистограммы длительности запроса, мс
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+CACHE_METHODS = ('get', 'get_many', 'set', 'set_many', 'add', 'delete',
+                 'delete_many', 'incr', 'decr', 'has_key', 'touch')
+
+_local = threading.local()
+_lock = threading.Lock()
+_views = {}
+_last_flush = time.monotonic()
+_file_logger = None
+
+
+class RequestProfile:
+    """Замеры одного запроса."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sections = dict.fromkeys(SECTIONS, 0.0)
+        self.queries = Counter()
+        self._stack = []
+        self._paused = None
+
+    def pause(self):
+        """Время до resume() (ожидание клиента потоковым ответом) не
+        входит в длительность запроса."""
+        self._paused = time.perf_counter()
+
+    def resume(self):
+        if self._paused is not None:
+            self.started += time.perf_counter() - self._paused
+            self._paused = None
+
+    @property
+    def elapsed(self):
+        """Длительность запроса в секундах."""
+        finished = self._paused
+        if finished is None:
+            finished = time.perf_counter()
+        return finished - self.started
+
+    def enter(self):
+        self._stack.append([time.perf_counter(), 0.0])
+
+    def exit(self, name):
+        started, children = self._stack.pop()
+        elapsed = time.perf_counter() - started
+        self.sections[name] += elapsed - children
+        if self._stack:
+            self._stack[-1][1] += elapsed
+
+    @property
+    def query_count(self):
+        return sum(self.queries.values())
+
+    @property
+    def duplicates(self):
+        """Повторы одного и того же запроса с теми же параметрами."""
+        return sum(count - 1 for count in self.queries.values())
+
+    def most_duplicated(self):
+        if not self.queries:
+            return None
+        (sql, _), count = self.queries.most_common(1)[0]
+        return sql if count > 1 else None
+
+
+def current():
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def section(name):
+    """Относит время блока к разделу name текущего запроса."""
+    profile = current()
+    if profile is None:
+        yield
+        return
+    profile.enter()
+    try:
+        yield
+    finally:
+        profile.exit(name)
+
+
+def _wrap(method, name):
+    def wrapper(*args, **kwargs):
+        profile = current()
+        if profile is None:
+            return method(*args, **kwargs)
+        profile.enter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            profile.exit(name)
+    wrapper.__wrapped__ = method
+    wrapper.profiled = True
+    return wrapper
+
+
+def instrument(cls, methods, name):
+    """Оборачивает методы класса замером раздела name (один раз)."""
+    for attribute in methods:
+        method = getattr(cls, attribute, None)
+        if method is not None and not getattr(method, 'profiled', False):
+            setattr(cls, attribute, _wrap(method, name))
+
+
+def install():
+    """Подключает замер шаблонов и всех настроенных кэшей."""
+    from django.core.cache import caches
+    from django.template.backends.django import Template
+
+    instrument(Template, ('render',), TEMPLATE)
+    for alias in settings.CACHES:
+        instrument(type(caches[alias]), CACHE_METHODS, CACHE)
+
+
+class QueryRecorder:
+    """execute_wrapper: время и отпечатки SQL-запросов."""
+
+    def __init__(self, profile):
+        self.profile = profile
+
+    def __call__(self, execute, sql, params, many, context):
+        self.profile.enter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.profile.exit(SQL)
+            try:
+                key = (sql, hash(tuple(params)) if params else None)
+            except TypeError:
+                key = (sql, id(params))
+            self.profile.queries[key] += 1
+
+
+@contextmanager
+def activate(profile):
+    """Замеры блока относятся к profile. Запрос может быть активен
+    несколько раз: потоковый ответ отдаёт тело уже после middleware."""
+    profile.resume()
+    _local.profile = profile
+    try:
+        yield profile
+    finally:
+        _local.profile = None
+        profile.pause()
+
+
+def profile_request():
+    return activate(RequestProfile())
+
+
+class Profiler:
+    """Выборочный cProfile запроса; результат - файл .prof в
+    PROFILING_DIR (смотреть через python -m pstats или snakeviz)."""
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+
+    def __enter__(self):
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.disable()
+
+    @staticmethod
+    def filename(view_name):
+        return f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-' \
+               f'{view_name.replace(":", "_")}.prof'
+
+    def save(self, name):
+        directory = os.path.join(settings.PROFILING_DIR, 'profiles')
+        os.makedirs(directory, exist_ok=True)
+        self.profiler.dump_stats(os.path.join(directory, name))
+
+
+def _empty_stats():
+    return {
+        'requests': 0,
+        'total_ms': 0.0,
+        'sections_ms': dict.fromkeys(SECTIONS, 0.0),
+        'python_ms': 0.0,
+        'queries': 0,
+        'max_queries': 0,
+        'duplicate_queries': 0,
+        'duplicated_sql': None,
+        'histogram': [0] * (len(BUCKETS) + 1),
+    }
+
+
+def record(view_name, profile):
+    """Добавляет замеры запроса к статистике представления."""
+    total = profile.elapsed * 1000
+    sections = {name: seconds * 1000
+                for name, seconds in profile.sections.items()}
+    query_count = profile.query_count
+    duplicates = profile.duplicates
+    duplicated_sql = profile.most_duplicated() if duplicates else None
+    with _lock:
+        stats = _views.get(view_name)
+        if stats is None:
+            stats = _views[view_name] = _empty_stats()
+        stats['requests'] += 1
+        stats['total_ms'] += total
+        for name, value in sections.items():
+            stats['sections_ms'][name] += value
+        stats['python_ms'] += max(total - sum(sections.values()), 0.0)
+        stats['queries'] += query_count
+        stats['max_queries'] = max(stats['max_queries'], query_count)
+        stats['duplicate_queries'] += duplicates
+        if duplicated_sql:
+            stats['duplicated_sql'] = duplicated_sql
+        stats['histogram'][bisect_left(BUCKETS, total)] += 1
+    _maybe_flush()
+    return total, sections
+
+
+def aggregate():
+    """Снимок статистики текущего процесса по представлениям."""
+    with _lock:
+        views = {
+            name: {**stats,
+                   'sections_ms': dict(stats['sections_ms']),
+                   'histogram': list(stats['histogram'])}
+            for name, stats in _views.items()
+        }
+    for stats in views.values():
+        stats['percentiles_ms'] = {
+            label: _histogram_percentile(stats['histogram'], fraction)
+            for label, fraction in (('p50', 0.5), ('p90', 0.9),
+                                    ('p99', 0.99))
+        }
+    return {'pid': os.getpid(), 'buckets_ms': list(BUCKETS),
+            'views': views}
+
+
+def _histogram_percentile(histogram, fraction):
+    """Верхняя граница корзины, в которую попадает перцентиль
+    (None - больше последней границы)."""
+    total = sum(histogram)
+    if not total:
+        return None
+    threshold = fraction * total
+    seen = 0
+    for bound, count in zip(BUCKETS + (None,), histogram):
+        seen += count
+        if seen >= threshold:
+            return bound
+    return None
+
+
+def reset():
+    with _lock:
+        _views.clear()
+
+
+def _get_file_logger():
+    global _file_logger
+    if _file_logger is None:
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+        handler = RotatingFileHandler(
+            os.path.join(settings.PROFILING_DIR, 'profiling.jsonl'),
+            maxBytes=settings.PROFILING_FILE_MAX_BYTES, backupCount=5)
+        logger = logging.getLogger('core.profiling.file')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+        _file_logger = logger
+    return _file_logger
+
+
+def _maybe_flush():
+    global _last_flush
+    now = time.monotonic()
+    if now - _last_flush < settings.PROFILING_FLUSH_INTERVAL:
+        return
+    with _lock:
+        if now - _last_flush < settings.PROFILING_FLUSH_INTERVAL:
+            return
+        _last_flush = now
+    flush()
+
+
+def flush():
+    """Пишет снимок статистики строкой JSON в ротируемый файл."""
+    snapshot = aggregate()
+    snapshot['time'] = time.time()
+    _get_file_logger().info(json.dumps(snapshot, ensure_ascii=False))
@@ -0,0 +1,50 @@
+"""Бюджет SQL-запросов на представление.
+
+Счётчик подключается через connection.execute_wrapper, поэтому
+работает и при DEBUG = False. Используется в тестах (assert_max_queries)
+и в QueryBudgetMiddleware.
+"""
+from contextlib import contextmanager
+
+from django.db import connections
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryCounter:
+    """Считает запросы, прошедшие через соединение."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    def report(self):
+        return '\n'.join(f'{number}. {sql}' for number, sql
+                         in enumerate(self.queries, start=1))
+
+
+@contextmanager
+def count_queries(using='default'):
+    counter = QueryCounter()
+    with connections[using].execute_wrapper(counter):
+        yield counter
+
+
+@contextmanager
+def assert_max_queries(limit, using='default'):
+    """Падает с AssertionError, если блок выполнил больше limit запросов."""
+    with count_queries(using) as counter:
+        yield counter
+    if counter.count > limit:
+        raise AssertionError(
+            f'Выполнено запросов: {counter.count}, бюджет: {limit}\n'
+            f'{counter.report()}')
@@ -0,0 +1,229 @@
+import asyncio
+import io
+import threading
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+from django.test import SimpleTestCase, TransactionTestCase
+from django.test import override_settings
+from django.urls import reverse
+
+from posts.models import Group, Post, User
+
+from ..asgi import ASGIHandler, ResponseAborted, wsgi_environ
+
+TIMEOUT = 5
+
+
+def http_scope(path, method='GET', query_string=b'', headers=()):
+    return {'type': 'http', 'method': method, 'path': path,
+            'query_string': query_string, 'headers': list(headers),
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 5000)}
+
+
+async def call(application, scope, body=b''):
+    """Запрос к приложению ASGI: (статус, заголовки, тело)."""
+    messages = [{'type': 'http.request', 'body': body}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(TIMEOUT)
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    await asyncio.wait_for(application(scope, receive, send), TIMEOUT)
+    start = sent[0]
+    body = b''.join(message.get('body', b'') for message in sent[1:])
+    return start['status'], dict(start['headers']), body
+
+
+class WSGIEnvironTest(SimpleTestCase):
+    def test_environ(self):
+        """Путь, строка запроса и заголовки переводятся в environ."""
+        body = io.BytesIO(b'text=1')
+        environ = wsgi_environ(http_scope(
+            '/group/кот/', method='POST', query_string=b'page=2',
+            headers=[(b'content-type', b'application/x-www-form-urlencoded'),
+                     (b'content-length', b'6'),
+                     (b'accept', b'text/html'),
+                     (b'accept', b'*/*')]), body)
+        self.assertEqual(environ['REQUEST_METHOD'], 'POST')
+        self.assertEqual(environ['PATH_INFO'].encode('latin-1').decode(),
+                         '/group/кот/')
+        self.assertEqual(environ['QUERY_STRING'], 'page=2')
+        self.assertEqual(environ['CONTENT_LENGTH'], '6')
+        self.assertEqual(environ['CONTENT_TYPE'],
+                         'application/x-www-form-urlencoded')
+        self.assertEqual(environ['HTTP_ACCEPT'], 'text/html,*/*')
+        self.assertEqual(environ['REMOTE_ADDR'], '127.0.0.1')
+        self.assertIs(environ['wsgi.input'], body)
+
+
+@override_settings(ASGI_RESPONSE_BUFFER=10)
+class ASGIHandlerStreamingTest(SimpleTestCase):
+    def test_request_body_and_mounts(self):
+        """Тело запроса доходит до WSGI-приложения, а пути под
+        префиксом отдаются смонтированному приложению."""
+        def echo(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [environ['wsgi.input'].read()]
+
+        async def mounted(scope, receive, send):
+            await send({'type': 'http.response.start', 'status': 204,
+                        'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        handler = ASGIHandler(echo, mounts={'/live/': mounted}, threads=2)
+        self.assertEqual(
+            asyncio.run(call(handler, http_scope('/', 'POST'), b'data')),
+            (200, {b'content-type': b'text/plain'}, b'data'))
+        self.assertEqual(
+            asyncio.run(call(handler, http_scope('/live/index/'))),
+            (204, {}, b''))
+
+    def test_backpressure_and_disconnect(self):
+        """Поток ждёт отставшего клиента и останавливается, когда
+        клиент уходит."""
+        produced = []
+        closed = threading.Event()
+
+        def endless():
+            try:
+                while True:
+                    produced.append(1)
+                    yield b'0123456789'
+            finally:
+                closed.set()
+
+        def application(environ, start_response):
+            start_response('200 OK', [])
+            return endless()
+
+        async def scenario():
+            handler = ASGIHandler(application, threads=1)
+            disconnected = asyncio.Event()
+            requested = []
+
+            async def receive():
+                if not requested:
+                    requested.append(1)
+                    return {'type': 'http.request', 'body': b''}
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message.get('body'):
+                    # Клиент не читает дальше первой части
+                    await asyncio.sleep(0.05)
+                    self.assertLessEqual(len(produced), 3)
+                    disconnected.set()
+
+            await asyncio.wait_for(handler(http_scope('/'), receive, send),
+                                   TIMEOUT)
+
+        asyncio.run(scenario())
+        self.assertTrue(closed.wait(TIMEOUT))
+
+    def test_error_before_response(self):
+        """Ошибка до начала ответа превращается в 500."""
+        def broken(environ, start_response):
+            raise RuntimeError('сломалось')
+
+        handler = ASGIHandler(broken, threads=1)
+        with self.assertLogs('core.asgi', 'ERROR'):
+            status, _, _ = asyncio.run(call(handler, http_scope('/')))
+        self.assertEqual(status, 500)
+
+    def test_error_after_response_start(self):
+        """Ошибка после начала ответа обрывает соединение, а не
+        завершает обрезанный ответ."""
+        def broken():
+            yield b'part'
+            raise RuntimeError('сломалось')
+
+        def application(environ, start_response):
+            start_response('200 OK', [])
+            return broken()
+
+        handler = ASGIHandler(application, threads=1)
+        requested = []
+        sent = []
+
+        async def receive():
+            if not requested:
+                requested.append(1)
+                return {'type': 'http.request', 'body': b''}
+            await asyncio.sleep(TIMEOUT)
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        with self.assertLogs('core.asgi', 'ERROR'):
+            with self.assertRaises(ResponseAborted):
+                asyncio.run(asyncio.wait_for(
+                    handler(http_scope('/'), receive, send), TIMEOUT))
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertTrue(all(message.get('more_body')
+                            for message in sent[1:]))
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=10,
+                       IMAGE_UPLOAD_MAX_SIZE=20)
+    def test_body_size_limit(self):
+        """Тело больше предела получает 413 и не доходит до
+        представления; для multipart предел больше на размер картинки."""
+        called = []
+
+        def application(environ, start_response):
+            called.append(1)
+            start_response('200 OK', [])
+            return [b'ok']
+
+        handler = ASGIHandler(application, threads=1)
+        status, _, _ = asyncio.run(call(
+            handler, http_scope('/', 'POST'), b'x' * 11))
+        self.assertEqual(status, 413)
+        self.assertFalse(called)
+        multipart = [(b'content-type', b'multipart/form-data; boundary=b')]
+        status, _, _ = asyncio.run(call(
+            handler, http_scope('/', 'POST', headers=multipart), b'x' * 30))
+        self.assertEqual(status, 200)
+        status, _, _ = asyncio.run(call(
+            handler, http_scope('/', 'POST', headers=multipart), b'x' * 31))
+        self.assertEqual(status, 413)
+        self.assertEqual(len(called), 1)
+
+
+class ASGIHandlerViewsTest(TransactionTestCase):
+    # С SQLITE_PRODUCTION чтение вне транзакции уходит на реплики
+    databases = {'default', *settings.DATABASE_READ_REPLICAS}
+
+    def test_feed_pages(self):
+        """Ленты и страница поста отдаются через пул потоков, в том
+        числе одновременно."""
+        author = User.objects.create_user(username='author')
+        group = Group.objects.create(title='Группа', slug='group',
+                                     description='Описание')
+        post = Post.objects.create(text='Пост под ASGI', author=author,
+                                   group=group)
+        handler = ASGIHandler(get_wsgi_application(), threads=4)
+        urls = (reverse('posts:index'),
+                reverse('posts:group_list', args=[group.slug]),
+                reverse('posts:profile', args=[author.username]),
+                reverse('posts:post_detail', args=[post.id]))
+
+        async def scenario():
+            return await asyncio.gather(*(
+                call(handler, http_scope(url)) for url in urls))
+
+        for url, (status, headers, body) in zip(urls,
+                                                asyncio.run(scenario())):
+            with self.subTest(url=url):
+                self.assertEqual(status, 200)
+                self.assertIn(b'text/html', headers[b'content-type'])
+                self.assertIn('Пост под ASGI', body.decode())
+        handler.executor.shutdown()
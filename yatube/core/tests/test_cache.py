@@ -0,0 +1,83 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from ..cache import SQLiteCache
+
+TEMP_CACHE_DIR = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+def make_cache(name, **options):
+    return SQLiteCache(os.path.join(TEMP_CACHE_DIR, name),
+                       {'OPTIONS': options})
+
+
+def increment_many(name, times):
+    cache = make_cache(name)
+    for _ in range(times):
+        cache.incr('counter')
+
+
+class SQLiteCacheTest(SimpleTestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_CACHE_DIR, ignore_errors=True)
+
+    def setUp(self):
+        self.cache = make_cache(f'{self._testMethodName}.sqlite3')
+
+    def test_basic_operations(self):
+        """Кэш хранит, отдаёт, добавляет и удаляет значения."""
+        self.cache.set('key', {'value': 1})
+        self.assertEqual(self.cache.get('key'), {'value': 1})
+        self.assertFalse(self.cache.add('key', 'other'))
+        self.assertTrue(self.cache.add('new', 'value'))
+        self.cache.set_many({'a': 1, 'b': 2})
+        self.assertEqual(self.cache.get_many(['a', 'b', 'missing']),
+                         {'a': 1, 'b': 2})
+        self.cache.delete('a')
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.set('expired', 1, timeout=-1)
+        self.assertFalse(self.cache.has_key('expired'))
+        self.cache.clear()
+        self.assertEqual(self.cache.totals(), {'entries': 0, 'size': 0})
+
+    def test_lru_eviction_by_entries(self):
+        """При переполнении вытесняются давно не читанные записи."""
+        cache = make_cache('lru.sqlite3', MAX_ENTRIES=4, CULL_FREQUENCY=4)
+        for number in range(4):
+            cache.set(f'key{number}', number)
+        cache._connection.execute(
+            "UPDATE cache SET accessed = 0 WHERE key LIKE '%key0'")
+        cache.set('key4', 4)
+        self.assertIsNone(cache.get('key0'))
+        self.assertEqual(cache.get('key4'), 4)
+        self.assertEqual(cache.totals()['entries'], 4)
+
+    def test_size_cap(self):
+        """Суммарный размер записей не превышает MAX_SIZE."""
+        cache = make_cache('size.sqlite3', MAX_SIZE=10000)
+        for number in range(20):
+            cache.set(f'key{number}', b'x' * 1000)
+        self.assertLessEqual(cache.totals()['size'], 10000)
+        self.assertIsNotNone(cache.get('key19'))
+
+    def test_incr_is_atomic_across_processes(self):
+        """incr не теряет обновления при записи из нескольких процессов."""
+        self.cache.set('counter', 0)
+        name = f'{self._testMethodName}.sqlite3'
+        workers = [multiprocessing.Process(target=increment_many,
+                                           args=(name, 50))
+                   for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.cache.get('counter'), 200)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
@@ -0,0 +1,112 @@
+import os
+import runpy
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from posts.models import Follow, Post, User
+
+from ..db import ReadReplicaRouter, set_sqlite_pragmas
+
+PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL',
+           'cache_size': -4096, 'mmap_size': 2 ** 20}
+
+
+@override_settings(SQLITE_PRODUCTION=True, SQLITE_PRAGMAS=PRAGMAS,
+                   DATABASE_READ_REPLICAS=['replica0'])
+class SQLitePragmasTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def connect(self, alias, name):
+        primary = connections['default']
+        settings_dict = dict(primary.settings_dict,
+                             NAME=os.path.join(self.directory, name))
+        wrapper = type(primary)(settings_dict, alias=alias)
+        wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        return wrapper.connection.execute(f'PRAGMA {name}').fetchone()[0]
+
+    def test_primary_pragmas(self):
+        """Новое соединение получает прагмы из SQLITE_PRAGMAS."""
+        primary = self.connect('default', 'primary.sqlite3')
+        self.assertEqual(self.pragma(primary, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(primary, 'synchronous'), 1)
+        self.assertEqual(self.pragma(primary, 'cache_size'), -4096)
+        self.assertEqual(self.pragma(primary, 'query_only'), 0)
+
+    def test_replica_is_query_only(self):
+        replica = self.connect('replica0', 'replica.sqlite3')
+        self.assertEqual(self.pragma(replica, 'query_only'), 1)
+        self.assertEqual(self.pragma(replica, 'journal_mode'), 'delete')
+
+    @override_settings(SQLITE_PRODUCTION=False)
+    def test_disabled(self):
+        primary = self.connect('default', 'plain.sqlite3')
+        set_sqlite_pragmas(None, primary)
+        self.assertEqual(self.pragma(primary, 'journal_mode'), 'delete')
+
+
+@override_settings(DATABASE_READ_REPLICAS=['replica0', 'replica1'])
+class ReadReplicaRouterTest(TransactionTestCase):
+    def setUp(self):
+        self.router = ReadReplicaRouter()
+
+    def test_feed_reads_go_to_replicas(self):
+        self.assertIn(self.router.db_for_read(Post), ('replica0', 'replica1'))
+        self.assertEqual(self.router.db_for_read(Follow), 'default')
+        self.assertEqual(self.router.db_for_write(Post), 'default')
+        self.assertFalse(self.router.allow_migrate('replica0', 'posts'))
+        self.assertTrue(self.router.allow_migrate('default', 'posts'))
+
+    def test_reads_inside_transaction_use_primary(self):
+        """В транзакции чтение идёт в default: реплика не видит
+        незафиксированных записей."""
+        with transaction.atomic():
+            self.assertEqual(self.router.db_for_read(Post), 'default')
+
+    def test_relations_between_replica_and_primary(self):
+        author = User(username='author')
+        author._state.db = 'replica1'
+        post = Post(text='Пост')
+        post._state.db = 'default'
+        self.assertTrue(self.router.allow_relation(author, post))
+        post._state.db = 'archive'
+        self.assertIsNone(self.router.allow_relation(author, post))
+
+    @override_settings(DATABASE_READ_REPLICAS=[])
+    def test_without_replicas(self):
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+
+
+class ProductionSettingsTest(SimpleTestCase):
+    def load(self, value):
+        previous = os.environ.get('SQLITE_PRODUCTION')
+        os.environ['SQLITE_PRODUCTION'] = value
+        try:
+            return runpy.run_path(
+                os.path.join(settings.BASE_DIR, 'yatube', 'settings.py'))
+        finally:
+            if previous is None:
+                del os.environ['SQLITE_PRODUCTION']
+            else:
+                os.environ['SQLITE_PRODUCTION'] = previous
+
+    def test_switched_by_environment(self):
+        """SQLITE_PRODUCTION=1 подключает реплики и маршрутизатор."""
+        production = self.load('1')
+        self.assertTrue(production['SQLITE_PRODUCTION'])
+        self.assertEqual(production['DATABASE_READ_REPLICAS'], ['replica0'])
+        self.assertIn('replica0', production['DATABASES'])
+        self.assertEqual(production['DATABASE_ROUTERS'],
+                         ['core.db.ReadReplicaRouter'])
+        plain = self.load('')
+        self.assertFalse(plain['SQLITE_PRODUCTION'])
+        self.assertNotIn('DATABASE_ROUTERS', plain)
@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from posts.models import Post
+
+from .. import metrics
+
+TEMP_METRICS_DIR = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+User = get_user_model()
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+        Post.objects.create(text='Тестовый пост', author=cls.user)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_METRICS_DIR, ignore_errors=True)
+
+    def setUp(self):
+        metrics.reset()
+        shutil.rmtree(TEMP_METRICS_DIR, ignore_errors=True)
+        self.client = Client(HTTP_AUTHORIZATION='Bearer secret')
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_views_db_and_cache_reported(self):
+        """Запросы, время ответа, SQL и кэш лент учитываются
+        по имени URL."""
+        self.client.get(reverse('posts:index'))
+        self.client.get(reverse('posts:index'))
+        self.client.get(reverse('about:author'))
+        text = self.scrape()
+        self.assertIn('yatube_http_requests_total{view="posts:index",'
+                      'method="GET",status="200"} 2', text)
+        self.assertIn('yatube_http_request_duration_seconds_bucket'
+                      '{view="about:author",le="+Inf"} 1', text)
+        self.assertIn('yatube_db_queries_total{view="posts:index"}', text)
+        self.assertIn('yatube_feed_cache_requests_total{result="miss"}',
+                      text)
+        self.assertIn('yatube_feed_cache_hit_ratio', text)
+        self.assertIn('yatube_active_sessions 0', text)
+
+    def test_forbidden_without_token(self):
+        """Без токена метрики закрыты, в том числе для localhost
+        (так выглядят все запросы за прокси на том же хосте)."""
+        for client in (Client(REMOTE_ADDR='127.0.0.1'),
+                       Client(HTTP_AUTHORIZATION='Bearer wrong')):
+            with self.subTest(headers=client.defaults):
+                self.assertEqual(client.get('/metrics').status_code, 403)
+
+    def test_staff_and_allowed_addresses(self):
+        staff = User.objects.create_user(username='admin', is_staff=True)
+        self.client = Client()
+        self.client.force_login(staff)
+        self.scrape()
+        with self.settings(METRICS_ALLOWED_IPS=('10.0.0.1',)):
+            response = Client(REMOTE_ADDR='10.0.0.1').get('/metrics')
+        self.assertEqual(response.status_code, 200)
+
+    def test_finished_thread_shards_merged(self):
+        """Шард завершившегося потока сливается с общими значениями
+        процесса и удаляется."""
+        worker = threading.Thread(target=metrics.inc,
+                                  args=('yatube_db_queries_total', (), 2))
+        worker.start()
+        worker.join()
+        self.assertEqual(
+            metrics.local_snapshot()[('yatube_db_queries_total', ())], 2)
+        self.assertNotIn(worker, metrics._shards)
+
+    @override_settings(METRICS_DIR=TEMP_METRICS_DIR)
+    def test_snapshots_of_other_processes_merged(self):
+        """Снимки других процессов из METRICS_DIR складываются
+        со своими значениями."""
+        metrics.inc('yatube_db_queries_total', (('view', 'posts:index'),), 3)
+        metrics.observe('yatube_thumbnail_render_seconds', 0.02)
+        metrics.dump()
+        # Снимок «другого» воркера
+        os.rename(metrics._path(), metrics._path('1-other'))
+        values = metrics.collect()
+        self.assertEqual(
+            values[('yatube_db_queries_total', (('view', 'posts:index'),))],
+            6)
+        self.assertEqual(
+            values[('yatube_thumbnail_render_seconds', ())][-1], 2)
+
+    @override_settings(METRICS_DIR=TEMP_METRICS_DIR, METRICS_STALE_AFTER=60)
+    def test_stale_snapshots_removed(self):
+        """Снимок, который давно не обновлялся, удаляется и не
+        учитывается."""
+        metrics.inc('yatube_db_queries_total', (), 3)
+        metrics.dump()
+        stale = metrics._path('2-stale')
+        os.rename(metrics._path(), stale)
+        old = time.time() - 120
+        os.utime(stale, (old, old))
+        metrics.reset()
+        self.assertNotIn(('yatube_db_queries_total', ()), metrics.collect())
+        self.assertFalse(os.path.exists(stale))
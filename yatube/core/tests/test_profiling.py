@@ -0,0 +1,92 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from posts.models import Post
+
+from .. import profiling
+
+TEMP_PROFILING_DIR = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+User = get_user_model()
+
+
+@override_settings(PROFILING_ENABLED=True,
+                   PROFILING_DIR=TEMP_PROFILING_DIR)
+class ProfilingMiddlewareTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+        cls.staff = User.objects.create_user(username='staff',
+                                             is_staff=True)
+        Post.objects.create(text='Тестовый пост', author=cls.user)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_PROFILING_DIR, ignore_errors=True)
+
+    def setUp(self):
+        profiling.reset()
+        self.staff_client = Client()
+        self.staff_client.force_login(self.staff)
+
+    def test_view_time_split_into_sections(self):
+        """Время запроса разбито на SQL, шаблон и остальной код."""
+        Client().get(reverse('posts:index'))
+        stats = profiling.aggregate()['views']['posts:index']
+        self.assertEqual(stats['requests'], 1)
+        self.assertGreater(stats['queries'], 0)
+        self.assertGreater(stats['sections_ms']['sql'], 0)
+        self.assertGreater(stats['sections_ms']['template'], 0)
+        self.assertEqual(sum(stats['histogram']), 1)
+        self.assertLessEqual(
+            sum(stats['sections_ms'].values()) + stats['python_ms'],
+            stats['total_ms'] + 0.001)
+
+    def test_duplicate_queries_detected(self):
+        """Повтор запроса с теми же параметрами считается дублем."""
+        with profiling.profile_request() as profile:
+            with connection.execute_wrapper(
+                    profiling.QueryRecorder(profile)):
+                for post_id in (1, 1, 2):
+                    list(Post.objects.filter(pk=post_id))
+        self.assertEqual(profile.query_count, 3)
+        self.assertEqual(profile.duplicates, 1)
+        self.assertIn('posts_post', profile.most_duplicated())
+
+    def test_stats_endpoint_staff_only(self):
+        url = reverse('core:profiling')
+        response = Client().get(url)
+        self.assertEqual(response.status_code, 302)
+        Client().get(reverse('posts:index'))
+        response = self.staff_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('posts:index', response.json()['views'])
+
+    def test_profile_on_header_for_staff(self):
+        """Персонал получает cProfile по заголовку X-Profile
+        и Server-Timing."""
+        response = Client().get(reverse('posts:index'), HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile', response)
+        response = self.staff_client.get(reverse('posts:index'),
+                                         HTTP_X_PROFILE='1')
+        self.assertTrue(os.path.exists(os.path.join(
+            TEMP_PROFILING_DIR, 'profiles', response['X-Profile'])))
+        self.assertIn('sql;dur=', response['Server-Timing'])
+
+    def test_flush_writes_json_lines(self):
+        Client().get(reverse('posts:index'))
+        profiling.flush()
+        with open(os.path.join(TEMP_PROFILING_DIR,
+                               'profiling.jsonl')) as log:
+            snapshot = json.loads(log.readlines()[-1])
+        self.assertIn('posts:index', snapshot['views'])
@@ -1,4 +1,13 @@
+import hmac
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.sessions.models import Session
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
 from django.shortcuts import render
+from django.utils import timezone
+
+from . import metrics, profiling
 
 
 def page_not_found(request, exception):
@@ -15,3 +24,46 @@ def permission_denied(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html', status=403)
+
+
+@staff_member_required
+def profiling_stats(request):
+    """Статистика профилирования представлений в этом процессе."""
+    return JsonResponse(profiling.aggregate(),
+                        json_dumps_params={'ensure_ascii': False})
+
+
+def _metrics_token_valid(request):
+    if not settings.METRICS_TOKEN:
+        return False
+    scheme, _, token = request.META.get(
+        'HTTP_AUTHORIZATION', '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(
+        token.strip().encode(), settings.METRICS_TOKEN.encode())
+
+
+def metrics_view(request):
+    """Метрики всех процессов в текстовом формате Prometheus.
+
+    Доступны персоналу, по заголовку Authorization: Bearer METRICS_TOKEN
+    и с адресов METRICS_ALLOWED_IPS (по умолчанию таких нет).
+    """
+    if not (request.user.is_staff or _metrics_token_valid(request)
+            or request.META.get('REMOTE_ADDR')
+            in settings.METRICS_ALLOWED_IPS):
+        return HttpResponseForbidden()
+    values = metrics.collect()
+    hits = sum(value for (name, labels), value in values.items()
+               if name == 'yatube_feed_cache_requests_total'
+               and ('result', 'hit') in labels)
+    lookups = sum(value for (name, labels), value in values.items()
+                  if name == 'yatube_feed_cache_requests_total')
+    gauges = (
+        ('yatube_feed_cache_hit_ratio',
+         'Доля попаданий в кэш фрагментов лент.',
+         hits / lookups if lookups else 0.0),
+        ('yatube_active_sessions', 'Неистёкшие сессии.',
+         Session.objects.filter(expire_date__gt=timezone.now()).count()),
+    )
+    return HttpResponse(metrics.render(values, gauges),
+                        content_type='text/plain; version=0.0.4')
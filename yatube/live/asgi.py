@@ -0,0 +1,16 @@
+"""Точка входа ASGI только для потоков событий, например:
+
+    uvicorn live.asgi:application
+
+Обычные страницы при этом обслуживает WSGI-сервер.
+"""
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+django.setup()
+
+from .sse import LiveEventsApp  # noqa: E402
+
+application = LiveEventsApp()
@@ -0,0 +1,74 @@
+"""Подписки на события в памяти процесса.
+
+Подписчик - SSE-соединение: очередь asyncio и набор каналов. Каналы
+называются как области posts.feed_cache: 'all', 'group:<id>',
+'author:<id>' и 'post:<id>'. Все подписчики живут в одном цикле
+событий: простаивающее соединение - это ожидающая корутина и пустая
+очередь, без потока и без запросов к БД.
+"""
+import threading
+from collections import defaultdict, namedtuple
+
+Event = namedtuple('Event', 'id name channels data')
+
+
+class Subscription:
+    def __init__(self, queue, channels):
+        self.queue = queue
+        self.channels = channels
+        # Клиент не успевает читать: соединение закрывается, и клиент
+        # догоняет пропущенное по Last-Event-ID
+        self.overflowed = False
+
+
+class Broker:
+    def __init__(self):
+        self.loop = None
+        self._channels = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, queue, channels):
+        subscription = Subscription(queue, frozenset(channels))
+        with self._lock:
+            for channel in subscription.channels:
+                self._channels[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._channels.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._channels[channel]
+
+    def has_subscribers(self):
+        return bool(self._channels)
+
+    def dispatch(self, event):
+        """Кладёт событие в очереди подписчиков его каналов. Вызывается
+        в потоке цикла событий."""
+        with self._lock:
+            subscribers = set().union(*(
+                self._channels.get(channel, ()) for channel in event.channels))
+        for subscription in subscribers:
+            if subscription.overflowed:
+                continue
+            if subscription.queue.full():
+                subscription.overflowed = True
+                # Будим читателя, чтобы он закрыл соединение
+                subscription.queue.get_nowait()
+                subscription.queue.put_nowait(None)
+                continue
+            subscription.queue.put_nowait(event)
+
+    def publish(self, event):
+        """Раздаёт событие из любого потока. Без запущенного цикла
+        событий (процесс WSGI) ничего не делает."""
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self.dispatch, event)
+
+
+broker = Broker()
@@ -0,0 +1,90 @@
+"""События о новых постах и комментариях.
+
+Сигналы вызывают emit() после фиксации транзакции: событие
+записывается в LiveEvent для других процессов и сразу раздаётся
+подписчикам этого процесса через broker.
+"""
+import json
+import os
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from .broker import Event, broker
+from .models import LiveEvent
+
+HOST = socket.gethostname()
+REPLAY_LIMIT = 500
+
+
+def origin():
+    # pid вычисляется при каждом вызове: воркеры создаются fork()
+    return f'{HOST}:{os.getpid()}'
+
+
+def post_event(post):
+    channels = ['all', f'author:{post.author_id}']
+    if post.group_id is not None:
+        channels.append(f'group:{post.group_id}')
+    data = {
+        'id': post.id,
+        'author': post.author.username,
+        'group': post.group_id,
+        'url': reverse('posts:post_detail', args=[post.id]),
+    }
+    return 'post', channels, data
+
+
+def comment_event(comment):
+    data = {
+        'id': comment.id,
+        'post': comment.post_id,
+        'author': comment.author.username,
+        'parent': comment.parent_id,
+        'depth': comment.depth,
+    }
+    return 'comment', [f'post:{comment.post_id}'], data
+
+
+def emit(name, channels, data):
+    transaction.on_commit(lambda: _send(name, channels, data))
+
+
+def _send(name, channels, data):
+    row = LiveEvent.objects.create(
+        name=name, channels=' '.join(channels),
+        data=json.dumps(data, ensure_ascii=False), origin=origin())
+    broker.publish(_event(row.id, name, row.channels, row.data))
+
+
+def _event(event_id, name, channels, data):
+    return Event(event_id, name, frozenset(channels.split()), data)
+
+
+def last_id():
+    return LiveEvent.objects.order_by('-id').values_list(
+        'id', flat=True).first() or 0
+
+
+def since(event_id, channels=None, foreign_only=False):
+    """События с id больше event_id по возрастанию id: для повтора
+    пропущенного (channels) или для моста между процессами
+    (foreign_only - только чужие)."""
+    rows = LiveEvent.objects.filter(id__gt=event_id).order_by('id')
+    if foreign_only:
+        rows = rows.exclude(origin=origin())
+    events = [_event(*row) for row in rows.values_list(
+        'id', 'name', 'channels', 'data')[:REPLAY_LIMIT]]
+    if channels is not None:
+        events = [event for event in events if event.channels & channels]
+    return events
+
+
+def prune():
+    """Удаляет события старше LIVE_EVENT_TTL секунд."""
+    border = timezone.now() - timedelta(seconds=settings.LIVE_EVENT_TTL)
+    return LiveEvent.objects.filter(created__lt=border).delete()[0]
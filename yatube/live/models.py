@@ -0,0 +1,21 @@
+from django.db import models
+
+
+class LiveEvent(models.Model):
+    """Событие для SSE-подписчиков других процессов.
+
+    Процесс, в котором сработал сигнал, раздаёт событие своим
+    подписчикам сразу, а остальные процессы читают новые строки
+    по id (см. live.sse). Старые строки удаляет тот же опрос.
+    """
+    name = models.CharField(max_length=20)
+    # Каналы через пробел: 'all group:1 author:2'
+    channels = models.CharField(max_length=255)
+    data = models.TextField()
+    # Процесс-источник, чтобы не раздавать своё событие повторно
+    origin = models.CharField(max_length=100)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Событие'
+        verbose_name_plural = 'События'
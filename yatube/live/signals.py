@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from posts.models import Comment, Post
+
+from . import events
+
+
+@receiver(post_save, sender=Post)
+def announce_post(sender, instance, created, **kwargs):
+    if created and settings.LIVE_EVENTS_ENABLED:
+        events.emit(*events.post_event(instance))
+
+
+@receiver(post_save, sender=Comment)
+def announce_comment(sender, instance, created, **kwargs):
+    if (created and settings.LIVE_EVENTS_ENABLED
+            and instance.post_id is not None):
+        events.emit(*events.comment_event(instance))
@@ -0,0 +1,255 @@
+"""ASGI-приложение Server-Sent Events.
+
+Потоки событий (относительно LIVE_URL):
+
+    index/              новые посты
+    group/<slug>/       новые посты сообщества
+    follow/             новые посты авторов, на которых подписан
+                        пользователь (по сессии)
+    post/<id>/          новые комментарии поста
+
+Все соединения обслуживает один цикл событий: соединение ждёт своей
+очереди в broker и раз в LIVE_HEARTBEAT секунд шлёт комментарий, по
+которому прокси и клиент видят, что оно живо. К БД обращаются только
+открытие потока (в пуле потоков) и общий для процесса опрос LiveEvent
+раз в LIVE_POLL_INTERVAL секунд, который приносит события других
+процессов.
+"""
+import asyncio
+import json
+import logging
+import re
+import time
+from http.cookies import SimpleCookie
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import close_old_connections
+from django.http import HttpRequest
+
+from posts.models import Follow, Group, Post
+
+from . import events
+from .broker import broker
+
+logger = logging.getLogger(__name__)
+
+STREAMS = re.compile(
+    r'^(?:(?P<index>index)|group/(?P<slug>[-\w]+)|(?P<follow>follow)'
+    r'|post/(?P<post_id>\d+))/$')
+# Через сколько миллисекунд браузер переподключается после обрыва
+RETRY_MS = 3000
+PRUNE_INTERVAL = 60
+
+
+class StreamError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _user_id(cookie_header):
+    """id пользователя по cookie сессии или None."""
+    cookies = SimpleCookie()
+    cookies.load(cookie_header)
+    morsel = cookies.get(settings.SESSION_COOKIE_NAME)
+    if morsel is None:
+        return None
+    request = HttpRequest()
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore(
+        morsel.value)
+    user = get_user(request)
+    return user.id if user.is_authenticated else None
+
+
+def resolve_channels(path, cookie_header=''):
+    """Каналы потока path. Читает БД, выполняется в пуле потоков."""
+    match = STREAMS.match(path)
+    if match is None:
+        raise StreamError(404, 'Не найдено.')
+    if match['index']:
+        return {'all'}
+    if match['slug']:
+        group_id = Group.objects.filter(slug=match['slug']).values_list(
+            'id', flat=True).first()
+        if group_id is None:
+            raise StreamError(404, 'Не найдено.')
+        return {f'group:{group_id}'}
+    if match['post_id']:
+        post_id = int(match['post_id'])
+        if not Post.objects.filter(id=post_id).exists():
+            raise StreamError(404, 'Не найдено.')
+        return {f'post:{post_id}'}
+    user_id = _user_id(cookie_header)
+    if user_id is None:
+        raise StreamError(401, 'Нужна авторизация.')
+    # Подписки, сделанные после открытия потока, попадут в него
+    # при переподключении
+    authors = Follow.objects.filter(user_id=user_id).values_list(
+        'author_id', flat=True)
+    return {f'author:{author_id}' for author_id in authors}
+
+
+def _db_call(func, *args):
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def run_db(func, *args):
+    """Выполняет синхронную работу с БД в пуле потоков цикла."""
+    return await asyncio.get_running_loop().run_in_executor(
+        None, _db_call, func, *args)
+
+
+def format_event(event):
+    return (f'id: {event.id}\nevent: {event.name}\n'
+            f'data: {event.data}\n\n').encode()
+
+
+class LiveEventsApp:
+    """ASGI 3 приложение потоков событий."""
+
+    def __init__(self, prefix=None):
+        self.prefix = prefix if prefix is not None else settings.LIVE_URL
+        self._poller = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        self.attach(asyncio.get_running_loop())
+        path = scope['path']
+        if not path.startswith(self.prefix):
+            await self.error(send, 404, 'Не найдено.')
+            return
+        if scope['method'] not in ('GET', 'HEAD'):
+            await self.error(send, 405, 'Метод не поддерживается.')
+            return
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                   for name, value in scope.get('headers', ())}
+        try:
+            channels = await run_db(resolve_channels,
+                                    path[len(self.prefix):],
+                                    headers.get('cookie', ''))
+        except StreamError as error:
+            await self.error(send, error.status, str(error))
+            return
+        last_event_id = headers.get('last-event-id', '')
+        await self.stream(send, receive, channels,
+                          int(last_event_id) if last_event_id.isdigit()
+                          else None)
+
+    def attach(self, loop):
+        """Привязывает broker к циклу событий и запускает опрос."""
+        if broker.loop is not loop:
+            broker.loop = loop
+            self._poller = None
+        if self._poller is None or self._poller.done():
+            self._poller = loop.create_task(self.poll())
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.attach(asyncio.get_running_loop())
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._poller is not None:
+                    self._poller.cancel()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def poll(self):
+        """Мост между процессами: новые чужие строки LiveEvent."""
+        last_id = await run_db(events.last_id)
+        pruned = time.monotonic()
+        while True:
+            await asyncio.sleep(settings.LIVE_POLL_INTERVAL)
+            try:
+                if broker.has_subscribers():
+                    found = await run_db(events.since, last_id, None, True)
+                    for event in found:
+                        broker.dispatch(event)
+                        last_id = event.id
+                else:
+                    last_id = await run_db(events.last_id)
+                if time.monotonic() - pruned > PRUNE_INTERVAL:
+                    pruned = time.monotonic()
+                    await run_db(events.prune)
+            except Exception:
+                logger.exception('Не удалось прочитать события')
+
+    async def error(self, send, status, message):
+        body = json.dumps({'detail': message}, ensure_ascii=False).encode()
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type',
+                                 b'application/json; charset=utf-8'),
+                                (b'content-length',
+                                 str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def stream(self, send, receive, channels, last_event_id):
+        queue = asyncio.Queue(settings.LIVE_QUEUE_SIZE)
+        # Подписка до повтора пропущенного: события между ними попадут
+        # в очередь, уже повторённые отбрасываются по id
+        subscription = broker.subscribe(queue, channels)
+        disconnect = asyncio.ensure_future(self.wait_disconnect(receive))
+        getter = None
+        try:
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [
+                            (b'content-type',
+                             b'text/event-stream; charset=utf-8'),
+                            (b'cache-control', b'no-cache'),
+                            (b'x-accel-buffering', b'no'),
+                        ]})
+            await send({'type': 'http.response.body', 'more_body': True,
+                        'body': f'retry: {RETRY_MS}\n\n'.encode()})
+            # Свои события процесс раздаёт сразу, а чужие - после опроса,
+            # поэтому живые события приходят не по порядку id: повтором
+            # считается только то, что не новее отправленного из БД
+            replayed_id = 0
+            if last_event_id is not None:
+                missed = await run_db(events.since, last_event_id, channels)
+                for event in missed:
+                    await self.send_event(send, event)
+                    replayed_id = event.id
+            while True:
+                if getter is None:
+                    getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait(
+                    {getter, disconnect},
+                    timeout=settings.LIVE_HEARTBEAT,
+                    return_when=asyncio.FIRST_COMPLETED)
+                if disconnect in done:
+                    return
+                if getter not in done:
+                    await send({'type': 'http.response.body',
+                                'body': b': ping\n\n', 'more_body': True})
+                    continue
+                event, getter = getter.result(), None
+                if event is None or subscription.overflowed:
+                    break
+                if event.id > replayed_id:
+                    await self.send_event(send, event)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            broker.unsubscribe(subscription)
+            for future in (getter, disconnect):
+                if future is not None:
+                    future.cancel()
+
+    async def send_event(self, send, event):
+        await send({'type': 'http.response.body', 'more_body': True,
+                    'body': format_event(event)})
+
+    async def wait_disconnect(self, receive):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
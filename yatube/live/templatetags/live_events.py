@@ -0,0 +1,18 @@
+from django import template
+from django.conf import settings
+
+register = template.Library()
+
+
+@register.inclusion_tag('live/events.html')
+def live_events(stream, *args):
+    """Баннер о новых постах или комментариях потока stream:
+    {% live_events 'index' %}, {% live_events 'group' group.slug %},
+    {% live_events 'follow' %}, {% live_events 'post' post.id %}."""
+    if not settings.LIVE_EVENTS_ENABLED:
+        return {'url': None}
+    path = '/'.join(str(part) for part in (stream, *args))
+    return {
+        'url': f'{settings.LIVE_URL}{path}/',
+        'event': 'comment' if stream == 'post' else 'post',
+    }
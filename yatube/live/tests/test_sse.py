@@ -0,0 +1,221 @@
+import asyncio
+import json
+
+from django.conf import settings
+from django.test import Client, TestCase, TransactionTestCase
+from django.test import override_settings
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post, User
+
+from ..broker import Event, broker
+from ..models import LiveEvent
+from ..sse import LiveEventsApp
+
+TIMEOUT = 5
+
+
+class StreamClient:
+    """Одно SSE-соединение с приложением, запущенное в текущем цикле."""
+
+    def __init__(self, app, path, headers=()):
+        self.incoming = asyncio.Queue()
+        self.sent = asyncio.Queue()
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': settings.LIVE_URL + path,
+            'headers': [(name.encode(), value.encode())
+                        for name, value in headers],
+        }
+        self.task = asyncio.ensure_future(
+            app(scope, self.incoming.get, self.sent.put))
+        self.buffer = b''
+
+    async def receive(self):
+        return await asyncio.wait_for(self.sent.get(), TIMEOUT)
+
+    async def start(self):
+        """Ждёт заголовков ответа и первой строки тела."""
+        start = await self.receive()
+        if start['status'] == 200:
+            await self.receive()
+        return start
+
+    async def event(self):
+        """Следующее событие (не комментарий-пинг): (id, имя, данные)."""
+        while b'\n\n' not in self.buffer:
+            message = await self.receive()
+            self.buffer += message['body']
+        chunk, self.buffer = self.buffer.split(b'\n\n', 1)
+        fields = dict(line.split(': ', 1)
+                      for line in chunk.decode().splitlines()
+                      if not line.startswith(':'))
+        if 'event' not in fields:
+            return await self.event()
+        return int(fields['id']), fields['event'], json.loads(fields['data'])
+
+    async def close(self):
+        await self.incoming.put({'type': 'http.disconnect'})
+        await asyncio.wait_for(self.task, TIMEOUT)
+
+
+@override_settings(LIVE_EVENTS_ENABLED=True, LIVE_POLL_INTERVAL=0.01)
+class LiveEventsTest(TransactionTestCase):
+    # С SQLITE_PRODUCTION чтение вне транзакции уходит на реплики
+    databases = {'default', *settings.DATABASE_READ_REPLICAS}
+
+    def setUp(self):
+        self.app = LiveEventsApp()
+        self.author = User.objects.create_user(username='author')
+        self.group = Group.objects.create(title='Группа', slug='group',
+                                          description='Описание')
+
+    def run_async(self, coroutine):
+        return asyncio.run(coroutine)
+
+    def test_new_post_delivered(self):
+        """Новый пост приходит в потоки ленты, сообщества и подписок,
+        но не в поток чужого сообщества."""
+        reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=reader, author=self.author)
+        other = Group.objects.create(title='Другая', slug='other',
+                                     description='Описание')
+        browser = Client()
+        browser.force_login(reader)
+        cookie = (f'{settings.SESSION_COOKIE_NAME}='
+                  f'{browser.cookies[settings.SESSION_COOKIE_NAME].value}')
+
+        async def scenario():
+            streams = [
+                StreamClient(self.app, 'index/'),
+                StreamClient(self.app, 'group/group/'),
+                StreamClient(self.app, 'follow/', [('cookie', cookie)]),
+            ]
+            silent = StreamClient(self.app, 'group/other/')
+            for stream in (*streams, silent):
+                self.assertEqual((await stream.start())['status'], 200)
+            post = Post.objects.create(text='Пост', author=self.author,
+                                       group=self.group)
+            for stream in streams:
+                _, name, data = await stream.event()
+                self.assertEqual(name, 'post')
+                self.assertEqual(data['id'], post.id)
+                self.assertEqual(data['author'], 'author')
+                await stream.close()
+            Post.objects.create(text='Другой', author=reader, group=other)
+            _, _, data = await silent.event()
+            self.assertEqual(data['author'], 'reader')
+            await silent.close()
+
+        self.run_async(scenario())
+
+    def test_new_comment_delivered(self):
+        """Комментарий приходит в поток своего поста."""
+        post = Post.objects.create(text='Пост', author=self.author)
+
+        async def scenario():
+            stream = StreamClient(self.app, f'post/{post.id}/')
+            await stream.start()
+            comment = Comment.objects.create(post=post, author=self.author,
+                                             text='Комментарий')
+            _, name, data = await stream.event()
+            self.assertEqual(name, 'comment')
+            self.assertEqual(data['id'], comment.id)
+            self.assertEqual(data['post'], post.id)
+            await stream.close()
+
+        self.run_async(scenario())
+
+    def test_foreign_events_bridged(self):
+        """Событие другого процесса доходит через опрос LiveEvent."""
+        async def scenario():
+            stream = StreamClient(self.app, 'index/')
+            await stream.start()
+            # Опрос запоминает последний id при запуске
+            await asyncio.sleep(0.1)
+            row = LiveEvent.objects.create(
+                name='post', channels='all author:99',
+                data=json.dumps({'id': 99}), origin='other-host:1')
+            event_id, name, data = await stream.event()
+            self.assertEqual((event_id, name, data), (row.id, 'post',
+                                                      {'id': 99}))
+            await stream.close()
+
+        self.run_async(scenario())
+
+    def test_foreign_event_after_newer_local(self):
+        """Чужое событие с меньшим id, пришедшее после своего более
+        нового, не теряется."""
+        async def scenario():
+            stream = StreamClient(self.app, 'index/')
+            await stream.start()
+            await asyncio.sleep(0.1)
+            broker.publish(Event(10, 'post', frozenset({'all'}),
+                                 json.dumps({'id': 10})))
+            self.assertEqual((await stream.event())[0], 10)
+            LiveEvent.objects.create(
+                id=9, name='post', channels='all',
+                data=json.dumps({'id': 9}), origin='other-host:1')
+            self.assertEqual(await stream.event(), (9, 'post', {'id': 9}))
+            await stream.close()
+
+        self.run_async(scenario())
+
+    def test_last_event_id_replay(self):
+        """После переподключения поток повторяет пропущенные события
+        своих каналов."""
+        first = Post.objects.create(text='Первый', author=self.author)
+        seen = LiveEvent.objects.get().id
+        Post.objects.create(text='Вне группы', author=self.author)
+        missed = Post.objects.create(text='Второй', author=self.author,
+                                     group=self.group)
+
+        async def scenario():
+            stream = StreamClient(self.app, 'group/group/',
+                                  [('last-event-id', str(seen))])
+            await stream.start()
+            _, _, data = await stream.event()
+            self.assertEqual(data['id'], missed.id)
+            await stream.close()
+
+        self.assertEqual(first.id + 2, missed.id)
+        self.run_async(scenario())
+
+    def test_errors(self):
+        """Поток подписок требует входа, неизвестные потоки - 404."""
+        async def scenario():
+            for path, status in (('follow/', 401),
+                                 ('group/missing/', 404),
+                                 ('post/12345/', 404),
+                                 ('unknown/', 404)):
+                with self.subTest(path=path):
+                    stream = StreamClient(self.app, path)
+                    self.assertEqual((await stream.start())['status'],
+                                     status)
+                    await stream.task
+
+        self.run_async(scenario())
+
+    @override_settings(LIVE_EVENTS_ENABLED=False)
+    def test_disabled(self):
+        """Без LIVE_EVENTS_ENABLED события не записываются."""
+        post = Post.objects.create(text='Пост', author=self.author)
+        Comment.objects.create(post=post, author=self.author, text='Текст')
+        self.assertFalse(LiveEvent.objects.exists())
+
+
+class LiveEventsTemplateTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.group = Group.objects.create(title='Группа', slug='group',
+                                         description='Описание')
+
+    def test_banner(self):
+        """Страница ленты подключается к своему потоку, если живые
+        обновления включены."""
+        url = reverse('posts:group_list', args=[self.group.slug])
+        self.assertNotContains(self.client.get(url), 'EventSource')
+        with self.settings(LIVE_EVENTS_ENABLED=True):
+            response = self.client.get(url)
+        self.assertContains(response, "EventSource('/live/group/group/')")
@@ -1,5 +1,6 @@
 from django.contrib import admin
 
+from . import search
 from .models import Post, Group, Comment, Follow
 
 
@@ -23,6 +24,13 @@ class PostAdmin(admin.ModelAdmin):
     # Добавляем возможность фильтрации по дате
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
+
+    def get_search_results(self, request, queryset, search_term):
+        # Ищем по полнотекстовому индексу (posts.search), а не LIKE
+        # по search_fields; сами search_fields включают поле поиска.
+        if not search_term.strip():
+            return queryset, False
+        return search.filter_posts(queryset, search_term), False
 # При регистрации модели Post источником конфигурации для неё назначаем
 # класс PostAdmin
 
@@ -0,0 +1,39 @@
+"""Массовая загрузка данных в обход сигналов.
+
+bulk_create не отправляет post_save, поэтому после него производные
+данные - ленты подписок, счётчики, поисковый индекс, пути веток
+комментариев и оценки популярности - пересобираются функцией
+refresh_derived().
+"""
+from contextlib import contextmanager
+
+from . import counters, feeds, search, threads, trending
+
+
+@contextmanager
+def auto_now_disabled(model, *field_names):
+    """Позволяет bulk_create сохранить явные значения полей с auto_now
+    и auto_now_add (например, исходные даты публикации)."""
+    fields = [model._meta.get_field(name) for name in field_names]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def refresh_derived():
+    """Пересобирает ленты, счётчики и поисковый индекс, заполняет пути
+    веток комментариев и оценивает новые посты. Существующие оценки
+    популярности не пересчитываются: trending.rebuild() потерял бы вклад
+    подписок."""
+    return {
+        'comment_paths': threads.rebuild(),
+        'feed_entries': feeds.rebuild(),
+        'counters': counters.reconcile(),
+        'search': search.rebuild(),
+        'trending': trending.score_unscored(),
+    }
@@ -0,0 +1,143 @@
+"""Условные GET-запросы к публичным страницам постов.
+
+До вызова представления валидатор одним запросом по индексу читает
+последнюю запись страницы (пост ленты, комментарий) и всё, что ещё
+выводится на странице (счётчики автора), а из posts.feed_cache берёт
+поколения её областей: их сдвигают сигналы при правке и удалении, чего
+не видно по последней записи. Из этого получаются ETag и
+Last-Modified; при совпадении с If-None-Match / If-Modified-Since
+ответ 304 отдаётся без выборки постов и отрисовки шаблона.
+
+Поколения сдвигаются только в кэше FEED_CACHE_ALIAS процесса, который
+обработал правку. Если этот кэш у каждого процесса свой, другой воркер
+подтвердил бы 304 устаревшую копию, поэтому условные запросы
+включаются, только когда кэш общий (или явно - CONDITIONAL_GET).
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.utils.cache import (get_conditional_response,
+                                patch_cache_control, patch_vary_headers)
+from django.utils.http import http_date
+
+from . import feed_cache
+from .models import Comment, Group, Post, User
+
+
+def enabled():
+    if settings.CONDITIONAL_GET is not None:
+        return settings.CONDITIONAL_GET
+    return feed_cache.shared()
+
+
+def _newest(queryset, date_field):
+    """Подзапросы к дате и id последней записи queryset."""
+    queryset = queryset.order_by(f'-{date_field}', '-id')
+    return {'newest_date': Subquery(queryset.values(date_field)[:1]),
+            'newest_id': Subquery(queryset.values('id')[:1])}
+
+
+def _validators(request, scopes, modified, *parts):
+    """ETag и Last-Modified страницы.
+
+    modified - даты изменения содержимого, известные из БД; к ним
+    добавляется время поколений scopes.
+    """
+    if request.user.is_authenticated:
+        # На страницах есть блок «Кого почитать» пользователя
+        scopes = [*scopes, f'follow:{request.user.id}']
+    generations = feed_cache.generations(scopes)
+    times = [value for value in modified if value is not None]
+    times.extend(map(feed_cache.generation_time, generations))
+    user = request.user
+    # Залогиненному пользователю страница показывает его имя и формы
+    # с CSRF-токеном: его копия не должна совпасть с чужой
+    viewer = ((user.id, request.COOKIES.get(settings.CSRF_COOKIE_NAME))
+              if user.is_authenticated else None)
+    raw = '|'.join(map(str, (request.path, sorted(request.GET.lists()),
+                             viewer, *generations, *parts)))
+    etag = '"{}"'.format(hashlib.md5(raw.encode()).hexdigest())
+    return etag, max(times)
+
+
+def index_validators(request):
+    newest = Post.objects.order_by('-pub_date', '-id').values_list(
+        'pub_date', 'id').first() or (None, None)
+    return _validators(request, ['all'], [newest[0]], *newest)
+
+
+def group_validators(request, slug):
+    posts = Post.objects.filter(group=OuterRef('pk'))
+    row = Group.objects.filter(slug=slug).annotate(
+        **_newest(posts, 'pub_date')).values_list(
+        'id', 'newest_date', 'newest_id').first()
+    if row is None:
+        return None
+    group_id, pub_date, post_id = row
+    return _validators(request, [f'group:{group_id}'], [pub_date],
+                       pub_date, post_id)
+
+
+def profile_validators(request, username):
+    posts = Post.objects.filter(author=OuterRef('pk'))
+    row = User.objects.filter(username=username).annotate(
+        **_newest(posts, 'pub_date')).values_list(
+        'id', 'newest_date', 'newest_id', 'stats__posts_count',
+        'stats__followers_count', 'stats__following_count').first()
+    if row is None:
+        return None
+    author_id, pub_date, *parts = row
+    return _validators(request, [f'author:{author_id}'], [pub_date],
+                       pub_date, *parts)
+
+
+def post_detail_validators(request, post_id):
+    comments = Comment.objects.filter(post=OuterRef('pk'))
+    row = Post.objects.filter(id=post_id).annotate(
+        **_newest(comments, 'created')).values_list(
+        'author_id', 'pub_date', 'newest_date', 'newest_id').first()
+    if row is None:
+        return None
+    author_id, pub_date, created, comment_id = row
+    return _validators(
+        request, [f'post:{post_id}', f'author:{author_id}'],
+        [pub_date, created], created, comment_id)
+
+
+def conditional_page(validators):
+    """Декоратор представления: 304 по ETag/Last-Modified и заголовки
+    кэширования для прокси.
+
+    Если validators вернул None (объекта нет), представление
+    вызывается как обычно и само отвечает 404.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or not enabled():
+                return view(request, *args, **kwargs)
+            result = validators(request, *args, **kwargs)
+            if result is None:
+                return view(request, *args, **kwargs)
+            etag, last_modified = result
+            response = get_conditional_response(
+                request, etag=etag,
+                last_modified=int(last_modified.timestamp()))
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+            if request.user.is_authenticated:
+                patch_cache_control(response, private=True, no_cache=True)
+            else:
+                patch_cache_control(
+                    response, public=True,
+                    max_age=settings.PUBLIC_PAGE_MAX_AGE)
+            patch_vary_headers(response, ('Cookie',))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,98 @@
+"""Денормализованные счётчики постов, комментариев и подписок.
+
+Счётчики меняются атомарным UPDATE ... SET x = x ± 1 из сигналов, так
+что страницы профиля и поста не выполняют COUNT(*). reconcile()
+пересчитывает все счётчики одним UPDATE на таблицу.
+"""
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 500
+
+
+def _model(apps, name):
+    return apps.get_model('posts', name)
+
+
+def bump(queryset, field, delta):
+    """Меняет счётчик на delta, не опуская его ниже нуля."""
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    return queryset.update(**{field: F(field) + delta})
+
+
+def bump_user(user_id, field, delta):
+    UserStats = _model(global_apps, 'UserStats')
+    stats = UserStats.objects.filter(user_id=user_id)
+    if not bump(stats, field, delta) and delta > 0:
+        # строки ещё нет (пользователь создан до появления счётчиков)
+        UserStats.objects.get_or_create(user_id=user_id)
+        bump(stats, field, delta)
+
+
+def bump_group(group_id, delta):
+    if group_id is not None:
+        Group = _model(global_apps, 'Group')
+        bump(Group.objects.filter(pk=group_id), 'posts_count', delta)
+
+
+def bump_post(post_id, delta):
+    Post = _model(global_apps, 'Post')
+    bump(Post.objects.filter(pk=post_id), 'comments_count', delta)
+
+
+def _count(queryset, field):
+    """Коррелированный подзапрос COUNT(*) с группировкой по field."""
+    counted = (queryset.filter(**{field: OuterRef('pk')})
+               .order_by().values(field)
+               .annotate(count=Count('pk')).values('count'))
+    return Coalesce(Subquery(counted, output_field=IntegerField()), 0)
+
+
+def _repair(queryset, **counts):
+    """Обновляет разошедшиеся счётчики, возвращает число исправленных
+    строк."""
+    actual = {f'actual_{name}': value for name, value in counts.items()}
+    drifted = queryset.annotate(**actual).exclude(
+        **{name: F(f'actual_{name}') for name in counts})
+    drift_pks = list(drifted.values_list('pk', flat=True))
+    for start in range(0, len(drift_pks), BATCH_SIZE):
+        queryset.filter(
+            pk__in=drift_pks[start:start + BATCH_SIZE]).update(**counts)
+    return len(drift_pks)
+
+
+def reconcile(apps=global_apps):
+    """Пересчитывает все счётчики по данным и возвращает словарь
+    {модель: число исправленных строк}."""
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    Post = _model(apps, 'Post')
+    Group = _model(apps, 'Group')
+    Comment = _model(apps, 'Comment')
+    Follow = _model(apps, 'Follow')
+    UserStats = _model(apps, 'UserStats')
+
+    missing = User.objects.filter(stats__isnull=True).values_list(
+        'pk', flat=True)
+    UserStats.objects.bulk_create(
+        (UserStats(user_id=pk) for pk in missing.iterator()),
+        batch_size=BATCH_SIZE, ignore_conflicts=True,
+    )
+    return {
+        'UserStats': _repair(
+            UserStats.objects.all(),
+            posts_count=_count(Post.objects.all(), 'author'),
+            followers_count=_count(Follow.objects.all(), 'author'),
+            following_count=_count(Follow.objects.all(), 'user'),
+        ),
+        'Group': _repair(
+            Group.objects.all(),
+            posts_count=_count(Post.objects.all(), 'group'),
+        ),
+        'Post': _repair(
+            Post.objects.all(),
+            comments_count=_count(Comment.objects.all(), 'post'),
+        ),
+    }
@@ -0,0 +1,133 @@
+"""Кэш фрагментов лент с инвалидацией по поколениям.
+
+Ключ фрагмента складывается из имени представления, номера страницы
+или курсора и поколений областей, от которых лента зависит: 'all',
+'group:<id>', 'author:<id>', 'follow:<user_id>', 'post:<id>'. Сигналы
+Post/Comment/Follow меняют поколение затронутых областей, и старые
+фрагменты просто перестают запрашиваться - угадывать TTL не нужно.
+"""
+import hashlib
+import itertools
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from core import metrics
+
+from .models import Follow
+
+GENERATION_KEY = 'feed:gen:{}'
+FRAGMENT_KEY = 'feed:fragment:{}'
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+_sequence = itertools.count()
+
+
+def get_cache():
+    return caches[settings.FEED_CACHE_ALIAS]
+
+
+def shared():
+    """Видны ли поколения всем процессам: LocMemCache живёт в памяти
+    одного процесса, DummyCache ничего не хранит."""
+    return not isinstance(get_cache(), (LocMemCache, DummyCache))
+
+
+def _new_generation():
+    # Время в наносекундах не повторяется после перезапуска процесса,
+    # поэтому потерянное поколение не «оживит» старые фрагменты.
+    return f'{time.time_ns():x}.{next(_sequence):x}'
+
+
+def generation_time(generation):
+    """Момент создания поколения: не раньше последнего изменения
+    области, поэтому годится для Last-Modified."""
+    nanoseconds = int(generation.split('.', 1)[0], 16)
+    return datetime.fromtimestamp(nanoseconds / 10 ** 9, tz=timezone.utc)
+
+
+def generations(scopes):
+    """Текущие поколения областей; недостающие создаются."""
+    cache = get_cache()
+    keys = [GENERATION_KEY.format(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    missing = {key: _new_generation() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        found.update(missing)
+    return [found[key] for key in keys]
+
+
+def invalidate(*scopes):
+    """Сдвигает поколения областей одним обращением к кэшу."""
+    if scopes:
+        get_cache().set_many(
+            {GENERATION_KEY.format(scope): _new_generation()
+             for scope in scopes},
+            timeout=None,
+        )
+
+
+def post_scopes(post, *group_ids, followers=True):
+    """Области всех лент, где показан пост (followers=False - без лент
+    подписчиков автора, не обращаясь к БД)."""
+    scopes = ['all', f'author:{post.author_id}', f'post:{post.id}']
+    scopes.extend(f'group:{group_id}'
+                  for group_id in {post.group_id, *group_ids}
+                  if group_id is not None)
+    if followers:
+        user_ids = Follow.objects.filter(
+            author_id=post.author_id).values_list('user_id', flat=True)
+        scopes.extend(f'follow:{user_id}' for user_id in user_ids)
+    return scopes
+
+
+def invalidate_post(post, *group_ids):
+    """Сдвигает поколения всех лент, где показан пост."""
+    invalidate(*post_scopes(post, *group_ids))
+
+
+def make_key(view, request, *scopes):
+    """Ключ фрагмента для страницы ленты."""
+    parts = [view, request.GET.get('page', ''),
+             request.GET.get('cursor', '')]
+    parts.extend(generations(scopes))
+    digest = hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest()
+    return FRAGMENT_KEY.format(digest)
+
+
+def get_fragment(key):
+    value = get_cache().get(key)
+    hit = value is not None
+    with _stats_lock:
+        _stats['hits' if hit else 'misses'] += 1
+    metrics.inc('yatube_feed_cache_requests_total',
+                (('result', 'hit' if hit else 'miss'),))
+    return value
+
+
+def set_fragment(key, value):
+    get_cache().set(key, value, settings.FEED_CACHE_TIMEOUT)
+
+
+def stats():
+    """Попадания и промахи кэша лент в текущем процессе."""
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / total if total else 0.0,
+    }
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.update(hits=0, misses=0)
@@ -0,0 +1,106 @@
+"""Запросы лент и материализованная лента подписок (fan-out on write).
+
+Для каждого подписчика хранится строка FeedEntry(user, post, pub_date),
+поэтому страница /follow/ читается одним диапазоном по индексу
+(user, -pub_date) вместо соединения Post с Follow на каждый запрос.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+from .models import FeedEntry, Follow, Post
+
+BATCH_SIZE = 500
+
+
+def index_feed():
+    """Посты главной страницы."""
+    return Post.objects.select_related('author', 'group')
+
+
+def group_feed(group):
+    """Посты сообщества."""
+    return Post.objects.select_related('author', 'group').filter(
+        group=group)
+
+
+def profile_feed(author):
+    """Посты автора."""
+    return Post.objects.select_related('author', 'group').filter(
+        author=author)
+
+
+def follow_feed(user):
+    """Посты ленты подписок пользователя в порядке ленты."""
+    return (Post.objects.select_related('author', 'group')
+            .filter(feed_entries__user=user)
+            .annotate(feed_pub_date=F('feed_entries__pub_date'),
+                      feed_post_id=F('feed_entries__post'))
+            .order_by('-feed_pub_date', '-feed_post_id'))
+
+
+def fan_out(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    followers = Follow.objects.filter(
+        author_id=post.author_id).values_list('user_id', flat=True)
+    FeedEntry.objects.bulk_create(
+        (FeedEntry(user_id=user_id, post_id=post.id, pub_date=post.pub_date)
+         for user_id in followers.iterator()),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту пользователя посты автора, на которого он
+    подписался. Глубину ограничивает settings.FEED_BACKFILL_LIMIT."""
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date').values_list('id', 'pub_date')
+    limit = settings.FEED_BACKFILL_LIMIT
+    if limit is not None:
+        posts = posts[:limit]
+    FeedEntry.objects.bulk_create(
+        (FeedEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+         for post_id, pub_date in posts.iterator()),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def trim(user_id, author_id):
+    """Убирает из ленты пользователя посты автора после отписки."""
+    FeedEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id).delete()
+
+
+def rebuild(user_ids=None):
+    """Пересобирает ленты целиком одним INSERT ... SELECT.
+
+    Возвращает число записей в пересобранных лентах.
+    """
+    entries = FeedEntry._meta.db_table
+    follows = Follow._meta.db_table
+    posts = Post._meta.db_table
+    where, params = '', []
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return 0
+        where = 'WHERE f.user_id IN ({})'.format(
+            ', '.join(['%s'] * len(user_ids)))
+        params = user_ids
+    with transaction.atomic():
+        if user_ids is None:
+            FeedEntry.objects.all().delete()
+        else:
+            FeedEntry.objects.filter(user_id__in=user_ids).delete()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {entries} (user_id, post_id, pub_date) '
+                f'SELECT f.user_id, p.id, p.pub_date '
+                f'FROM {follows} f '
+                f'INNER JOIN {posts} p ON p.author_id = f.author_id '
+                f'{where}',
+                params,
+            )
+            return cursor.rowcount
@@ -1,6 +1,8 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 from django.utils.translation import gettext_lazy as _
 
+from . import threads, uploads
 from .models import Post, Comment
 
 
@@ -25,11 +27,32 @@ class PostForm(forms.ModelForm):
             'text': forms.Textarea(attrs={'cols': 79, 'rows': 10}),
         }
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        # Уже сохранённую картинку при редактировании не трогаем
+        if isinstance(image, UploadedFile):
+            return uploads.process(image)
+        return image
+
 
 class CommentForm(forms.ModelForm):
+    """Комментарий или ответ на комментарий parent того же поста.
+
+    Родитель передаётся аргументом, а не полем формы: его выбирает
+    кнопка «Ответить», а не пользователь в форме.
+    """
+
     class Meta:
         model = Comment
         fields = ('text',)
         labels = {
             'text': _('Текст комментария'),
         }
+
+    def __init__(self, *args, parent=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.parent = parent
+
+    def save(self, commit=True):
+        self.instance.parent = threads.reply_parent(self.parent)
+        return super().save(commit)
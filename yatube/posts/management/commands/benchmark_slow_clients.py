@@ -0,0 +1,172 @@
+import asyncio
+import io
+import json
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.urls import reverse
+
+from core.asgi import ASGIHandler, wsgi_environ
+from posts.models import Group, Post, User
+
+from .benchmark_views import PAGES, percentile
+
+MODES = ('wsgi', 'asgi')
+
+
+def request_scope(url):
+    path, _, query = url.partition('?')
+    return {'type': 'http', 'method': 'GET', 'path': path,
+            'query_string': query.encode(), 'headers': [],
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 0)}
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность страниц лент при множестве '
+            'медленных клиентов: WSGI (поток занят до последнего байта '
+            'ответа) и ASGI из core.asgi (поток занят только '
+            'представлением). Клиент читает ответ со скоростью --rate, '
+            'оба режима получают одинаковое число потоков.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1000,
+                            help='одновременных клиентов')
+        parser.add_argument('--threads', type=int,
+                            default=settings.ASGI_THREADS)
+        parser.add_argument(
+            '--rate', type=int, default=64 * 1024,
+            help='скорость чтения клиента, байт в секунду')
+        parser.add_argument('--chunk-size', type=int, default=8 * 1024,
+                            help='размер записи в сокет')
+        parser.add_argument('--modes', nargs='+', choices=MODES,
+                            default=MODES)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='файл для результатов JSON')
+
+    def handle(self, *args, **options):
+        self.rate = options['rate']
+        self.chunk_size = options['chunk_size']
+        urls = self.sample(random.Random(options['seed']),
+                           options['clients'])
+        application = get_wsgi_application()
+        self.started = time.perf_counter()
+        # Прогрев кэшей: оба режима получают одинаково тёплые страницы
+        for url in set(urls):
+            self.serve_wsgi(application, url, rate=None)
+        results = {}
+        for mode in options['modes']:
+            # Все клиенты приходят одновременно: время ответа считается
+            # от старта, вместе с ожиданием свободного потока
+            self.started = time.perf_counter()
+            timings = getattr(self, f'run_{mode}')(application, urls,
+                                                  options['threads'])
+            elapsed = time.perf_counter() - self.started
+            results[mode] = {
+                'seconds': round(elapsed, 3),
+                'pages_per_second': round(len(urls) / elapsed, 1),
+                'p50_ms': round(percentile(timings, 0.5) * 1000, 1),
+                'p99_ms': round(percentile(timings, 0.99) * 1000, 1),
+                'mean_ms': round(statistics.mean(timings) * 1000, 1),
+            }
+            self.stdout.write(
+                f'{mode}  {results[mode]["pages_per_second"]:8.1f} '
+                f'страниц/с  p50 {results[mode]["p50_ms"]:9.1f} мс  '
+                f'p99 {results[mode]["p99_ms"]:9.1f} мс')
+        if options['output']:
+            report = {
+                'options': {name: options[name] for name in (
+                    'clients', 'threads', 'rate', 'chunk_size')},
+                'modes': results,
+            }
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+                output.write('\n')
+
+    def sample(self, randomizer, count):
+        """Адреса страниц лент и постов, по одному на клиента."""
+        groups = list(Group.objects.values_list('slug', flat=True)[:50])
+        authors = list(User.objects.filter(posts__isnull=False)
+                       .values_list('username', flat=True).distinct()[:50])
+        posts = list(Post.objects.values_list('pk', flat=True)[:50])
+        if not (groups and posts):
+            raise CommandError('Нет данных: запустите seed_data.')
+        urls = []
+        for _ in range(count):
+            page = f'?page={randomizer.choice(PAGES)}'
+            urls.append(randomizer.choice((
+                reverse('posts:index') + page,
+                reverse('posts:group_list',
+                        args=[randomizer.choice(groups)]) + page,
+                reverse('posts:profile',
+                        args=[randomizer.choice(authors)]) + page,
+                reverse('posts:post_detail',
+                        args=[randomizer.choice(posts)]),
+            )))
+        return urls
+
+    def parts(self, body):
+        """Размеры записей в сокет, которыми уходит body."""
+        for offset in range(0, len(body), self.chunk_size):
+            yield min(self.chunk_size, len(body) - offset)
+
+    def serve_wsgi(self, application, url, rate):
+        """Запрос, как его обслуживает поток WSGI-сервера: поток
+        пишет ответ в сокет, пока клиент не прочитает всё."""
+        statuses = []
+        response = application(
+            wsgi_environ(request_scope(url), io.BytesIO()),
+            lambda status, headers, exc_info=None: statuses.append(status))
+        try:
+            for body in response:
+                for size in self.parts(body) if rate else ():
+                    time.sleep(size / rate)
+        finally:
+            response.close()
+        if not statuses[0].startswith('200'):
+            raise CommandError(f'{url}: {statuses[0]}')
+        return time.perf_counter() - self.started
+
+    def run_wsgi(self, application, urls, threads):
+        with ThreadPoolExecutor(threads) as executor:
+            return list(executor.map(
+                lambda url: self.serve_wsgi(application, url, self.rate),
+                urls))
+
+    def run_asgi(self, application, urls, threads):
+        handler = ASGIHandler(application, threads=threads)
+
+        async def client(url):
+            requested = []
+            statuses = []
+
+            async def receive():
+                if not requested:
+                    requested.append(True)
+                    return {'type': 'http.request', 'body': b''}
+                # Клиент не уходит, пока не прочитает ответ
+                await asyncio.get_running_loop().create_future()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+                    return
+                for size in self.parts(message.get('body', b'')):
+                    await asyncio.sleep(size / self.rate)
+
+            await handler(request_scope(url), receive, send)
+            if statuses[0] != 200:
+                raise CommandError(f'{url}: {statuses[0]}')
+            return time.perf_counter() - self.started
+
+        async def clients():
+            return await asyncio.gather(*(client(url) for url in urls))
+
+        try:
+            return asyncio.run(clients())
+        finally:
+            handler.executor.shutdown()
@@ -0,0 +1,113 @@
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from posts import transfer
+from posts.models import Post
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Замеряет скорость import_posts и export_posts (постов в '
+            'секунду) на синтетическом наборе. Все изменения БД '
+            'откатываются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=200000)
+        parser.add_argument('--authors', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=100)
+        parser.add_argument('--format', choices=transfer.FORMATS,
+                            default='ndjson')
+        parser.add_argument('--chunk-size', type=int,
+                            default=transfer.CHUNK_SIZE)
+        parser.add_argument(
+            '--defer-indexes', action='store_true',
+            help='снимать индексы постов на время импорта')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--min-rate', type=float, default=0,
+            help='ошибка, если импорт медленнее стольких постов в секунду')
+        parser.add_argument('--output', help='файл для результатов JSON')
+
+    def handle(self, *args, **options):
+        descriptor, path = tempfile.mkstemp(suffix='.' + options['format'])
+        os.close(descriptor)
+        try:
+            self.generate(path, options)
+            try:
+                with transaction.atomic():
+                    results = self.measure(path, options)
+                    raise Rollback
+            except Rollback:
+                pass
+        finally:
+            os.remove(path)
+        self.stdout.write(
+            f'импорт  {results["import_rate"]:10.0f} постов/с\n'
+            f'экспорт {results["export_rate"]:10.0f} постов/с')
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+                output.write('\n')
+        if results['import_rate'] < options['min_rate']:
+            raise CommandError(
+                f'Импорт {results["import_rate"]:.0f} постов/с, '
+                f'нужно не меньше {options["min_rate"]:.0f}')
+
+    def generate(self, path, options):
+        randomizer = random.Random(options['seed'])
+        now = timezone.now()
+        with open(path, 'w', newline='', encoding='utf-8') as output:
+            records = (
+                (f'Пост номер {number} для замера импорта',
+                 f'transfer-bench-{randomizer.randrange(options["authors"])}',
+                 f'transfer-bench-{randomizer.randrange(options["groups"])}'
+                 if randomizer.random() > 0.33 else '',
+                 (now - timedelta(minutes=number)).isoformat(), '')
+                for number in range(options['posts'])
+            )
+            transfer.write_records(output, records, options['format'])
+
+    def measure(self, path, options):
+        importer = transfer.Importer(chunk_size=options['chunk_size'],
+                                     create_authors=True,
+                                     create_groups=True,
+                                     defer_indexes=options['defer_indexes'])
+        started = time.perf_counter()
+        with open(path, newline='', encoding='utf-8') as stream:
+            importer.run(transfer.read_records(stream, options['format']))
+        import_seconds = time.perf_counter() - started
+        if importer.imported != options['posts']:
+            raise CommandError(f'Импортировано {importer.imported} постов '
+                               f'из {options["posts"]}')
+
+        started = time.perf_counter()
+        with open(os.devnull, 'w', newline='',
+                  encoding='utf-8') as output:
+            exported = transfer.write_records(
+                output,
+                transfer.export_records(Post.objects.all(),
+                                        options['chunk_size']),
+                options['format'])
+        export_seconds = time.perf_counter() - started
+        return {
+            'posts': options['posts'],
+            'format': options['format'],
+            'chunk_size': options['chunk_size'],
+            'defer_indexes': options['defer_indexes'],
+            'import_seconds': round(import_seconds, 3),
+            'import_rate': round(importer.imported / import_seconds),
+            'exported': exported,
+            'export_seconds': round(export_seconds, 3),
+            'export_rate': round(exported / export_seconds),
+        }
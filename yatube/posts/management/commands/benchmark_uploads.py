@@ -0,0 +1,110 @@
+import statistics
+import tempfile
+import time
+
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from posts import uploads
+
+CLEAR_REFS = '/proc/self/clear_refs'
+STATUS = '/proc/self/status'
+
+
+def reset_peak_rss():
+    """Сбрасывает пик RSS процесса (Linux 4.0+). Возвращает False,
+    если это не поддерживается."""
+    try:
+        with open(CLEAR_REFS, 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def peak_rss():
+    """Пик RSS процесса в байтах по VmHWM."""
+    with open(STATUS) as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def make_source(megapixels, image_format):
+    """Создаёт на диске картинку нужного размера с EXIF."""
+    width = int((megapixels * 10 ** 6 * 3 / 2) ** 0.5)
+    height = width * 2 // 3
+    source = tempfile.NamedTemporaryFile(suffix=f'.{image_format.lower()}')
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    exif = Image.Exif()
+    exif[0x010F] = 'Benchmark camera'
+    image.save(source, image_format, exif=exif.tobytes())
+    source.flush()
+    return source
+
+
+def as_upload(source, image_format):
+    # Большие загрузки Django держит во временных файлах на диске
+    upload = TemporaryUploadedFile(
+        f'image.{image_format.lower()}', f'image/{image_format.lower()}',
+        0, None)
+    with open(source.name, 'rb') as data:
+        while True:
+            chunk = data.read(2 ** 20)
+            if not chunk:
+                break
+            upload.write(chunk)
+    upload.size = upload.tell()
+    upload.seek(0)
+    return upload
+
+
+def naive(upload):
+    """Прежний путь: полное декодирование и пересохранение."""
+    with Image.open(upload) as image:
+        image.load()
+        image.save(tempfile.TemporaryFile(), image.format)
+
+
+def pipeline(upload):
+    result = uploads.process(upload)
+    result.close()
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время и пиковую память обработки большой '
+            'загруженной картинки: полное декодирование и posts.uploads.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--megapixels', type=float, default=40)
+        parser.add_argument('--format', default='JPEG',
+                            choices=sorted(uploads.OUTPUT_FORMATS))
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, megapixels, format, repeat, **options):
+        source = make_source(megapixels, format)
+        measure_memory = reset_peak_rss()
+        if not measure_memory:
+            self.stderr.write('Пик памяти не измеряется: нет '
+                              f'{CLEAR_REFS}.')
+        self.stdout.write(f'{megapixels:g} Мп, {format}')
+        for name, func in (('naive', naive), ('pipeline', pipeline)):
+            timings, peaks = [], []
+            for _ in range(repeat):
+                upload = as_upload(source, format)
+                if measure_memory:
+                    reset_peak_rss()
+                    baseline = peak_rss()
+                started = time.perf_counter()
+                func(upload)
+                timings.append(time.perf_counter() - started)
+                if measure_memory:
+                    peaks.append(peak_rss() - baseline)
+                upload.close()
+            line = f'{name:9} {statistics.median(timings) * 1000:8.0f} мс'
+            if peaks:
+                line += f' {max(peaks) / 2 ** 20:8.1f} МБ сверх базового RSS'
+            self.stdout.write(line)
+        source.close()
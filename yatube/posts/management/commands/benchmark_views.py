@@ -0,0 +1,178 @@
+import json
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from core.query_budget import count_queries
+from posts.models import Follow, Group, Post, User
+
+VIEWS = ('index', 'group_posts', 'profile', 'post_detail', 'follow_index')
+# Первые страницы лент запрашиваются чаще остальных
+PAGES = (1, 1, 1, 2, 3, 10)
+
+
+def percentile(values, fraction):
+    """Перцентиль методом ближайшего ранга."""
+    ordered = sorted(values)
+    rank = max(int(round(fraction * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Замеряет p50/p99 времени ответа и число SQL-запросов '
+            'страниц постов через тестовый клиент и пишет результат в JSON '
+            'для сравнения между коммитами.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='запросов на каждое представление')
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--views', nargs='+', choices=VIEWS,
+                            default=VIEWS)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--cold-cache', action='store_true',
+            help='очищать кэш перед каждым запросом')
+        parser.add_argument('--output', help='файл для результатов JSON')
+        parser.add_argument(
+            '--baseline',
+            help='JSON предыдущего прогона для сравнения')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.2,
+            help='допустимый рост p50/p99 относительно baseline')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests должно быть не меньше 1')
+        self.random = random.Random(options['seed'])
+        self.cold_cache = options['cold_cache']
+        self.client = Client()
+        self.sample()
+        results = {}
+        for view in options['views']:
+            self.measure(view, options['warmup'])
+            results[view] = self.measure(view, options['requests'])
+            self.stdout.write(
+                f'{view:13} p50 {results[view]["p50_ms"]:8.2f} мс  '
+                f'p99 {results[view]["p99_ms"]:8.2f} мс  '
+                f'запросов {results[view]["queries_max"]}')
+        report = {
+            'revision': git_revision(),
+            'python': sys.version.split()[0],
+            'database': connection.vendor,
+            'dataset': {
+                'users': User.objects.count(),
+                'groups': Group.objects.count(),
+                'posts': Post.objects.count(),
+                'follows': Follow.objects.count(),
+            },
+            'options': {
+                'requests': options['requests'],
+                'cold_cache': self.cold_cache,
+                'pagination_mode': settings.PAGINATION_MODE,
+            },
+            'views': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True,
+                          ensure_ascii=False)
+                output.write('\n')
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    def sample(self):
+        """Выбирает объекты, страницы которых будут запрашиваться."""
+        self.groups = list(Group.objects.values_list('slug', flat=True)[:50])
+        self.authors = list(User.objects.filter(posts__isnull=False)
+                            .values_list('username', flat=True)
+                            .distinct()[:50])
+        self.posts = list(Post.objects.values_list('pk', flat=True)[:50])
+        reader = (User.objects.filter(follower__isnull=False).first()
+                  or User.objects.first())
+        if not (self.posts and reader):
+            raise CommandError('Нет данных: запустите seed_data.')
+        self.client.force_login(reader)
+
+    def url(self, view):
+        page = f'?page={self.random.choice(PAGES)}'
+        if view == 'index':
+            return reverse('posts:index') + page
+        if view == 'group_posts':
+            slug = self.random.choice(self.groups)
+            return reverse('posts:group_list', args=[slug]) + page
+        if view == 'profile':
+            username = self.random.choice(self.authors)
+            return reverse('posts:profile', args=[username]) + page
+        if view == 'post_detail':
+            return reverse('posts:post_detail',
+                           args=[self.random.choice(self.posts)])
+        return reverse('posts:follow_index') + page
+
+    def measure(self, view, count):
+        timings, queries = [], []
+        for _ in range(count):
+            url = self.url(view)
+            if self.cold_cache:
+                for cache in caches.all():
+                    cache.clear()
+            with count_queries() as counter:
+                started = time.perf_counter()
+                response = self.client.get(url)
+                if response.streaming:
+                    # Посты потоковой страницы читаются при отдаче тела
+                    b''.join(response.streaming_content)
+                timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise CommandError(f'{url}: {response.status_code}')
+            queries.append(counter.count)
+        if not timings:
+            return {}
+        return {
+            'requests': count,
+            'p50_ms': round(percentile(timings, 0.5), 3),
+            'p99_ms': round(percentile(timings, 0.99), 3),
+            'mean_ms': round(statistics.mean(timings), 3),
+            'queries_min': min(queries),
+            'queries_max': max(queries),
+        }
+
+    def compare(self, results, path, tolerance):
+        with open(path) as baseline_file:
+            baseline = json.load(baseline_file)['views']
+        regressions = []
+        for view, current in results.items():
+            previous = baseline.get(view)
+            if not previous:
+                continue
+            for metric in ('p50_ms', 'p99_ms'):
+                if current[metric] > previous[metric] * (1 + tolerance):
+                    regressions.append(
+                        f'{view} {metric}: {previous[metric]} -> '
+                        f'{current[metric]}')
+            if current['queries_max'] > previous['queries_max']:
+                regressions.append(
+                    f'{view} queries: {previous["queries_max"]} -> '
+                    f'{current["queries_max"]}')
+        if regressions:
+            raise CommandError('Регрессии относительно baseline:\n'
+                               + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
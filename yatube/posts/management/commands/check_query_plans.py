@@ -0,0 +1,82 @@
+import re
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from posts import feeds, threads, trending
+from posts.models import Comment, Follow, Group, User
+from posts.paginators import CursorPaginator
+
+FULL_SCAN = re.compile(r'^SCAN (TABLE )?\w+$')
+TEMP_SORT = 'USE TEMP B-TREE'
+
+
+def feed_queries():
+    """Запросы, которые выполняют страницы лент: первая страница и
+    переход по курсору."""
+    group, author = Group(pk=0), User(pk=0)
+    queries = {
+        'index': feeds.index_feed(),
+        'group_posts': feeds.group_feed(group),
+        'profile': feeds.profile_feed(author),
+        'follow_index': feeds.follow_feed(author),
+    }
+    for name, post_list in list(queries.items()):
+        ordering = post_list.query.order_by or ('-pub_date', '-id')
+        paginator = CursorPaginator(post_list, settings.PAG_NUM, ordering)
+        position = [timezone.now(), 0]
+        queries[name] = paginator.object_list[:settings.PAG_NUM]
+        queries[f'{name} (cursor)'] = paginator.object_list.filter(
+            paginator.seek(position))[:settings.PAG_NUM + 1]
+    # Страница комментариев (posts.views.comment_page): корни веток
+    # по индексу (post, depth, path), затем их ветки диапазоном путей
+    # по индексу (post, path)
+    path = threads.make_path(0)
+    roots = CursorPaginator(
+        Comment.objects.filter(post_id=0, depth=0).values('path'),
+        settings.COMMENTS_PER_PAGE, ('path',))
+    queries['post_detail comment roots'] = roots.object_list[
+        :settings.COMMENTS_PER_PAGE]
+    queries['post_detail comment roots (cursor)'] = (
+        roots.object_list.filter(roots.seek([path]))[
+            :settings.COMMENTS_PER_PAGE + 1])
+    queries['post_detail threads'] = threads.thread_range(
+        Comment.objects.select_related('author').filter(post_id=0),
+        path, path)
+    queries['trending'] = trending.trending_posts()[
+        :settings.TRENDING_POSTS_SHOWN]
+    queries['trending groups'] = trending.trending_groups()[
+        :settings.TRENDING_GROUPS_SHOWN]
+    queries['fan_out followers'] = Follow.objects.filter(
+        author_id=0).values_list('user_id', flat=True)
+    return queries
+
+
+def explain(queryset):
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+class Command(BaseCommand):
+    help = ('Проверяет планы запросов лент: ни один не должен читать '
+            'таблицу целиком или сортировать во временном B-дереве.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Проверка планов поддерживается только '
+                               'для SQLite.')
+        problems = []
+        for name, queryset in feed_queries().items():
+            plan = explain(queryset)
+            bad = [detail for detail in plan
+                   if FULL_SCAN.match(detail) or TEMP_SORT in detail]
+            status = self.style.ERROR('FAIL') if bad else 'ok'
+            self.stdout.write(f'{status:4} {name}: {"; ".join(plan)}')
+            problems.extend(f'{name}: {detail}' for detail in bad)
+        if problems:
+            raise CommandError(
+                'Запросы без подходящего индекса:\n' + '\n'.join(problems))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from posts import trending
+
+
+class Command(BaseCommand):
+    help = ('Применяет затухание к оценкам популярности и удаляет '
+            'устаревшие; запускается периодически (например, раз в час).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='пересчитать оценки по публикациям и комментариям',
+        )
+
+    def handle(self, *args, rebuild=False, **options):
+        if rebuild:
+            count = trending.rebuild()
+            self.stdout.write(self.style.SUCCESS(
+                f'Оценки пересчитаны, постов: {count}'))
+            return
+        removed = trending.decay()
+        self.stdout.write(self.style.SUCCESS(
+            'Затухание применено, удалено оценок: постов '
+            f'{removed["PostScore"]}, сообществ {removed["GroupScore"]}'))
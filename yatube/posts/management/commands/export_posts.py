@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from posts import transfer
+from posts.models import Post
+
+from .import_posts import guess_format
+
+
+class Command(BaseCommand):
+    help = ('Выгружает посты в NDJSON или CSV в порядке id. Посты '
+            'читаются курсором порциями, поэтому память не зависит от '
+            'их числа.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-',
+                            help='файл или "-" для stdout')
+        parser.add_argument('--format', choices=transfer.FORMATS,
+                            help='по умолчанию - по расширению файла')
+        parser.add_argument('--chunk-size', type=int,
+                            default=transfer.CHUNK_SIZE)
+        parser.add_argument('--author', help='только посты пользователя')
+        parser.add_argument('--group', help='только посты группы (slug)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        posts = Post.objects.all()
+        if options['author']:
+            posts = posts.filter(author__username=options['author'])
+        if options['group']:
+            posts = posts.filter(group__slug=options['group'])
+        records = transfer.export_records(posts, options['chunk_size'])
+        stream = (self.stdout if path == '-'
+                  else open(path, 'w', newline='', encoding='utf-8'))
+        try:
+            count = transfer.write_records(
+                stream, records, guess_format(path, options['format']))
+        finally:
+            if stream is not self.stdout:
+                stream.close()
+        if stream is not self.stdout:
+            self.stdout.write(self.style.SUCCESS(
+                f'Выгружено постов: {count}'))
@@ -0,0 +1,64 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts import thumbnails
+from posts.models import Post
+
+
+def is_missing(name):
+    return any(thumbnails.cached_thumbnail(name, geometry, **options) is None
+               for geometry, options in thumbnails.SIZES)
+
+
+def register(name):
+    for geometry, options in thumbnails.SIZES:
+        thumbnails.cached_thumbnail(name, geometry, **options)
+
+
+class Command(BaseCommand):
+    help = 'Параллельно создаёт недостающие миниатюры картинок постов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='число потоков или процессов',
+        )
+        parser.add_argument(
+            '--processes', action='store_true',
+            help='использовать процессы вместо потоков '
+                 '(декодирование картинок нагружает CPU)',
+        )
+
+    def handle(self, *args, workers, processes, **options):
+        names = (Post.objects.exclude(image='').order_by()
+                 .values_list('image', flat=True).distinct())
+        missing = [name for name in names.iterator() if is_missing(name)]
+        self.stdout.write(f'Недостающих миниатюр: {len(missing)}')
+        if not missing:
+            return
+        if workers <= 1:
+            rendered = list(map(thumbnails.render, missing))
+        else:
+            rendered = self.render_parallel(missing, workers, processes)
+        # Файлы созданы параллельно без обращений к БД, в хранилище
+        # ключей их записывает основной процесс.
+        done = 0
+        for name, ok in zip(missing, rendered):
+            if ok:
+                register(name)
+                done += 1
+        self.stdout.write(self.style.SUCCESS(f'Создано миниатюр: {done}'))
+
+    def render_parallel(self, missing, workers, processes):
+        if processes:
+            # дочерние процессы не должны наследовать открытые соединения
+            connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers)
+        with executor:
+            return list(executor.map(thumbnails.render, missing,
+                                     chunksize=16))
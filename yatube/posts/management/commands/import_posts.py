@@ -0,0 +1,80 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import bulk, transfer
+
+
+def guess_format(path, file_format):
+    if file_format:
+        return file_format
+    return 'csv' if path.endswith('.csv') else 'ndjson'
+
+
+class Command(BaseCommand):
+    help = ('Импортирует посты из NDJSON или CSV (поля text, author, '
+            'group, pub_date, image). Вход читается потоком, посты '
+            'вставляются порциями одним executemany подготовленного '
+            'INSERT, затем пересобираются ленты, счётчики и индекс - '
+            'и после ошибки посреди файла.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-',
+                            help='файл или "-" для stdin')
+        parser.add_argument('--format', choices=transfer.FORMATS,
+                            help='по умолчанию - по расширению файла')
+        parser.add_argument('--chunk-size', type=int,
+                            default=transfer.CHUNK_SIZE)
+        parser.add_argument(
+            '--create-authors', action='store_true',
+            help='создавать отсутствующих пользователей без пароля')
+        parser.add_argument(
+            '--create-groups', action='store_true',
+            help='создавать отсутствующие группы с названием, равным slug')
+        parser.add_argument(
+            '--skip-invalid', action='store_true',
+            help='пропускать ошибочные записи вместо остановки импорта')
+        parser.add_argument(
+            '--defer-indexes', action='store_true',
+            help='снять индексы постов на время импорта и построить их '
+                 'заново в конце (для загрузки большого объёма в пустую '
+                 'базу)')
+        parser.add_argument(
+            '--skip-derived', action='store_true',
+            help='не пересобирать ленты, счётчики и поисковый индекс')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = guess_format(path, options['format'])
+        importer = transfer.Importer(
+            chunk_size=options['chunk_size'],
+            create_authors=options['create_authors'],
+            create_groups=options['create_groups'],
+            skip_invalid=options['skip_invalid'],
+            defer_indexes=options['defer_indexes'])
+        started = time.perf_counter()
+        stream = (sys.stdin if path == '-'
+                  else open(path, newline='', encoding='utf-8'))
+        try:
+            importer.run(transfer.read_records(stream, file_format),
+                         progress=self.progress)
+        except ValueError as error:
+            raise CommandError(
+                f'{error}. Импортировано постов: {importer.imported}')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            elapsed = time.perf_counter() - started
+            self.stdout.write('')
+            # Уже вставленные порции остаются в БД и при ошибке
+            if not options['skip_derived'] and importer.imported:
+                self.stdout.write('Пересборка лент, счётчиков и индекса...')
+                bulk.refresh_derived()
+        rate = importer.imported / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано постов: {importer.imported} '
+            f'({rate:.0f} в секунду), пропущено: {importer.skipped}'))
+
+    def progress(self, importer):
+        self.stdout.write(f'\rПостов: {importer.imported}', ending='')
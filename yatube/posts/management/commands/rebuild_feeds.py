@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from posts import feeds
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает материализованные ленты подписок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', dest='user_ids', type=int, action='append',
+            help='id пользователя; по умолчанию пересобираются все ленты',
+        )
+
+    def handle(self, *args, user_ids=None, **options):
+        count = feeds.rebuild(user_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Лент пересобрано, записей: {count}'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счётчики и исправляет расхождения.'
+
+    def handle(self, *args, **options):
+        for model, fixed in counters.reconcile().items():
+            self.stdout.write(f'{model}: исправлено строк {fixed}')
+        self.stdout.write(self.style.SUCCESS('Счётчики сверены'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from posts import recommendations
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает рекомендации «кого почитать» пользователей '
+            'из очереди после подписок и отписок.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='пересчитать рекомендации всех пользователей',
+        )
+        parser.add_argument(
+            '--top-k', type=int, default=None,
+            help='сколько авторов хранить для пользователя '
+                 '(по умолчанию RECOMMENDATIONS_TOP_K)',
+        )
+
+    def handle(self, *args, full=False, top_k=None, **options):
+        if full:
+            count = recommendations.refresh(k=top_k)
+        else:
+            count = recommendations.refresh_pending(k=top_k)
+        self.stdout.write(self.style.SUCCESS(
+            f'Рекомендации пересчитаны, пользователей: {count}'))
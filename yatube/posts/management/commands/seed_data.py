@@ -0,0 +1,177 @@
+import itertools
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from faker import Faker
+
+from posts import bulk
+from posts.models import Comment, Follow, Group, Post, User
+
+BATCH_SIZE = 5000
+# Тексты берутся из заранее созданного набора: Faker слишком медленный,
+# чтобы вызывать его для каждого из миллионов постов.
+TEXT_POOL = 2000
+
+
+def chunks(iterable, size=BATCH_SIZE):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def power_law_weights(count, alpha):
+    """Накопленные веса распределения Ципфа: k-й по популярности
+    элемент выбирается с вероятностью, пропорциональной 1 / k^alpha."""
+    return list(itertools.accumulate(
+        1 / rank ** alpha for rank in range(1, count + 1)))
+
+
+class Command(BaseCommand):
+    help = ('Заполняет БД большим набором данных для нагрузочных тестов: '
+            'пользователи, группы, посты, комментарии и граф подписок '
+            'со степенным распределением.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=100)
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='среднее число подписок пользователя')
+        parser.add_argument(
+            '--alpha', type=float, default=1.1,
+            help='показатель степенного распределения популярности')
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='за сколько дней распределены даты публикации')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--prefix', default='seed',
+            help='префикс имён пользователей и адресов групп')
+        parser.add_argument(
+            '--skip-derived', action='store_true',
+            help='не пересобирать ленты, счётчики и поисковый индекс')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        Faker.seed(options['seed'])
+        self.fake = Faker('ru_RU')
+        self.alpha = options['alpha']
+        prefix = options['prefix']
+
+        user_ids = self.seed_users(prefix, options['users'])
+        group_ids = self.seed_groups(prefix, options['groups'])
+        post_ids = self.seed_posts(user_ids, group_ids, options['posts'],
+                                   options['days'])
+        self.seed_follows(user_ids, options['follows'])
+        self.seed_comments(user_ids, post_ids, options['comments'])
+        if not options['skip_derived']:
+            self.stdout.write('Пересборка лент, счётчиков и индекса...')
+            derived = bulk.refresh_derived()
+            self.stdout.write(f'Записей лент: {derived["feed_entries"]}')
+        self.stdout.write(self.style.SUCCESS('Данные созданы'))
+
+    def popular(self, population, count):
+        """count элементов population со степенным распределением."""
+        population = list(population)
+        self.random.shuffle(population)
+        weights = power_law_weights(len(population), self.alpha)
+        return self.random.choices(population, cum_weights=weights, k=count)
+
+    def insert(self, model, objects, total):
+        done = 0
+        for chunk in chunks(objects):
+            with transaction.atomic():
+                # Размер одного INSERT выбирает бэкенд БД (у SQLite
+                # ограничено число переменных в запросе)
+                model.objects.bulk_create(chunk, ignore_conflicts=True)
+            done += len(chunk)
+            self.stdout.write(f'\r{model.__name__}: {done}/{total}',
+                              ending='')
+        self.stdout.write('')
+
+    def seed_users(self, prefix, count):
+        names = [(self.fake.first_name(), self.fake.last_name())
+                 for _ in range(min(count, TEXT_POOL))]
+        now = timezone.now()
+        users = (
+            User(username=f'{prefix}{number}',
+                 first_name=first_name, last_name=last_name,
+                 password=f'{UNUSABLE_PASSWORD_PREFIX}{prefix}',
+                 date_joined=now)
+            for number, (first_name, last_name)
+            in zip(range(count), itertools.cycle(names))
+        )
+        self.insert(User, users, count)
+        return list(User.objects.filter(
+            username__startswith=prefix).values_list('pk', flat=True))
+
+    def seed_groups(self, prefix, count):
+        groups = (
+            Group(title=self.fake.catch_phrase()[:200],
+                  slug=f'{prefix}-group-{number}',
+                  description=self.fake.paragraph())
+            for number in range(count)
+        )
+        self.insert(Group, groups, count)
+        return list(Group.objects.filter(
+            slug__startswith=f'{prefix}-group-').values_list('pk', flat=True))
+
+    def seed_posts(self, user_ids, group_ids, count, days):
+        texts = [self.fake.paragraph(nb_sentences=4)
+                 for _ in range(TEXT_POOL)]
+        authors = self.popular(user_ids, count)
+        groups = (self.popular(group_ids, count) if group_ids
+                  else [None] * count)
+        now = timezone.now()
+        span = timedelta(days=days).total_seconds()
+        start = Post.objects.order_by('-pk').values_list(
+            'pk', flat=True).first() or 0
+        posts = (
+            Post(text=self.random.choice(texts), author_id=author_id,
+                 # треть постов без группы
+                 group_id=group_id if self.random.random() > 0.33 else None,
+                 pub_date=now - timedelta(
+                     seconds=self.random.random() * span))
+            for author_id, group_id in zip(authors, groups)
+        )
+        with bulk.auto_now_disabled(Post, 'pub_date'):
+            self.insert(Post, posts, count)
+        return list(Post.objects.filter(pk__gt=start).values_list(
+            'pk', flat=True))
+
+    def seed_follows(self, user_ids, mean):
+        if len(user_ids) < 2 or mean <= 0:
+            return
+        total = len(user_ids) * mean
+        # На популярных авторов подписано больше пользователей
+        authors = iter(self.popular(user_ids, total))
+        follows = (
+            Follow(user_id=user_id, author_id=author_id)
+            for user_id in user_ids
+            for author_id in set(itertools.islice(
+                authors, int(self.random.expovariate(1 / mean))))
+            if author_id != user_id
+        )
+        self.insert(Follow, follows, total)
+
+    def seed_comments(self, user_ids, post_ids, count):
+        if not post_ids:
+            return
+        texts = [self.fake.sentence() for _ in range(TEXT_POOL)]
+        # Обсуждения тоже сосредоточены вокруг немногих постов
+        posts = self.popular(post_ids, count)
+        comments = (
+            Comment(post_id=post_id, text=self.random.choice(texts),
+                    author_id=self.random.choice(user_ids))
+            for post_id in posts
+        )
+        self.insert(Comment, comments, count)
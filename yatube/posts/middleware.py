@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import write_behind
+
+
+class WriteBehindMiddleware:
+    """Пользователь видит свои отложенные записи (posts.write_behind):
+    его запрос ждёт, пока комментарии и подписки из общей очереди в БД
+    будут сохранены, какой бы процесс их ни принял. Запросы остальных
+    пользователей не задерживаются. Заодно запускает фоновый разбор
+    очереди в процессе."""
+
+    def __init__(self, get_response):
+        if not settings.WRITE_BEHIND_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        write_behind.start()
+
+    def __call__(self, request):
+        if request.user.is_authenticated:
+            write_behind.wait_for(request.user.id)
+        return self.get_response(request)
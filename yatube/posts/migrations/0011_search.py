@@ -0,0 +1,120 @@
+# Generated by Django 2.2.16 on 2026-10-17 17:32
+
+import re
+import unicodedata
+from collections import Counter
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+FTS_TABLE = 'posts_post_fts'
+# Веса полей: текст, название группы, имя автора
+WEIGHTS = (1, 2, 2)
+WORD = re.compile(r'\w+')
+LATIN_END = '\u0250'
+
+
+def fold(char):
+    if char >= LATIN_END:
+        return char
+    return ''.join(part for part in unicodedata.normalize('NFKD', char)
+                   if not unicodedata.combining(part))
+
+
+def terms(text):
+    for word in WORD.findall(text or ''):
+        word = word.casefold().replace('ё', 'е')
+        yield ''.join(map(fold, word))[:64]
+
+
+def fts_available(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return any('FTS5' in row[0] for row in cursor.fetchall())
+
+
+def fill_fts(apps, cursor):
+    Post = apps.get_model('posts', 'Post')
+    Group = apps.get_model('posts', 'Group')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    weights = ', '.join(str(float(weight)) for weight in WEIGHTS)
+    cursor.execute(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+        f'text, group_title, author_name, '
+        f"tokenize = 'unicode61 remove_diacritics 2')")
+    cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rank) "
+                   f"VALUES ('rank', 'bm25({weights})')")
+    columns = ', '.join(
+        f"REPLACE(REPLACE({column}, 'ё', 'е'), 'Ё', 'Е')" for column in (
+            'p.text',
+            "COALESCE(g.title, '')",
+            "u.first_name || ' ' || u.last_name || ' ' || u.username",
+        ))
+    cursor.execute(
+        f'INSERT INTO {FTS_TABLE} (rowid, text, group_title, author_name) '
+        f'SELECT p.id, {columns} '
+        f'FROM {Post._meta.db_table} p '
+        f'JOIN {User._meta.db_table} u ON u.id = p.author_id '
+        f'LEFT JOIN {Group._meta.db_table} g ON g.id = p.group_id')
+
+
+def fill_search_terms(apps):
+    Post = apps.get_model('posts', 'Post')
+    SearchTerm = apps.get_model('posts', 'SearchTerm')
+    posts = Post.objects.select_related('author', 'group').iterator()
+    for post in posts:
+        author = post.author
+        fields = (
+            post.text,
+            post.group.title if post.group_id else '',
+            f'{author.first_name} {author.last_name} {author.username}',
+        )
+        weights = Counter()
+        for text, weight in zip(fields, WEIGHTS):
+            for term in terms(text):
+                weights[term] += weight
+        SearchTerm.objects.bulk_create(
+            SearchTerm(term=term, post_id=post.pk, weight=weight)
+            for term, weight in weights.items())
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    fts = fts_available(connection)
+    if fts:
+        with connection.cursor() as cursor:
+            fill_fts(apps, cursor)
+    if not fts or settings.SEARCH_BACKEND == 'terms':
+        fill_search_terms(apps)
+
+
+def drop_search_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.PositiveIntegerField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='posts.Post')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='searchterm',
+            constraint=models.UniqueConstraint(fields=('term', 'post'), name='unique_search_term'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
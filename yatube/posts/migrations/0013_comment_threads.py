@@ -0,0 +1,65 @@
+# Generated by Django 2.2.16 on 2026-10-17 18:01
+
+import string
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+SEGMENT_WIDTH = 8
+DIGITS = string.digits + string.ascii_lowercase
+MAX_ID = len(DIGITS) ** SEGMENT_WIDTH - 1
+
+
+def top_level_path(comment_id):
+    # Поле parent появляется в этой миграции, поэтому все существующие
+    # комментарии - корни веток: путь - «перевёрнутый» id в base36
+    number = MAX_ID - comment_id
+    digits = []
+    for _ in range(SEGMENT_WIDTH):
+        number, digit = divmod(number, len(DIGITS))
+        digits.append(DIGITS[digit])
+    return ''.join(reversed(digits))
+
+
+def fill_paths(apps, schema_editor):
+    Comment = apps.get_model('posts', 'Comment')
+    comments = [Comment(id=comment_id, path=top_level_path(comment_id),
+                        depth=0)
+                for comment_id in Comment.objects.values_list('id',
+                                                              flat=True)]
+    Comment.objects.bulk_update(comments, ['path', 'depth'],
+                                batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_comment_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='posts.Comment', verbose_name='Ответ на'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'depth', 'path'], name='comment_post_depth_path_idx'),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+    ]
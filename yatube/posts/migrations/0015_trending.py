@@ -0,0 +1,88 @@
+# Generated by Django 2.2.16 on 2026-10-17 18:08
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+POST_WEIGHT = 1.0
+COMMENT_WEIGHT = 2.0
+MIN_SCORE = 0.01
+HORIZON = 20
+
+
+def fill_scores(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    PostScore = apps.get_model('posts', 'PostScore')
+    GroupScore = apps.get_model('posts', 'GroupScore')
+    TrendingClock = apps.get_model('posts', 'TrendingClock')
+    half_life = settings.TRENDING_HALF_LIFE
+    now = timezone.now()
+    since = now - timedelta(seconds=HORIZON * half_life)
+    posts, groups = {}, {}
+
+    def add(post_id, group_id, weight, moment):
+        value = weight * 2 ** ((moment - now).total_seconds() / half_life)
+        posts[post_id] = posts.get(post_id, 0) + value
+        if group_id is not None:
+            groups[group_id] = groups.get(group_id, 0) + value
+
+    for post_id, group_id, pub_date in Post.objects.filter(
+            pub_date__gte=since).values_list('id', 'group_id', 'pub_date'):
+        add(post_id, group_id, POST_WEIGHT, pub_date)
+    for post_id, group_id, created in Comment.objects.filter(
+            created__gte=since, post__isnull=False).values_list(
+            'post_id', 'post__group_id', 'created'):
+        add(post_id, group_id, COMMENT_WEIGHT, created)
+    TrendingClock.objects.create(pk=1, epoch=now)
+    PostScore.objects.bulk_create(
+        (PostScore(post_id=pk, score=score)
+         for pk, score in posts.items() if score >= MIN_SCORE),
+        batch_size=2000)
+    GroupScore.objects.bulk_create(
+        (GroupScore(group_id=pk, score=score)
+         for pk, score in groups.items() if score >= MIN_SCORE),
+        batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupScore',
+            fields=[
+                ('group', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trend', serialize=False, to='posts.Group')),
+                ('score', models.FloatField(default=0, verbose_name='Оценка')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PostScore',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trend', serialize=False, to='posts.Post')),
+                ('score', models.FloatField(default=0, verbose_name='Оценка')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrendingClock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('epoch', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='postscore',
+            index=models.Index(fields=['-score', '-post'], name='post_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='groupscore',
+            index=models.Index(fields=['-score', '-group'], name='group_score_idx'),
+        ),
+        migrations.RunPython(fill_scores, migrations.RunPython.noop),
+    ]
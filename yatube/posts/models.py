@@ -9,6 +9,8 @@ class Group(models.Model):
     title = models.CharField(verbose_name='Название', max_length=200)
     slug = models.SlugField(verbose_name='URL-Адрес', unique=True)
     description = models.TextField(verbose_name='Описание')
+    posts_count = models.PositiveIntegerField(
+        verbose_name='Число постов', default=0, editable=False)
 
     def __str__(self):
         return self.title
@@ -39,9 +41,19 @@ class Post(models.Model):
         help_text='Подсказка для админа',
         verbose_name='Группа'
     )
+    comments_count = models.PositiveIntegerField(
+        verbose_name='Число комментариев', default=0, editable=False)
 
     class Meta:
-        ordering = ['-pub_date']
+        ordering = ['-pub_date', '-id']
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_pub_date_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_pub_date_idx'),
+        ]
 
     def __str__(self):
         return self.text[:15]
@@ -61,11 +73,29 @@ class Comment(models.Model):
     )
     text = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
+    parent = models.ForeignKey(
+        'self',
+        blank=True, null=True,
+        on_delete=models.CASCADE,
+        related_name='replies',
+        verbose_name='Ответ на'
+    )
+    # Материализованный путь ветки и глубина, см. posts.threads
+    path = models.CharField(max_length=255, blank=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
 
     class Meta:
         ordering = ['-created']
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
+        indexes = [
+            models.Index(fields=['post', '-created', '-id'],
+                         name='comment_post_created_idx'),
+            models.Index(fields=['post', 'path'],
+                         name='comment_post_path_idx'),
+            models.Index(fields=['post', 'depth', 'path'],
+                         name='comment_post_depth_path_idx'),
+        ]
 
 
 class Follow(models.Model):
@@ -81,3 +111,150 @@ class Follow(models.Model):
                 name='unique_followings'
             )
         ]
+        indexes = [
+            models.Index(fields=['author', 'user'],
+                         name='follow_author_user_idx'),
+        ]
+
+
+class UserStats(models.Model):
+    """Денормализованные счётчики пользователя.
+
+    Поддерживаются сигналами (см. posts.counters), расхождения
+    исправляет команда reconcile_counters.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                primary_key=True, related_name='stats')
+    posts_count = models.PositiveIntegerField('Число постов', default=0)
+    followers_count = models.PositiveIntegerField('Подписчиков', default=0)
+    following_count = models.PositiveIntegerField('Подписок', default=0)
+
+    class Meta:
+        verbose_name = 'Статистика пользователя'
+        verbose_name_plural = 'Статистика пользователей'
+
+
+class FeedEntry(models.Model):
+    """Строка материализованной ленты подписок пользователя.
+
+    Заполняется при публикации поста (fan-out on write) и при подписке,
+    удаляется при отписке; см. posts.feeds.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='feed_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name='feed_entries')
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-pub_date']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='feed_user_pub_date_idx'),
+        ]
+
+
+class SearchTerm(models.Model):
+    """Вхождение слова в пост для поиска без FTS5.
+
+    Используется, когда БД не поддерживает FTS5 (см. posts.search);
+    weight - число вхождений слова с учётом веса поля.
+    """
+    term = models.CharField(max_length=64)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name='search_terms')
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['term', 'post'],
+                name='unique_search_term'
+            )
+        ]
+
+
+class Recommendation(models.Model):
+    """Автор, которого стоит почитать пользователю.
+
+    Лучшие RECOMMENDATIONS_TOP_K авторов по графу подписок, считаются
+    командой refresh_recommendations (см. posts.recommendations).
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='recommendations')
+    suggested = models.ForeignKey(User, on_delete=models.CASCADE,
+                                  related_name='+',
+                                  verbose_name='Рекомендуемый автор')
+    score = models.FloatField('Оценка')
+
+    class Meta:
+        verbose_name = 'Рекомендация'
+        verbose_name_plural = 'Рекомендации'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'suggested'],
+                name='unique_recommendation'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['user', '-score'],
+                         name='recommendation_user_score_idx'),
+        ]
+
+
+class RecommendationRefresh(models.Model):
+    """Очередь пользователей, чьи рекомендации устарели после подписки
+    или отписки."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                primary_key=True, related_name='+')
+
+
+class TrendingClock(models.Model):
+    """Момент, от которого отсчитываются оценки популярности.
+
+    Единственная строка; её сдвигает вперёд периодическое затухание
+    (см. posts.trending).
+    """
+    epoch = models.DateTimeField()
+
+
+class PostScore(models.Model):
+    """Оценка популярности поста с учётом давности (см. posts.trending)."""
+    post = models.OneToOneField(Post, on_delete=models.CASCADE,
+                                primary_key=True, related_name='trend')
+    score = models.FloatField('Оценка', default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score', '-post'],
+                         name='post_score_idx'),
+        ]
+
+
+class GroupScore(models.Model):
+    """Оценка популярности сообщества (см. posts.trending)."""
+    group = models.OneToOneField(Group, on_delete=models.CASCADE,
+                                 primary_key=True, related_name='trend')
+    score = models.FloatField('Оценка', default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score', '-group'],
+                         name='group_score_idx'),
+        ]
+
+
+class PendingWrite(models.Model):
+    """Комментарий или подписка, ждущие сохранения пачкой (см.
+    posts.write_behind). Строка фиксируется до ответа пользователю,
+    поэтому запись переживает падение процесса."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='+')
+    model = models.CharField(max_length=32)
+    data = models.TextField()
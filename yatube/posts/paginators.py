@@ -0,0 +1,145 @@
+import base64
+import binascii
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage(Page):
+    """Страница ленты, полученная поиском по ключу, а не через OFFSET.
+
+    Вместо номера страницы хранит непрозрачные курсоры на соседние
+    страницы: шаблону достаточно подставить их в ?cursor=.
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, paginator, next_cursor=None,
+                 previous_cursor=None):
+        super().__init__(object_list, None, paginator)
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<Cursor page>'
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class CursorPaginator(Paginator):
+    """Пагинатор, который ищет страницу по паре (pub_date, id).
+
+    Не выполняет COUNT(*) и не использует OFFSET, поэтому глубокие
+    страницы отдаются так же быстро, как первая. Поля сортировки
+    (поля модели или аннотации) должны однозначно упорядочивать
+    выборку, последнее из них - уникальное (обычно id).
+    """
+
+    def __init__(self, object_list, per_page,
+                 ordering=('-pub_date', '-id')):
+        self.ordering = tuple(ordering)
+        super().__init__(object_list.order_by(*self.ordering), per_page)
+
+    @property
+    def fields(self):
+        """Поля сортировки: поля модели или аннотации queryset."""
+        query = self.object_list.query
+        fields = []
+        for name in self.ordering:
+            name = name.lstrip('-')
+            if name in query.annotations:
+                fields.append(query.annotations[name].output_field)
+            else:
+                fields.append(query.model._meta.get_field(name))
+        return fields
+
+    def encode_cursor(self, obj, direction):
+        """obj - объект модели или словарь строки из .values()."""
+        values = []
+        for name in self.ordering:
+            name = name.lstrip('-')
+            value = obj[name] if isinstance(obj, dict) else getattr(obj, name)
+            values.append(value.isoformat() if hasattr(value, 'isoformat')
+                          else str(value))
+        raw = '|'.join([direction] + values)
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padding = '=' * (-len(cursor) % 4)
+            raw = base64.urlsafe_b64decode(cursor + padding).decode()
+            direction, *values = raw.split('|')
+            if direction not in (NEXT, PREVIOUS):
+                raise InvalidCursor(cursor)
+            if len(values) != len(self.fields):
+                raise InvalidCursor(cursor)
+            position = [field.to_python(value)
+                        for field, value in zip(self.fields, values)]
+        except (ValueError, UnicodeDecodeError, binascii.Error,
+                ValidationError):
+            raise InvalidCursor(cursor)
+        return direction, position
+
+    def seek(self, position, backwards=False):
+        """Условие «строго после position» для заданного направления.
+
+        Нестрогая граница по первому полю позволяет базе начать чтение
+        индекса сразу с нужного места, а не фильтровать его с начала.
+        """
+        condition = Q()
+        equal = {}
+        bound = None
+        for name, value in zip(self.ordering, position):
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            lookup = 'lt' if descending != backwards else 'gt'
+            if bound is None:
+                bound = Q(**{f'{name}__{lookup}e': value})
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return bound & condition
+
+    def page(self, cursor=None):
+        if cursor is None:
+            return self._build_page(self.object_list, None, NEXT)
+        direction, position = self.decode_cursor(cursor)
+        backwards = direction == PREVIOUS
+        object_list = self.object_list.filter(
+            self.seek(position, backwards))
+        if backwards:
+            object_list = object_list.reverse()
+        return self._build_page(object_list, position, direction)
+
+    def _build_page(self, object_list, position, direction):
+        items = list(object_list[:self.per_page + 1])
+        has_more = len(items) > self.per_page
+        items = items[:self.per_page]
+        if direction == PREVIOUS:
+            items.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+        next_cursor = previous_cursor = None
+        if items and has_next:
+            next_cursor = self.encode_cursor(items[-1], NEXT)
+        if items and has_previous:
+            previous_cursor = self.encode_cursor(items[0], PREVIOUS)
+        return CursorPage(items, self, next_cursor, previous_cursor)
+
+    def get_page(self, cursor):
+        """Как Paginator.get_page: битый курсор ведёт на первую страницу."""
+        try:
+            return self.page(cursor or None)
+        except InvalidCursor:
+            return self.page()
@@ -0,0 +1,237 @@
+"""Полнотекстовый поиск по постам.
+
+Индексируются текст поста, название группы и имя автора. На SQLite
+индекс - виртуальная таблица FTS5 posts_post_fts (rowid = id поста),
+результаты ранжируются по bm25. На остальных БД используется
+собственный обратный индекс в таблице SearchTerm: слово -> пост с
+весом. Оба индекса обновляют сигналы, полностью их перестраивает
+команда rebuild_search_index.
+
+Запрос разбивается на слова; пост находится, если содержит их все.
+"""
+import re
+import unicodedata
+from collections import Counter
+
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.db import connection
+from django.db.models import (Count, ExpressionWrapper, FloatField,
+                              IntegerField, Sum)
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'posts_post_fts'
+FTS_SCHEMA = (
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+    f'text, group_title, author_name, '
+    f"tokenize = 'unicode61 remove_diacritics 2')"
+)
+# Веса полей: текст, название группы, имя автора
+WEIGHTS = (1, 2, 2)
+MAX_TERMS = 8
+BATCH_SIZE = 500
+
+WORD = re.compile(r'\w+')
+LATIN_END = '\u0250'
+
+_uses_fts = {}
+
+
+def _fold(char):
+    # Как unicode61 с remove_diacritics: диакритика снимается только
+    # с латиницы («й» остаётся), «ё» заменяется на «е» отдельно.
+    if char >= LATIN_END:
+        return char
+    return ''.join(part for part in unicodedata.normalize('NFKD', char)
+                   if not unicodedata.combining(part))
+
+
+def normalize(word):
+    word = word.casefold().replace('ё', 'е')
+    return ''.join(map(_fold, word))[:64]
+
+
+def tokenize(text):
+    return [normalize(word) for word in WORD.findall(text or '')]
+
+
+def query_terms(query):
+    """Уникальные слова запроса в исходном порядке."""
+    return list(dict.fromkeys(tokenize(query)))[:MAX_TERMS]
+
+
+def fts_available():
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return any('FTS5' in row[0] for row in cursor.fetchall())
+
+
+def uses_fts():
+    """Используется ли индекс FTS5 (его создаёт миграция, если SQLite
+    собран с FTS5); SEARCH_BACKEND позволяет выбрать явно."""
+    if settings.SEARCH_BACKEND is not None:
+        return settings.SEARCH_BACKEND == 'fts5'
+    name = connection.settings_dict['NAME']
+    if name not in _uses_fts:
+        _uses_fts[name] = (
+            connection.vendor == 'sqlite'
+            and FTS_TABLE in connection.introspection.table_names())
+    return _uses_fts[name]
+
+
+def create_fts():
+    weights = ', '.join(str(float(weight)) for weight in WEIGHTS)
+    with connection.cursor() as cursor:
+        cursor.execute(FTS_SCHEMA)
+        # Скрытый столбец rank будет считаться как bm25 с весами полей;
+        # в отличие от вызова bm25() его можно сравнивать в WHERE.
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rank) "
+                       f"VALUES ('rank', 'bm25({weights})')")
+    _uses_fts.clear()
+
+
+def drop_fts():
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    _uses_fts.clear()
+
+
+def _fts_query(terms):
+    # Слова состоят только из \w, поэтому кавычки их не экранируют,
+    # а лишь отключают синтаксис запросов FTS5 (AND, NEAR, * и т. п.).
+    return ' '.join(f'"{term}"' for term in terms)
+
+
+def _fts_insert_sql(apps, where=''):
+    Post = apps.get_model('posts', 'Post')
+    Group = apps.get_model('posts', 'Group')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    columns = (
+        'p.text',
+        "COALESCE(g.title, '')",
+        "u.first_name || ' ' || u.last_name || ' ' || u.username",
+    )
+    # unicode61 не считает «ё» буквой «е» с диакритикой
+    columns = ', '.join(f"REPLACE(REPLACE({column}, 'ё', 'е'), 'Ё', 'Е')"
+                        for column in columns)
+    return (
+        f'INSERT INTO {FTS_TABLE} (rowid, text, group_title, author_name) '
+        f'SELECT p.id, {columns} '
+        f'FROM {Post._meta.db_table} p '
+        f'JOIN {User._meta.db_table} u ON u.id = p.author_id '
+        f'LEFT JOIN {Group._meta.db_table} g ON g.id = p.group_id {where}'
+    )
+
+
+def _document(post):
+    author = post.author
+    fields = (
+        post.text,
+        post.group.title if post.group_id else '',
+        f'{author.first_name} {author.last_name} {author.username}',
+    )
+    weights = Counter()
+    for text, weight in zip(fields, WEIGHTS):
+        for term in tokenize(text):
+            weights[term] += weight
+    return weights
+
+
+def index_posts(post_ids, apps=global_apps):
+    """Переиндексирует посты; удалённые из БД убираются из индекса."""
+    post_ids = list(post_ids)
+    Post = apps.get_model('posts', 'Post')
+    SearchTerm = apps.get_model('posts', 'SearchTerm')
+    fts = uses_fts()
+    for start in range(0, len(post_ids), BATCH_SIZE):
+        batch = post_ids[start:start + BATCH_SIZE]
+        if fts:
+            placeholders = ', '.join('%s' for _ in batch)
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {FTS_TABLE} '
+                               f'WHERE rowid IN ({placeholders})', batch)
+                cursor.execute(_fts_insert_sql(
+                    apps, f'WHERE p.id IN ({placeholders})'), batch)
+            continue
+        SearchTerm.objects.filter(post_id__in=batch).delete()
+        posts = Post.objects.filter(pk__in=batch).select_related(
+            'author', 'group')
+        SearchTerm.objects.bulk_create(
+            (SearchTerm(term=term, post_id=post.pk, weight=weight)
+             for post in posts
+             for term, weight in _document(post).items()),
+            batch_size=BATCH_SIZE,
+        )
+
+
+def remove_post(post_id):
+    # Строки SearchTerm удаляет каскад внешнего ключа
+    if uses_fts():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                           [post_id])
+
+
+def rebuild(apps=global_apps):
+    """Перестраивает индекс целиком, возвращает число постов в нём."""
+    Post = apps.get_model('posts', 'Post')
+    SearchTerm = apps.get_model('posts', 'SearchTerm')
+    if uses_fts():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(_fts_insert_sql(apps))
+            # Слияние сегментов ускоряет последующие запросы
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) "
+                           f"VALUES ('optimize')")
+        return Post.objects.count()
+    SearchTerm.objects.all().delete()
+    post_ids = Post.objects.order_by().values_list('pk', flat=True)
+    post_ids = list(post_ids.iterator())
+    index_posts(post_ids, apps)
+    return len(post_ids)
+
+
+def filter_posts(queryset, query):
+    """Посты queryset, содержащие все слова запроса, без ранжирования."""
+    terms = query_terms(query)
+    if not terms:
+        return queryset.none()
+    if uses_fts():
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            (_fts_query(terms),),
+        ))
+    SearchTerm = global_apps.get_model('posts', 'SearchTerm')
+    matches = (SearchTerm.objects.filter(term__in=terms)
+               .values('post').annotate(matched=Count('pk'))
+               .filter(matched=len(terms)).values('post'))
+    return queryset.filter(pk__in=matches)
+
+
+def search(queryset, query):
+    """Посты queryset, найденные по запросу, от самых релевантных.
+
+    Ранг - аннотация rank (меньше - лучше), сортировка ('rank', '-id')
+    подходит и для CursorPaginator.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return queryset.none()
+    if uses_fts():
+        table = queryset.model._meta.db_table
+        queryset = queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = {table}.id',
+                   f'{FTS_TABLE} MATCH %s'],
+            params=[_fts_query(terms)],
+        ).annotate(rank=RawSQL(f'{FTS_TABLE}.rank', (),
+                               output_field=FloatField()))
+    else:
+        queryset = queryset.filter(search_terms__term__in=terms).annotate(
+            matched=Count('search_terms'),
+            rank=ExpressionWrapper(-Sum('search_terms__weight'),
+                                   output_field=IntegerField()),
+        ).filter(matched=len(terms))
+    return queryset.order_by('rank', '-id')
@@ -0,0 +1,95 @@
+"""Потоковая отрисовка страниц лент (STREAMING_RENDER).
+
+render() из django.shortcuts собирает страницу целиком, поэтому время
+до первого байта включает всю выборку постов и отрисовку. С
+STREAMING_RENDER страница отдаётся StreamingHttpResponse: шаблон
+отрисовывается сразу, но вместо блока {% streamed %} (и кэшируемого
+фрагмента feedcache вокруг него) в нём остаётся метка. Всё, что до
+первой метки - head и шапка base.html, заголовок ленты - уходит
+клиенту первым куском. Затем посты читаются из БД итератором, без кэша
+выборки, и отрисовываются по STREAMING_CHUNK_SIZE штук на кусок,
+после них уходит остаток страницы.
+
+Метки содержат случайный ключ отрисовки и ищутся только в выводе
+шаблонов, а не в отложенных частях: текст постов не может подделать
+метку, даже если содержит NUL. Запросы и отрисовка постов выполняются,
+когда сервер читает ответ, уже после middleware; middleware core
+продолжают замер на время отдачи тела (core.middleware.MeasuredContent).
+Ошибка в них обрывает ответ, статус которого уже отправлен.
+"""
+import re
+import secrets
+
+from django.conf import settings
+from django.core.paginator import Page
+from django.db.models.query import QuerySet
+from django.http import StreamingHttpResponse
+from django.shortcuts import render as render_page
+from django.template import loader
+
+# Ключ контекста шаблона: переменные с подчёркиванием шаблонам
+# недоступны
+STREAM_KEY = '_page_stream'
+
+
+class PageStream:
+    """Отложенные части страницы и сборка её по кускам."""
+
+    def __init__(self):
+        self.parts = []
+        # Ключ не покидает процесс: метки заменяются до отправки
+        token = secrets.token_hex(16)
+        self.marker = f'\x00stream:{token}:{{}}\x00'
+        self.marker_re = re.compile(f'\x00stream:{token}:(\\d+)\x00')
+
+    def defer(self, chunks):
+        """Откладывает часть страницы: chunks() возвращает итератор
+        строк. Возвращает метку, которую нужно вывести на её месте."""
+        self.parts.append(chunks)
+        return self.marker.format(len(self.parts) - 1)
+
+    def has_markers(self, text):
+        return self.marker_re.search(text) is not None
+
+    def expand(self, text):
+        """Куски вывода шаблона text с подставленными вместо меток
+        частями. Каждая часть подставляется один раз, её собственный
+        вывод не просматривается."""
+        position = 0
+        for match in self.marker_re.finditer(text):
+            yield text[position:match.start()]
+            index = int(match[1])
+            chunks, self.parts[index] = self.parts[index], None
+            if chunks is not None:
+                yield from chunks()
+            position = match.end()
+        yield text[position:]
+
+
+def get_stream(context):
+    return context.get(STREAM_KEY)
+
+
+def lazy_items(objects):
+    """Элементы страницы ленты, не загружая всю выборку в память."""
+    if isinstance(objects, Page):
+        objects = objects.object_list
+    if objects is None:
+        return ()
+    # Ещё не выполненный запрос без prefetch_related (его итератор
+    # не поддерживает) читается кусками без кэша результатов
+    if (isinstance(objects, QuerySet) and objects._result_cache is None
+            and not objects._prefetch_related_lookups):
+        return objects.iterator(chunk_size=settings.STREAMING_CHUNK_SIZE)
+    return objects
+
+
+def render(request, template_name, context):
+    """Как django.shortcuts.render, а с STREAMING_RENDER - по кускам."""
+    if not settings.STREAMING_RENDER:
+        return render_page(request, template_name, context)
+    stream = PageStream()
+    page = loader.get_template(template_name).render(
+        {**context, STREAM_KEY: stream}, request)
+    return StreamingHttpResponse(
+        chunk for chunk in stream.expand(page) if chunk)
@@ -0,0 +1,49 @@
+from django import template
+
+from posts import feed_cache, streaming
+
+register = template.Library()
+
+
+class FeedCacheNode(template.Node):
+    def __init__(self, nodelist, key):
+        self.nodelist = nodelist
+        self.key = key
+
+    def render(self, context):
+        key = self.key.resolve(context)
+        if not key:
+            return self.nodelist.render(context)
+        fragment = feed_cache.get_fragment(key)
+        if fragment is None:
+            fragment = self.nodelist.render(context)
+            stream = streaming.get_stream(context)
+            if stream is not None and stream.has_markers(fragment):
+                # В фрагменте потоковые части: он попадёт в кэш, когда
+                # будет отправлен целиком
+                return stream.defer(
+                    lambda: self.cache_chunks(stream, key, fragment))
+            feed_cache.set_fragment(key, fragment)
+        return fragment
+
+    def cache_chunks(self, stream, key, fragment):
+        chunks = []
+        for chunk in stream.expand(fragment):
+            chunks.append(chunk)
+            yield chunk
+        feed_cache.set_fragment(key, ''.join(chunks))
+
+
+@register.tag
+def feedcache(parser, token):
+    """Кэширует фрагмент ленты по ключу из posts.feed_cache.make_key.
+
+    {% feedcache feed_cache_key %} ... {% endfeedcache %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError(
+            f"'{bits[0]}' принимает один аргумент - ключ фрагмента")
+    nodelist = parser.parse(('endfeedcache',))
+    parser.delete_first_token()
+    return FeedCacheNode(nodelist, parser.compile_filter(bits[1]))
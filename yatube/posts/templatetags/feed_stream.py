@@ -0,0 +1,78 @@
+from copy import copy
+
+from django import template
+from django.conf import settings
+from django.template.defaulttags import ForNode
+
+from posts import streaming
+
+register = template.Library()
+
+_END = object()
+
+
+class StreamedNode(template.Node):
+    def __init__(self, nodelist):
+        self.nodelist = nodelist
+
+    def render(self, context):
+        stream = streaming.get_stream(context)
+        if stream is None:
+            return self.nodelist.render(context)
+        # Блок отрисуется позже, когда сервер дойдёт до метки: копия
+        # сохраняет переменные, шаблон и состояние отрисовки
+        snapshot = copy(context)
+        return stream.defer(lambda: self.iter_render(snapshot))
+
+    def iter_render(self, context):
+        for node in self.nodelist:
+            if (isinstance(node, ForNode) and len(node.loopvars) == 1
+                    and not node.is_reversed):
+                yield from self.iter_loop(context, node)
+            else:
+                yield node.render_annotated(context)
+
+    def iter_loop(self, context, node):
+        """Цикл for по кускам из STREAMING_CHUNK_SIZE элементов. Длина
+        выборки заранее неизвестна, поэтому forloop знает только
+        counter, counter0, first и last."""
+        items = iter(streaming.lazy_items(
+            node.sequence.resolve(context, ignore_failures=True)))
+        chunk_size = settings.STREAMING_CHUNK_SIZE
+        bits = []
+        rendered = 0
+        with context.push():
+            loop = context['forloop'] = {
+                'parentloop': context.get('forloop', {})}
+            item = next(items, _END)
+            while item is not _END:
+                # Следующий элемент читается заранее ради forloop.last
+                following = next(items, _END)
+                loop.update(counter0=rendered, counter=rendered + 1,
+                            first=rendered == 0, last=following is _END)
+                context[node.loopvars[0]] = item
+                bits.append(node.nodelist_loop.render(context))
+                rendered += 1
+                if len(bits) >= chunk_size:
+                    yield ''.join(bits)
+                    bits = []
+                item = following
+        if not rendered:
+            bits.append(node.nodelist_empty.render(context))
+        yield ''.join(bits)
+
+
+@register.tag
+def streamed(parser, token):
+    """Блок, который при STREAMING_RENDER отдаётся отдельно от остальной
+    страницы, а циклы for в нём - по кускам (см. posts.streaming).
+    Без потоковой отрисовки ничего не меняет.
+
+    {% streamed %}{% for post in page_obj %} ... {% endfor %}{% endstreamed %}
+    """
+    if len(token.split_contents()) != 1:
+        raise template.TemplateSyntaxError(
+            "'streamed' не принимает аргументов")
+    nodelist = parser.parse(('endstreamed',))
+    parser.delete_first_token()
+    return StreamedNode(nodelist)
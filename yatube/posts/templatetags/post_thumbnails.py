@@ -0,0 +1,19 @@
+from django import template
+
+from posts import thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_thumbnail(post, geometry_string, **options):
+    """Готовая миниатюра картинки поста или None.
+
+    Если миниатюры ещё нет, ставит её создание в очередь и не задерживает
+    отрисовку страницы.
+    """
+    thumbnail = thumbnails.cached_thumbnail(post.image, geometry_string,
+                                            **options)
+    if thumbnail is None and post.image:
+        thumbnails.schedule(post, follow_scopes=False)
+    return thumbnail
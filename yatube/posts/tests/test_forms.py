@@ -1,12 +1,17 @@
 import shutil
 import tempfile
+from io import BytesIO, StringIO
 
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
 
+from posts import thumbnails
 from posts.models import Group, Post, Comment
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -165,3 +170,179 @@ class PostCreateFormTests(TestCase):
         self.assertRedirects(response, reverse('users:login') + '?next='
                              + reverse('posts:add_comment',
                              kwargs={'post_id': f'{self.post.id}'}))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class PostThumbnailTests(TestCase):
+    SMALL_GIF = (
+        b'\x47\x49\x46\x38\x39\x61\x02\x00'
+        b'\x01\x00\x80\x00\x00\x00\x00\x00'
+        b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+        b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+        b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+        b'\x0A\x00\x3B'
+    )
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='TestUser')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_sorl_internals_present(self):
+        """Закрытые методы sorl-thumbnail, которые использует
+        PregeneratingBackend, есть в установленной версии."""
+        for name in thumbnails.SORL_INTERNALS:
+            with self.subTest(name=name):
+                self.assertTrue(callable(getattr(
+                    thumbnails.PregeneratingBackend, name, None)))
+
+    def upload(self, name):
+        return SimpleUploadedFile(name=name, content=self.SMALL_GIF,
+                                  content_type='image/gif')
+
+    @override_settings(THUMBNAIL_ASYNC=False)
+    def test_thumbnail_generated_on_save(self):
+        """Миниатюра создаётся при сохранении поста с картинкой,
+        и страница показывает её."""
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост с картинкой', 'image': self.upload('a.gif')},
+        )
+        post = Post.objects.get(text='Пост с картинкой')
+        thumbnail = thumbnails.cached_thumbnail(post.image, '200x200',
+                                                crop='center')
+        self.assertIsNotNone(thumbnail)
+        self.assertContains(self.authorized_client.get(reverse('posts:index')),
+                            thumbnail.url)
+
+    def test_original_shown_while_thumbnail_pending(self):
+        """Пока миниатюра не готова, показывается исходная картинка."""
+        post = Post.objects.create(text='Пост', author=self.user,
+                                   image=self.upload('b.gif'))
+        self.assertIsNone(thumbnails.cached_thumbnail(post.image, '200x200',
+                                                      crop='center'))
+        self.assertContains(self.authorized_client.get(reverse('posts:index')),
+                            post.image.url)
+
+    @override_settings(THUMBNAIL_ASYNC=False)
+    def test_failed_thumbnail_not_retried(self):
+        """Картинку, миниатюра которой не получилась, страницы не ставят
+        в очередь снова до THUMBNAIL_RETRY_AFTER."""
+        post = Post.objects.create(text='Пост', author=self.user,
+                                   image=self.upload('d.gif'))
+        post.image.storage.delete(post.image.name)
+        self.addCleanup(thumbnails._failed.pop, post.image.name, None)
+        thumbnails.schedule(post)
+        self.assertIn(post.image.name, thumbnails._failed)
+        retry_at = thumbnails._failed[post.image.name]
+        thumbnails.schedule(post)
+        self.assertEqual(thumbnails._failed[post.image.name], retry_at)
+
+    def test_template_schedule_without_queries(self):
+        """Шаблон ставит миниатюру в очередь без запросов к БД."""
+        post = Post.objects.create(text='Пост', author=self.user,
+                                   image=self.upload('e.gif'))
+        with self.assertNumQueries(0):
+            thumbnails.schedule(post, follow_scopes=False)
+
+    def test_generate_thumbnails_command(self):
+        """generate_thumbnails создаёт недостающие миниатюры."""
+        post = Post.objects.create(text='Пост', author=self.user,
+                                   image=self.upload('c.gif'))
+        call_command('generate_thumbnails', workers=1, stdout=StringIO())
+        self.assertIsNotNone(thumbnails.cached_thumbnail(
+            post.image, '200x200', crop='center'))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_ASYNC=False)
+class PostImageUploadTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='TestUser')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def upload(self, size, image_format='JPEG', **options):
+        content = BytesIO()
+        Image.new('RGB', size, 'red').save(content, image_format, **options)
+        return SimpleUploadedFile(
+            name=f'photo.{image_format.lower()}', content=content.getvalue(),
+            content_type=f'image/{image_format.lower()}')
+
+    def create(self, image):
+        return self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост с картинкой', 'image': image},
+        )
+
+    @override_settings(IMAGE_MAX_EDGE=32)
+    def test_large_image_downscaled(self):
+        """Картинка уменьшается до IMAGE_MAX_EDGE по большей стороне
+        и сохраняется в posts/."""
+        self.create(self.upload((128, 64)))
+        post = Post.objects.get(text='Пост с картинкой')
+        self.assertTrue(post.image.name.startswith('posts/'))
+        with Image.open(post.image) as image:
+            self.assertEqual(image.size, (32, 16))
+
+    def test_metadata_stripped(self):
+        """EXIF не сохраняется, а поворот из него применяется."""
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera'
+        exif[0x0112] = 6
+        self.create(self.upload((40, 20), exif=exif.tobytes()))
+        post = Post.objects.get(text='Пост с картинкой')
+        with Image.open(post.image) as image:
+            self.assertEqual(dict(image.getexif()), {})
+            self.assertEqual(image.size, (20, 40))
+
+    @override_settings(IMAGE_MAX_PIXELS=1000)
+    def test_too_many_pixels_rejected(self):
+        """Картинка с числом пикселей больше IMAGE_MAX_PIXELS
+        отклоняется."""
+        response = self.create(self.upload((100, 100)))
+        self.assertFalse(Post.objects.exists())
+        self.assertFormError(response, 'form', 'image',
+                             'Картинка 100×100 больше допустимых '
+                             '0.001 Мп.')
+
+    @override_settings(IMAGE_UPLOAD_MAX_SIZE=10)
+    def test_too_large_file_rejected(self):
+        response = self.create(self.upload((10, 10)))
+        self.assertFalse(Post.objects.exists())
+        self.assertEqual(response.context['form'].errors['image'][0],
+                         'Файл больше 10\xa0байт.')
+
+    def test_animation_metadata_stripped(self):
+        """Анимация сохраняет кадры, но теряет метаданные."""
+        frames = [Image.new('P', (10, 10), color) for color in (1, 2)]
+        content = BytesIO()
+        frames[0].save(content, 'GIF', save_all=True,
+                       append_images=frames[1:], duration=100,
+                       comment=b'secret')
+        self.create(SimpleUploadedFile(name='anim.gif',
+                                       content=content.getvalue(),
+                                       content_type='image/gif'))
+        post = Post.objects.get(text='Пост с картинкой')
+        with Image.open(post.image) as image:
+            self.assertEqual(image.n_frames, 2)
+            self.assertEqual(image.info['duration'], 100)
+            self.assertNotIn('comment', image.info)
@@ -1,13 +1,29 @@
+import json
 import shutil
 import tempfile
+from datetime import timedelta
+from io import StringIO
 
 from django.conf import settings
-from django.test import Client, TestCase
+from django.db import connection
+from django.template import Context, Template
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django.core.cache import cache
+from django.core.management import CommandError, call_command
 from django.core.files.uploadedfile import SimpleUploadedFile
 
-from ..models import Follow, Post, Group, User
+from core import metrics
+from core.query_budget import QueryBudgetExceeded, assert_max_queries
+from .. import (bulk, feed_cache, recommendations, streaming, threads,
+                trending, write_behind)
+from ..models import (Comment, FeedEntry, Follow, Group, GroupScore,
+                      PendingWrite, Post, PostScore, Recommendation,
+                      RecommendationRefresh, TrendingClock, User)
+from ..paginators import CursorPaginator
 from yatube.settings import PAG_NUM
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -60,6 +76,7 @@ class PostPagesTests(TestCase):
         shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
 
     def setUp(self):
+        cache.clear()
         self.authorized_client = Client()
         self.authorized_leo_user = Client()
         self.authorized_unfollower_user = Client()
@@ -111,14 +128,15 @@ class PostPagesTests(TestCase):
         self.post_info_massage(response.context['post'])
 
     def test_index_page_cache(self):
-        """Записть хранится в кеше 20 секунд или до очистки кэша."""
+        """Лента берётся из кэша, пока её не изменят сигналы
+        или не очистят кэш."""
         test_post = Post.objects.create(
             text='Тестовый текст для кеша',
             author=self.user,
             group=self.group
         )
         response = self.authorized_client.get(self.index_reverse).content
-        test_post.delete()
+        Post.objects.filter(pk=test_post.pk).update(text='Без сигналов')
         self.assertEqual(response,
                          self.authorized_client.get(self.index_reverse).
                          content)
@@ -127,6 +145,45 @@ class PostPagesTests(TestCase):
                             self.authorized_client.get(self.index_reverse).
                             content)
 
+    def test_feed_cache_invalidated_by_signals(self):
+        """Удаление поста и новый комментарий сразу видны на страницах."""
+        test_post = Post.objects.create(
+            text='Пост, который удалят',
+            author=self.user,
+            group=self.group
+        )
+        for address in (self.index_reverse, self.group_list_reverse,
+                        self.profile_reverse):
+            with self.subTest(address=address):
+                self.assertContains(self.authorized_client.get(address),
+                                    test_post.text)
+        test_post.delete()
+        for address in (self.index_reverse, self.group_list_reverse,
+                        self.profile_reverse):
+            with self.subTest(address=address):
+                self.assertNotContains(self.authorized_client.get(address),
+                                       test_post.text)
+        self.authorized_client.get(self.post_detail_reverse)
+        Comment.objects.create(post=self.post, author=self.user,
+                               text='Свежий комментарий')
+        self.assertContains(
+            self.authorized_client.get(self.post_detail_reverse),
+            'Свежий комментарий')
+
+    def test_feed_cache_keyed_by_page(self):
+        """Разные страницы ленты кэшируются отдельно, попадания
+        и промахи учитываются."""
+        Post.objects.bulk_create(
+            Post(text=f'Пост {i}', author=self.user) for i in range(PAG_NUM))
+        feed_cache.reset_stats()
+        first = self.authorized_client.get(self.index_reverse).content
+        second = self.authorized_client.get(
+            self.index_reverse + '?page=2').content
+        self.assertNotEqual(first, second)
+        self.authorized_client.get(self.index_reverse + '?page=2')
+        self.assertEqual(feed_cache.stats()['misses'], 2)
+        self.assertEqual(feed_cache.stats()['hits'], 1)
+
 
 class FollowingTest(TestCase):
     """Класс тестирования подписок."""
@@ -282,3 +339,1085 @@ class PaginatorViewsTest(TestCase):
                 for i in range(0, PAG_NUM):
                     object_post = response.context['page_obj'][i].id
                     self.assertEqual(object_post, post[i].id)
+
+
+class CursorPaginatorViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='Name')
+        cls.group = Group.objects.create(
+            title='Тестовое название группы',
+            slug='test_slug',
+            description='Тестовое описание группы',
+        )
+        Post.objects.bulk_create(
+            Post(text=f'Тестовый пост №{i}', group=cls.group,
+                 author=cls.user)
+            for i in range(PAG_NUM + 3)
+        )
+        cls.posts = list(Post.objects.order_by('-pub_date', '-id'))
+        cls.pagination_reverses = (
+            reverse('posts:group_list', kwargs={'slug': cls.group.slug}),
+            reverse('posts:profile', kwargs={'username': cls.user.username}),
+        )
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_cursor_pages_walk_whole_feed(self):
+        """Курсоры next/prev проходят ленту без пропусков и повторов."""
+        for reverse_name in self.pagination_reverses:
+            with self.subTest(reverse_name=reverse_name):
+                first = self.authorized_client.get(
+                    reverse_name + '?cursor=').context['page_obj']
+                self.assertTrue(first.is_cursor)
+                self.assertFalse(first.has_previous())
+                self.assertEqual(list(first), self.posts[:PAG_NUM])
+                second = self.authorized_client.get(
+                    f'{reverse_name}?cursor={first.next_cursor}'
+                ).context['page_obj']
+                self.assertEqual(list(second), self.posts[PAG_NUM:])
+                self.assertFalse(second.has_next())
+                back = self.authorized_client.get(
+                    f'{reverse_name}?cursor={second.previous_cursor}'
+                ).context['page_obj']
+                self.assertEqual(list(back), self.posts[:PAG_NUM])
+
+    def test_cursor_page_skips_count_query(self):
+        """Страница по курсору не выполняет COUNT(*)."""
+        with self.assertNumQueries(1):
+            page = CursorPaginator(Post.objects.all(), PAG_NUM).get_page('')
+            list(page)
+
+    def test_broken_cursor_returns_first_page(self):
+        """Испорченный курсор ведёт на первую страницу."""
+        response = self.authorized_client.get(
+            self.pagination_reverses[0] + '?cursor=broken')
+        self.assertEqual(list(response.context['page_obj']),
+                         self.posts[:PAG_NUM])
+
+    @override_settings(PAGINATION_MODE='cursor')
+    def test_page_number_still_works_in_cursor_mode(self):
+        """В режиме курсоров ?page=N по-прежнему отдаёт нумерованную
+        страницу."""
+        response = self.authorized_client.get(
+            self.pagination_reverses[0] + '?page=2')
+        self.assertEqual(response.context['page_obj'].number, 2)
+        response = self.authorized_client.get(self.pagination_reverses[0])
+        self.assertTrue(response.context['page_obj'].is_cursor)
+
+
+class FollowFeedTest(TestCase):
+    """Материализованная лента подписок."""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Name')
+        cls.author = User.objects.create_user(username='Leo')
+        cls.other_follower = User.objects.create_user(username='Mark')
+        cls.old_post = Post.objects.create(text='Старый пост',
+                                           author=cls.author)
+        cls.follow_reverse = reverse('posts:follow_index')
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def feed(self):
+        response = self.authorized_client.get(self.follow_reverse)
+        return list(response.context['page_obj'])
+
+    def test_follow_backfills_and_unfollow_trims_feed(self):
+        """Подписка добавляет в ленту прошлые посты автора,
+        отписка убирает их, не трогая чужие подписки."""
+        Follow.objects.create(user=self.other_follower, author=self.author)
+        self.authorized_client.get(reverse(
+            'posts:profile_follow', kwargs={'username': 'Leo'}))
+        self.assertEqual(self.feed(), [self.old_post])
+        self.authorized_client.get(reverse(
+            'posts:profile_unfollow', kwargs={'username': 'Leo'}))
+        self.assertEqual(self.feed(), [])
+        self.assertTrue(Follow.objects.filter(
+            user=self.other_follower, author=self.author).exists())
+        self.assertEqual(
+            FeedEntry.objects.filter(user=self.other_follower).count(), 1)
+
+    def test_new_post_fans_out_to_followers(self):
+        """Новый пост попадает в ленты подписчиков в порядке ленты."""
+        Follow.objects.create(user=self.user, author=self.author)
+        new_post = Post.objects.create(text='Новый пост', author=self.author)
+        self.assertEqual(self.feed(), [new_post, self.old_post])
+
+    def test_rebuild_feeds_command(self):
+        """rebuild_feeds восстанавливает потерянные записи ленты."""
+        Follow.objects.create(user=self.user, author=self.author)
+        Post.objects.bulk_create([Post(text='Импорт', author=self.author)])
+        FeedEntry.objects.all().delete()
+        call_command('rebuild_feeds', stdout=StringIO())
+        self.assertEqual(len(self.feed()), 2)
+
+
+class QueryBudgetTest(TestCase):
+    """Число запросов страниц не зависит от числа постов на странице."""
+    QUERY_BUDGET = 6
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Name')
+        authors = [User.objects.create_user(username=f'author{i}')
+                   for i in range(PAG_NUM)]
+        groups = [Group.objects.create(title=f'Группа {i}', slug=f'slug-{i}',
+                                       description='Описание')
+                  for i in range(PAG_NUM)]
+        for author, group in zip(authors, groups):
+            Follow.objects.create(user=cls.user, author=author)
+            Post.objects.create(text='Текст', author=author, group=group)
+        cls.post = Post.objects.create(text='Текст', author=authors[0],
+                                       group=groups[0])
+        for author in authors:
+            Comment.objects.create(text='Коммент', author=author,
+                                   post=cls.post)
+        cls.urls = (
+            reverse('posts:index'),
+            reverse('posts:index') + '?cursor=',
+            reverse('posts:group_list', kwargs={'slug': groups[0].slug}),
+            reverse('posts:profile', kwargs={'username': 'author0'}),
+            reverse('posts:post_detail', kwargs={'post_id': cls.post.id}),
+            reverse('posts:follow_index'),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_feed_pages_fit_query_budget(self):
+        """Страницы лент укладываются в бюджет запросов."""
+        for url in self.urls:
+            with self.subTest(url=url):
+                with assert_max_queries(self.QUERY_BUDGET):
+                    self.authorized_client.get(url)
+
+    @override_settings(QUERY_BUDGET=1, QUERY_BUDGET_RAISE=True)
+    def test_middleware_raises_over_budget(self):
+        """QueryBudgetMiddleware сообщает о превышении бюджета."""
+        client = Client()
+        client.force_login(self.user)
+        with self.assertRaises(QueryBudgetExceeded):
+            client.get(self.urls[0])
+
+
+class PostSearchTest(TestCase):
+    BACKENDS = ('fts5', 'terms')
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='writer', first_name='Лев', last_name='Толстой')
+        self.group = Group.objects.create(title='Ёлки', slug='trees',
+                                          description='Описание')
+        self.client = Client()
+
+    def create_posts(self):
+        return (
+            Post.objects.create(text='Зимой ёлка в снегу', author=self.user),
+            Post.objects.create(text='Про ёлку и ещё раз про ёлку',
+                                author=self.user, group=self.group),
+            Post.objects.create(text='Летний пост', author=self.user),
+        )
+
+    def found(self, query, **params):
+        response = self.client.get(reverse('posts:search'),
+                                   {'q': query, **params})
+        return list(response.context['page_obj'])
+
+    def test_search_text_group_and_author(self):
+        """Поиск находит посты по тексту, группе и автору; регистр
+        и «ё» не важны."""
+        for backend in self.BACKENDS:
+            with self.subTest(backend=backend), \
+                    override_settings(SEARCH_BACKEND=backend):
+                Post.objects.all().delete()
+                snow, trees, summer = self.create_posts()
+                self.assertEqual(self.found('СНЕГУ ёлка'), [snow])
+                self.assertEqual(self.found('елки'), [trees])
+                self.assertEqual(self.found('толстой летний'), [summer])
+                self.assertEqual(self.found('пост про ёлку'), [])
+                self.assertEqual(self.found(''), [])
+
+    def test_search_ranked_and_paginated(self):
+        """Чаще упомянутое слово - выше, результаты делятся
+        на страницы."""
+        for backend in self.BACKENDS:
+            with self.subTest(backend=backend), \
+                    override_settings(SEARCH_BACKEND=backend):
+                Post.objects.all().delete()
+                best = Post.objects.create(text='ёлку ёлку ёлку',
+                                           author=self.user)
+                Post.objects.bulk_create(
+                    Post(text=f'ёлку номер {i}', author=self.user)
+                    for i in range(PAG_NUM + 2))
+                call_command('rebuild_search_index', stdout=StringIO())
+                first = self.found('ёлку')
+                self.assertEqual(len(first), PAG_NUM)
+                self.assertEqual(first[0], best)
+                self.assertEqual(len(self.found('ёлку', page=2)), 3)
+                cursor_page = self.client.get(
+                    reverse('posts:search'), {'q': 'ёлку', 'cursor': ''}
+                ).context['page_obj']
+                self.assertEqual(list(cursor_page), first)
+                rest = self.found('ёлку', cursor=cursor_page.next_cursor)
+                self.assertEqual(len(rest), 3)
+                self.assertFalse(set(rest) & set(first))
+
+    def test_index_follows_changes(self):
+        """Индекс обновляется при правке и удалении поста, группы
+        и автора."""
+        for backend in self.BACKENDS:
+            with self.subTest(backend=backend), \
+                    override_settings(SEARCH_BACKEND=backend):
+                Post.objects.all().delete()
+                snow, trees, _ = self.create_posts()
+                snow.text = 'Весной ручьи'
+                snow.save()
+                self.assertEqual(self.found('снегу'), [])
+                self.assertEqual(self.found('ручьи'), [snow])
+                self.group.title = 'Сосны'
+                self.group.save()
+                self.assertEqual(self.found('сосны'), [trees])
+                self.user.last_name = 'Чехов'
+                self.user.save()
+                self.assertEqual(len(self.found('чехов')), 3)
+                trees.delete()
+                self.assertEqual(self.found('сосны'), [])
+
+    def test_author_reindexed_only_on_name_change(self):
+        """Сохранение автора без смены имени не переиндексирует его
+        посты."""
+        self.create_posts()
+        self.user.is_active = False
+        with CaptureQueriesContext(connection) as queries:
+            self.user.save()
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'posts_post' in query['sql']])
+        self.user.first_name = 'Антон'
+        with CaptureQueriesContext(connection) as queries:
+            self.user.save()
+        self.assertTrue([query for query in queries.captured_queries
+                         if 'posts_post' in query['sql']])
+
+    def test_admin_search_uses_index(self):
+        """Поиск в админке идёт по индексу, без LIKE по тексту."""
+        snow, _, _ = self.create_posts()
+        admin = User.objects.create_superuser('admin', 'a@a.ru', 'pass')
+        self.client.force_login(admin)
+        with self.assertNumQueries(6) as queries:
+            response = self.client.get(
+                reverse('admin:posts_post_changelist'), {'q': 'снегу'})
+        self.assertEqual(list(response.context['cl'].result_list), [snow])
+        self.assertFalse(any('LIKE' in query['sql']
+                             for query in queries.captured_queries))
+
+
+class BenchmarkCommandsTest(TestCase):
+    def test_seed_and_benchmark(self):
+        """seed_data создаёт согласованные данные, benchmark_views пишет
+        замеры всех представлений в JSON."""
+        call_command('seed_data', users=6, groups=2, posts=40, comments=10,
+                     follows=3, stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 40)
+        self.assertGreater(
+            Post.objects.values('pub_date').distinct().count(), 1)
+        author = User.objects.filter(posts__isnull=False).first()
+        self.assertEqual(author.stats.posts_count, author.posts.count())
+        self.assertEqual(
+            FeedEntry.objects.count(),
+            Post.objects.filter(author__following__isnull=False).count())
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command('benchmark_views', requests=3, warmup=0,
+                         output=output.name, stdout=StringIO())
+            report = json.load(output)
+        self.assertEqual(report['dataset']['posts'], 40)
+        for view in ('index', 'group_posts', 'profile', 'post_detail',
+                     'follow_index'):
+            with self.subTest(view=view):
+                self.assertEqual(report['views'][view]['requests'], 3)
+                self.assertLessEqual(report['views'][view]['p50_ms'],
+                                     report['views'][view]['p99_ms'])
+        with self.assertRaises(CommandError):
+            call_command('benchmark_views', requests=0, stdout=StringIO())
+
+
+class TransferCommandsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='writer')
+        self.group = Group.objects.create(title='Группа', slug='transfer',
+                                          description='Описание')
+        self.first = Post.objects.create(text='Ёжик в тумане',
+                                         author=self.author,
+                                         group=self.group)
+        self.second = Post.objects.create(text='Без группы',
+                                          author=self.author)
+
+    def path(self, name, content=None):
+        path = f'{self.directory}/{name}'
+        if content is not None:
+            with open(path, 'w', encoding='utf-8') as output:
+                output.write(content)
+        return path
+
+    def test_round_trip(self):
+        """Выгруженные посты загружаются обратно с теми же полями,
+        авторы и группы создаются по именам."""
+        for file_format in ('ndjson', 'csv'):
+            with self.subTest(file_format=file_format):
+                path = self.path(f'posts.{file_format}')
+                call_command('export_posts', path, stdout=StringIO())
+                exported = list(Post.objects.order_by('id').values_list(
+                    'text', 'group__slug', 'pub_date'))
+                Post.objects.all().delete()
+                self.author.delete()
+                self.group.delete()
+                call_command('import_posts', path, create_authors=True,
+                             create_groups=True, chunk_size=1,
+                             stdout=StringIO())
+                self.assertEqual(
+                    list(Post.objects.order_by('id').values_list(
+                        'text', 'group__slug', 'pub_date')),
+                    exported)
+                self.author = User.objects.get(username='writer')
+                self.assertFalse(self.author.has_usable_password())
+                self.group = Group.objects.get(slug='transfer')
+                self.assertEqual(self.author.stats.posts_count, 2)
+                response = self.client.get(reverse('posts:search'),
+                                           {'q': 'ежик'})
+                self.assertEqual(len(response.context['page_obj']), 1)
+
+    def test_export_to_stdout(self):
+        output = StringIO()
+        call_command('export_posts', group='transfer', stdout=output)
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(records, [{
+            'text': 'Ёжик в тумане', 'author': 'writer', 'group': 'transfer',
+            'pub_date': self.first.pub_date.isoformat(), 'image': '',
+        }])
+
+    def test_invalid_records(self):
+        """Запись с неизвестным автором останавливает импорт, а с
+        --skip-invalid пропускается."""
+        path = self.path('invalid.ndjson', '\n'.join((
+            json.dumps({'text': 'Есть автор', 'author': 'writer'}),
+            json.dumps({'text': 'Нет автора', 'author': 'ghost'}),
+        )))
+        with self.assertRaisesMessage(CommandError, 'Запись 2'):
+            call_command('import_posts', path, stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 2)
+        call_command('import_posts', path, skip_invalid=True,
+                     stdout=StringIO())
+        self.assertTrue(Post.objects.filter(text='Есть автор').exists())
+        self.assertFalse(User.objects.filter(username='ghost').exists())
+
+    def test_malformed_lines(self):
+        """Строки, которые не разбираются как объект JSON, подчиняются
+        --skip-invalid, как и остальные ошибочные записи."""
+        path = self.path('malformed.ndjson', '\n'.join((
+            '{"text": "Обрыв',
+            '["не объект"]',
+            json.dumps({'text': 'Список', 'author': ['writer']}),
+            json.dumps({'text': 'Целая', 'author': 'writer'}),
+        )))
+        with self.assertRaisesMessage(CommandError, 'Запись 1'):
+            call_command('import_posts', path, stdout=StringIO())
+        output = StringIO()
+        call_command('import_posts', path, skip_invalid=True, stdout=output)
+        self.assertTrue(Post.objects.filter(text='Целая').exists())
+        self.assertIn('пропущено: 3', output.getvalue())
+
+    def test_derived_refreshed_after_failure(self):
+        """Счётчики пересобираются и тогда, когда импорт остановила
+        ошибка посреди файла."""
+        path = self.path('partial.ndjson', '\n'.join((
+            json.dumps({'text': 'Первая', 'author': 'writer'}),
+            json.dumps({'text': 'Вторая', 'author': 'ghost'}),
+        )))
+        with self.assertRaises(CommandError):
+            call_command('import_posts', path, chunk_size=1,
+                         stdout=StringIO())
+        self.author.stats.refresh_from_db()
+        self.assertEqual(self.author.stats.posts_count, 3)
+
+    def test_defer_indexes(self):
+        """После импорта со снятыми индексами они созданы заново."""
+        with connection.cursor() as cursor:
+            before = connection.introspection.get_constraints(
+                cursor, Post._meta.db_table)
+        path = self.path('one.ndjson', json.dumps(
+            {'text': 'Новый', 'author': 'writer',
+             'pub_date': '2020-01-02T03:04:05'}))
+        call_command('import_posts', path, defer_indexes=True,
+                     skip_derived=True, stdout=StringIO())
+        with connection.cursor() as cursor:
+            after = connection.introspection.get_constraints(
+                cursor, Post._meta.db_table)
+        self.assertEqual(after, before)
+        self.assertEqual(Post.objects.get(text='Новый').pub_date.year, 2020)
+
+
+@override_settings(CONDITIONAL_GET=True)
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Группа', slug='cond',
+                                         description='Описание')
+        cls.post = Post.objects.create(text='Пост', author=cls.author,
+                                       group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+        self.urls = {
+            'index': reverse('posts:index'),
+            'group_list': reverse('posts:group_list', args=['cond']),
+            'profile': reverse('posts:profile', args=['author']),
+            'post_detail': reverse('posts:post_detail',
+                                   args=[self.post.id]),
+        }
+
+    def assertNotModified(self, url, etag):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(len(queries), 1)
+
+    def test_not_modified_without_rendering(self):
+        """Совпавший ETag и свежий If-Modified-Since - 304 за один
+        запрос к БД; анонимный ответ можно кэшировать в прокси."""
+        for name, url in self.urls.items():
+            with self.subTest(name=name):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('public', response['Cache-Control'])
+                self.assertIn('max-age=0', response['Cache-Control'])
+                self.assertIn('Cookie', response['Vary'])
+                self.assertNotModified(url, response['ETag'])
+                response = self.client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+                self.assertEqual(response.status_code, 304)
+
+    def test_changes_update_validators(self):
+        etags = {name: self.client.get(url)['ETag']
+                 for name, url in self.urls.items()}
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='Комментарий')
+        self.assertEqual(self.client.get(
+            self.urls['post_detail'],
+            HTTP_IF_NONE_MATCH=etags['post_detail']).status_code, 200)
+        self.assertNotModified(self.urls['index'], etags['index'])
+
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.client.get(
+            self.urls['profile'],
+            HTTP_IF_NONE_MATCH=etags['profile']).status_code, 200)
+
+        Post.objects.create(text='Новый', author=self.author,
+                            group=self.group)
+        for name in ('index', 'group_list'):
+            with self.subTest(name=name):
+                self.assertEqual(self.client.get(
+                    self.urls[name],
+                    HTTP_IF_NONE_MATCH=etags[name]).status_code, 200)
+
+    def test_authenticated_copies_are_private(self):
+        anonymous = self.client.get(self.urls['index'])['ETag']
+        self.client.force_login(self.reader)
+        response = self.client.get(self.urls['index'],
+                                   HTTP_IF_NONE_MATCH=anonymous)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotIn('public', response['Cache-Control'])
+
+    def test_missing_objects(self):
+        response = self.client.get(
+            reverse('posts:group_list', args=['missing']))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+    @override_settings(CONDITIONAL_GET=None)
+    def test_disabled_with_process_local_cache(self):
+        """С кэшем поколений в памяти процесса ETag не выдаётся:
+        другой воркер не знает о правке и ответил бы 304."""
+        response = self.client.get(self.urls['index'])
+        self.assertFalse(response.has_header('ETag'))
+        self.assertEqual(self.client.get(
+            self.urls['index'], HTTP_IF_NONE_MATCH='"*"').status_code, 200)
+
+
+@override_settings(COMMENTS_PER_PAGE=2)
+class CommentPaginationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(text='Пост', author=cls.author)
+        cls.comments = [
+            Comment.objects.create(post=cls.post, author=User.objects.create(
+                username=f'commenter{number}'), text=f'Комментарий {number}')
+            for number in range(5)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_first_page_rendered(self):
+        """Страница поста отрисовывает только первую порцию, авторы
+        загружаются без отдельных запросов."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('posts:post_detail', args=[self.post.id]))
+        self.assertEqual(list(response.context['comments']),
+                         self.comments[:-3:-1])
+        self.assertFalse(any(
+            query['sql'].startswith('SELECT')
+            and 'FROM "auth_user" WHERE' in query['sql']
+            for query in queries.captured_queries))
+        self.assertContains(response, 'data-comments-more')
+        self.assertNotContains(response, 'Комментарий 2')
+
+    def test_load_more(self):
+        url = reverse('posts:comments', args=[self.post.id])
+        seen = []
+        next_url = url + '?format=json'
+        while next_url:
+            data = self.client.get(next_url).json()
+            seen.extend(comment['id'] for comment in data['comments'])
+            next_url = data['next']
+        self.assertEqual(seen, [comment.id for comment in
+                                reversed(self.comments)])
+
+        first = self.client.get(url)
+        self.assertEqual(list(first.context['page']),
+                         self.comments[:-3:-1])
+        cursor = first.context['page'].next_cursor
+        fragment = self.client.get(url, {'cursor': cursor})
+        self.assertContains(fragment, 'Комментарий 2')
+        self.assertNotContains(fragment, '<html')
+
+    def test_errors(self):
+        url = reverse('posts:comments', args=[self.post.id])
+        self.assertEqual(
+            self.client.get(url, {'cursor': 'broken'}).status_code, 400)
+        self.assertEqual(self.client.get(
+            reverse('posts:comments', args=[0])).status_code, 404)
+
+
+@override_settings(COMMENTS_PER_PAGE=2, COMMENT_MAX_DEPTH=2)
+class CommentThreadsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='commenter')
+        cls.post = Post.objects.create(text='Пост', author=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def comment(self, text, parent=None):
+        self.client.post(
+            reverse('posts:add_comment', args=[self.post.id]),
+            {'text': text, 'parent': parent.id if parent else ''})
+        return Comment.objects.get(text=text)
+
+    def test_replies_keep_threads_together(self):
+        """Ответы идут сразу за родителем, новые ветки - первыми, ветка
+        читается одним запросом."""
+        first = self.comment('Первый')
+        second = self.comment('Второй')
+        reply = self.comment('Ответ на первый', first)
+        nested = self.comment('Ответ на ответ', reply)
+        late = self.comment('Поздний ответ', first)
+        self.assertEqual((reply.parent, reply.depth), (first, 1))
+        self.assertEqual(nested.depth, 2)
+        with self.assertNumQueries(1):
+            ordered = list(Comment.objects.filter(
+                post=self.post).order_by('path'))
+        self.assertEqual(ordered, [second, first, reply, nested, late])
+        with self.assertNumQueries(1):
+            branch = list(threads.subtree(Comment.objects.all(),
+                                          reply.path))
+        self.assertEqual(branch, [reply, nested])
+
+    def test_depth_limit(self):
+        root = self.comment('Корень')
+        reply = self.comment('Ответ', root)
+        deepest = self.comment('Глубже', reply)
+        flattened = self.comment('Ещё глубже', deepest)
+        self.assertEqual(flattened.parent, reply)
+        self.assertEqual(flattened.depth, 2)
+
+    def test_pages_carry_replies(self):
+        """Страница - COMMENTS_PER_PAGE веток верхнего уровня вместе
+        со всеми ответами."""
+        old = self.comment('Старая ветка')
+        self.comment('Ответ в старой', old)
+        middle = self.comment('Средняя ветка')
+        middle_reply = self.comment('Ответ в средней', middle)
+        new = self.comment('Новая ветка')
+        response = self.client.get(
+            reverse('posts:post_detail', args=[self.post.id]))
+        page = response.context['comments']
+        self.assertEqual(list(page), [new, middle, middle_reply])
+        data = self.client.get(
+            reverse('posts:comments', args=[self.post.id]),
+            {'format': 'json', 'cursor': page.next_cursor}).json()
+        self.assertEqual(
+            [(comment['text'], comment['depth'])
+             for comment in data['comments']],
+            [('Старая ветка', 0), ('Ответ в старой', 1)])
+
+    def test_reply_links_for_authenticated(self):
+        """«Ответить» видят только вошедшие, хотя фрагмент кэшируется."""
+        self.comment('Корень')
+        url = reverse('posts:post_detail', args=[self.post.id])
+        anonymous = Client().get(url)
+        self.assertContains(anonymous, 'Корень')
+        self.assertNotContains(anonymous, 'Ответить</a>')
+        self.assertContains(self.client.get(url), 'Ответить</a>')
+        self.assertNotContains(Client().get(url), 'Ответить</a>')
+
+    def test_parent_from_other_post(self):
+        other = Post.objects.create(text='Другой', author=self.user)
+        foreign = Comment.objects.create(post=other, author=self.user,
+                                         text='Чужой')
+        response = self.client.post(
+            reverse('posts:add_comment', args=[self.post.id]),
+            {'text': 'Ответ', 'parent': foreign.id})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Comment.objects.filter(text='Ответ').exists())
+
+    def test_rebuild_paths(self):
+        """Пути комментариев из bulk_create заполняет threads.rebuild."""
+        root = self.comment('Корень')
+        Comment.objects.bulk_create([
+            Comment(post=self.post, author=self.user, text='Массовый')])
+        bulk = Comment.objects.get(text='Массовый')
+        reply = Comment.objects.create(post=self.post, author=self.user,
+                                       text='Ответ', parent=bulk)
+        Comment.objects.filter(pk=reply.pk).update(path='', depth=0)
+        self.assertEqual(threads.rebuild(), 2)
+        bulk.refresh_from_db()
+        reply.refresh_from_db()
+        self.assertEqual(reply.path[:len(bulk.path)], bulk.path)
+        self.assertEqual(reply.depth, 1)
+        self.assertLess(bulk.path, root.path)
+
+
+class RecommendationsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        names = ('reader', 'friend', 'fof', 'twin', 'cofollowed', 'lonely')
+        users = {name: User.objects.create_user(username=name)
+                 for name in names}
+        for name, user in users.items():
+            setattr(cls, name, user)
+        for user, author in (('reader', 'friend'), ('friend', 'fof'),
+                             ('twin', 'friend'), ('twin', 'cofollowed')):
+            Follow.objects.create(user=users[user], author=users[author])
+
+    def setUp(self):
+        cache.clear()
+
+    def suggested(self, user):
+        return list(Recommendation.objects.filter(user=user).order_by(
+            '-score').values_list('suggested__username', flat=True))
+
+    def test_friends_of_friends_and_cofollows(self):
+        """Друзья друзей и подписки похожих пользователей; себя и уже
+        прочитанных авторов в рекомендациях нет."""
+        call_command('refresh_recommendations', '--full', stdout=StringIO())
+        self.assertEqual(self.suggested(self.reader), ['fof', 'cofollowed'])
+        self.assertNotIn('lonely', self.suggested(self.twin))
+        self.assertEqual(self.suggested(self.lonely), [])
+
+    def test_follow_queues_refresh(self):
+        """Подписка убирает автора из рекомендаций сразу и ставит в
+        очередь пользователя и его подписчиков."""
+        recommendations.refresh()
+        RecommendationRefresh.objects.all().delete()
+        Follow.objects.create(user=self.reader, author=self.fof)
+        self.assertEqual(self.suggested(self.reader), ['cofollowed'])
+        self.assertEqual(
+            set(RecommendationRefresh.objects.values_list(
+                'user_id', flat=True)), {self.reader.id})
+        Follow.objects.create(user=self.fof, author=self.lonely)
+        # reader, fof и подписчик fof - friend
+        self.assertEqual(recommendations.refresh_pending(), 3)
+        self.assertEqual(self.suggested(self.reader)[0], 'lonely')
+        self.assertFalse(RecommendationRefresh.objects.exists())
+
+    @override_settings(CONDITIONAL_GET=True)
+    def test_pages_show_suggestions(self):
+        """Блок «Кого почитать» на своём профиле - один запрос
+        к Recommendation и новый ETag страницы после пересчёта."""
+        self.client.force_login(self.reader)
+        url = reverse('posts:profile', args=['reader'])
+        etag = self.client.get(url)['ETag']
+        recommendations.refresh([self.reader.id])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item.suggested for item in response.context['suggestions']],
+            [self.fof, self.cofollowed])
+        self.assertEqual(len([
+            query for query in queries.captured_queries
+            if 'posts_recommendation' in query['sql']]), 1)
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertContains(response, 'Кого почитать')
+
+
+class TrendingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.quiet = Group.objects.create(title='Тихая', slug='quiet',
+                                         description='Описание')
+        cls.busy = Group.objects.create(title='Шумная', slug='busy',
+                                        description='Описание')
+        cls.old = Post.objects.create(text='Обсуждаемый', author=cls.author,
+                                      group=cls.busy)
+        cls.new = Post.objects.create(text='Новый', author=cls.author,
+                                      group=cls.quiet)
+
+    def score(self, post):
+        return PostScore.objects.get(post=post).score
+
+    def test_engagement_ranks_posts_and_groups(self):
+        """Без комментариев выше новый пост, комментарии поднимают
+        обсуждаемый пост и его сообщество."""
+        self.assertGreater(self.score(self.new), self.score(self.old))
+        Comment.objects.create(post=self.old, author=self.reader,
+                               text='Комментарий')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('posts:trending'))
+        self.assertEqual(response.context['posts'], [self.old, self.new])
+        self.assertEqual(response.context['groups'], [self.busy, self.quiet])
+        selects = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 2)
+        self.assertNotIn('posts_comment', ' '.join(selects))
+
+    def test_follow_raises_recent_posts(self):
+        before = self.score(self.new)
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertAlmostEqual(self.score(self.new) - before,
+                               trending.FOLLOW_WEIGHT, places=2)
+
+    def test_decay_keeps_order_and_prunes(self):
+        """Затухание сдвигает epoch, не меняя порядка, и удаляет
+        оценки ниже MIN_SCORE."""
+        Comment.objects.create(post=self.old, author=self.reader,
+                               text='Комментарий')
+        scores = dict(PostScore.objects.values_list('post_id', 'score'))
+        later = timezone.now() + timedelta(
+            seconds=settings.TRENDING_HALF_LIFE)
+        trending.decay(later)
+        for post_id, score in PostScore.objects.values_list(
+                'post_id', 'score'):
+            self.assertAlmostEqual(score, scores[post_id] / 2, places=3)
+        trending.decay(later + timedelta(
+            seconds=6 * settings.TRENDING_HALF_LIFE))
+        self.assertEqual(
+            list(PostScore.objects.values_list('post_id', flat=True)),
+            [self.old.id])
+
+    def test_rebuild_matches_signals(self):
+        Comment.objects.create(post=self.old, author=self.reader,
+                               text='Комментарий')
+        expected = dict(PostScore.objects.values_list('post_id', 'score'))
+        groups = dict(GroupScore.objects.values_list('group_id', 'score'))
+        call_command('decay_trending', '--rebuild', stdout=StringIO())
+        for post_id, score in PostScore.objects.values_list(
+                'post_id', 'score'):
+            self.assertAlmostEqual(score, expected[post_id], places=3)
+        self.assertEqual(GroupScore.objects.count(), len(groups))
+
+    def test_stale_epoch_rebased(self):
+        """Если затухание давно не запускали, событие само переносит
+        epoch вместо переполнения 2 ** x."""
+        TrendingClock.objects.update(epoch=timezone.now() - timedelta(
+            seconds=2000 * settings.TRENDING_HALF_LIFE))
+        post = Post.objects.create(text='Свежий', author=self.author)
+        self.assertAlmostEqual(self.score(post), trending.POST_WEIGHT,
+                               places=2)
+        self.assertLess(timezone.now() - trending.epoch(),
+                        timedelta(minutes=1))
+
+    def test_refresh_derived_keeps_follow_boost(self):
+        """Пересборка после массовой загрузки оценивает новые посты и не
+        трогает существующие оценки с вкладом подписок."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        scores = dict(PostScore.objects.values_list('post_id', 'score'))
+        Post.objects.bulk_create([
+            Post(text='Загруженный', author=self.author, group=self.quiet)])
+        bulk.refresh_derived()
+        for post_id, score in scores.items():
+            self.assertAlmostEqual(self.score(Post(pk=post_id)), score,
+                                   places=6)
+        loaded = Post.objects.get(text='Загруженный')
+        self.assertAlmostEqual(self.score(loaded), trending.POST_WEIGHT,
+                               places=2)
+
+
+@override_settings(WRITE_BEHIND_ENABLED=True, WRITE_BEHIND_INTERVAL=None,
+                   WRITE_BEHIND_BATCH_SIZE=3)
+class WriteBehindTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(text='Пост', author=cls.author)
+        cls.readers = [User.objects.create_user(username=f'reader{number}')
+                       for number in range(3)]
+
+    def client_for(self, user):
+        client = Client()
+        client.force_login(user)
+        return client
+
+    def comment(self, client, text, parent=None):
+        return client.post(
+            reverse('posts:add_comment', args=[self.post.id]),
+            {'text': text, 'parent': parent.id if parent else ''})
+
+    def test_batch_saved_with_signals(self):
+        """Комментарии разных пользователей копятся и сохраняются одной
+        пачкой; сигналы обновляют счётчик и пути веток."""
+        first, second, third = map(self.client_for, self.readers)
+        self.comment(first, 'Первый')
+        self.comment(second, 'Второй')
+        self.assertFalse(Comment.objects.exists())
+        self.comment(third, 'Третий')
+        self.assertEqual(Comment.objects.count(), 3)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 3)
+        self.assertFalse(Comment.objects.filter(path='').exists())
+
+    def test_read_your_writes(self):
+        """Автор записи сразу видит её на следующей странице."""
+        client = self.client_for(self.readers[0])
+        self.comment(client, 'Свой комментарий')
+        self.assertFalse(Comment.objects.exists())
+        response = client.get(
+            reverse('posts:post_detail', args=[self.post.id]))
+        self.assertContains(response, 'Свой комментарий')
+        root = Comment.objects.get()
+        self.comment(client, 'Ответ', root)
+        client.get(reverse('posts:index'))
+        self.assertEqual(Comment.objects.get(text='Ответ').parent, root)
+
+    def test_waits_only_for_own_writes(self):
+        """Запрос пользователя сохраняет только его записи."""
+        self.comment(self.client_for(self.readers[1]), 'Чужой')
+        client = self.client_for(self.readers[0])
+        self.comment(client, 'Свой')
+        client.get(reverse('posts:index'))
+        self.assertEqual(Comment.objects.get().text, 'Свой')
+        self.assertEqual(PendingWrite.objects.get().user, self.readers[1])
+
+    @override_settings(WRITE_BEHIND_WAIT=0)
+    def test_wait_limited(self):
+        """Ожидание не дольше WRITE_BEHIND_WAIT, даже если записи
+        пользователя не удаётся сохранить."""
+        write_behind.enqueue(Comment(post_id=self.post.id,
+                                     author=self.readers[0], text='Первый'))
+        with self.assertLogs('posts.write_behind', 'WARNING'):
+            write_behind.wait_for(self.readers[0].id)
+        self.assertTrue(PendingWrite.objects.exists())
+        self.assertFalse(Comment.objects.exists())
+
+    def test_spooled_before_response(self):
+        """Запись фиксируется в очереди до ответа и сохраняется при
+        разборе очереди."""
+        self.comment(self.client_for(self.readers[0]), 'В очереди')
+        pending = PendingWrite.objects.get()
+        self.assertEqual(pending.user, self.readers[0])
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(write_behind.drain(), 1)
+        self.assertFalse(PendingWrite.objects.exists())
+        self.assertEqual(Comment.objects.get().text, 'В очереди')
+
+    def test_unfollow_after_pending_follow(self):
+        """Отписка выполняется после подписки из очереди."""
+        client = self.client_for(self.readers[0])
+        client.get(reverse('posts:profile_follow', args=['author']))
+        self.assertFalse(Follow.objects.exists())
+        client.get(reverse('posts:profile_unfollow', args=['author']))
+        self.assertFalse(Follow.objects.exists())
+        self.assertFalse(PendingWrite.objects.exists())
+        self.author.stats.refresh_from_db()
+        self.assertEqual(self.author.stats.followers_count, 0)
+
+    def test_follows_deduplicated(self):
+        client = self.client_for(self.readers[0])
+        url = reverse('posts:profile_follow', args=['author'])
+        write_behind.enqueue(Follow(user=self.readers[0], author=self.author))
+        client.get(url)
+        client.get(reverse('posts:follow_index'))
+        self.assertEqual(Follow.objects.count(), 1)
+        self.author.stats.refresh_from_db()
+        self.assertEqual(self.author.stats.followers_count, 1)
+        self.assertTrue(FeedEntry.objects.filter(
+            user=self.readers[0], post=self.post).exists())
+
+
+@override_settings(WRITE_BEHIND_ENABLED=True, WRITE_BEHIND_INTERVAL=0.001,
+                   WRITE_BEHIND_BATCH_SIZE=100)
+class WriteBehindThreadTest(TransactionTestCase):
+    # С SQLITE_PRODUCTION чтение вне транзакции уходит на реплики
+    databases = {'default', *settings.DATABASE_READ_REPLICAS}
+
+    def test_background_flush_and_shutdown(self):
+        """Фоновый поток сохраняет очередь; остановка досохраняет её."""
+        author = User.objects.create_user(username='author')
+        post = Post.objects.create(text='Пост', author=author)
+        for number in range(5):
+            write_behind.enqueue(Comment(post=post, author=author,
+                                         text=f'Комментарий {number}'))
+        write_behind.wait_for(author.id)
+        self.assertEqual(Comment.objects.count(), 5)
+        write_behind.shutdown()
+        # Запись, которую не успел сохранить остановленный процесс,
+        # остаётся в очереди и сохраняется любым другим
+        with override_settings(WRITE_BEHIND_INTERVAL=None):
+            write_behind.enqueue(Comment(post=post, author=author,
+                                         text='Ещё'))
+        self.assertTrue(PendingWrite.objects.exists())
+        write_behind.drain()
+        self.assertFalse(PendingWrite.objects.exists())
+        self.assertEqual(Comment.objects.count(), 6)
+
+
+@override_settings(STREAMING_CHUNK_SIZE=2)
+class StreamingRenderTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(title='Группа', slug='stream',
+                                         description='Описание')
+        for number in range(5):
+            Post.objects.create(text=f'Потоковый пост {number}',
+                                author=cls.author, group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_streamed(self, url, client=None):
+        with self.settings(STREAMING_RENDER=True):
+            response = (client or self.client).get(url)
+        self.assertTrue(response.streaming)
+        return [chunk.decode() for chunk in response.streaming_content]
+
+    def test_same_page(self):
+        """Потоковая отрисовка выдаёт ту же страницу, что и обычная."""
+        for url in (reverse('posts:index'),
+                    reverse('posts:group_list', args=[self.group.slug]),
+                    reverse('posts:profile', args=[self.author.username])):
+            with self.subTest(url=url):
+                page = self.client.get(url).content.decode()
+                cache.clear()
+                self.assertEqual(''.join(self.get_streamed(url)), page)
+                cache.clear()
+
+    def test_chunks(self):
+        """Шапка уходит первым куском, посты - по STREAMING_CHUNK_SIZE."""
+        chunks = self.get_streamed(reverse('posts:index'))
+        self.assertIn('<head>', chunks[0])
+        self.assertNotIn('Потоковый пост', chunks[0])
+        self.assertEqual([chunk.count('Потоковый пост') for chunk in chunks
+                          if 'Потоковый пост' in chunk], [2, 2, 1])
+        self.assertIn('</html>', chunks[-1])
+
+    def test_follow_page(self):
+        """Лента подписок тоже отдаётся по кускам."""
+        reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=reader, author=self.author)
+        client = Client()
+        client.force_login(reader)
+        page = ''.join(self.get_streamed(reverse('posts:follow_index'),
+                                         client))
+        self.assertEqual(page.count('все записи группы'), 5)
+
+    def test_fragment_cached(self):
+        """Отправленный целиком фрагмент ленты попадает в кэш."""
+        url = reverse('posts:index')
+        page = ''.join(self.get_streamed(url))
+        # update() не отправляет сигналов и не сбрасывает кэш
+        Post.objects.update(text='Изменён')
+        self.assertEqual(''.join(self.get_streamed(url)), page)
+
+    def test_marker_in_post_text(self):
+        """Текст поста, похожий на метку, выводится как есть."""
+        Post.objects.create(text='До \x00stream:0\x00 после',
+                            author=self.author)
+        url = reverse('posts:index')
+        page = self.client.get(url).content.decode()
+        cache.clear()
+        self.assertIn('\x00stream:0\x00', page)
+        self.assertEqual(''.join(self.get_streamed(url)), page)
+
+    @override_settings(QUERY_BUDGET=1, QUERY_BUDGET_RAISE=True)
+    def test_body_queries_in_budget(self):
+        """Запросы при отдаче тела учитываются QueryBudgetMiddleware."""
+        with self.assertRaises(QueryBudgetExceeded):
+            self.get_streamed(reverse('posts:index'), Client())
+
+    def test_body_in_metrics(self):
+        """Потоковый ответ учитывается в метриках после отдачи тела
+        вместе с его запросами."""
+        metrics.reset()
+        client = Client()
+        with self.settings(STREAMING_RENDER=True):
+            response = client.get(reverse('posts:index'))
+        key = ('yatube_http_requests_total',
+               (('view', 'posts:index'), ('method', 'GET'),
+                ('status', '200')))
+        self.assertNotIn(key, metrics.local_snapshot())
+        queries = CaptureQueriesContext(connection)
+        with queries:
+            b''.join(response.streaming_content)
+        snapshot = metrics.local_snapshot()
+        self.assertEqual(snapshot[key], 1)
+        self.assertGreaterEqual(
+            snapshot[('yatube_db_queries_total',
+                      (('view', 'posts:index'),))],
+            len(queries.captured_queries))
+
+    def test_streamed_tag(self):
+        """Цикл в блоке streamed даёт тот же результат, что и без него,
+        в том числе {% empty %}."""
+        source = ('{% for item in items %}{{ forloop.counter }}:{{ item }}'
+                  '{% if not forloop.last %}, {% endif %}'
+                  '{% empty %}пусто{% endfor %}')
+        streamed = Template('{% load feed_stream %}{% streamed %}'
+                            + source + '{% endstreamed %}')
+        stream = streaming.PageStream()
+        for items in ('абв', []):
+            with self.subTest(items=items):
+                page = streamed.render(Context(
+                    {'items': items, streaming.STREAM_KEY: stream}))
+                self.assertEqual(''.join(stream.expand(page)),
+                                 Template(source).render(
+                                     Context({'items': items})))
@@ -0,0 +1,106 @@
+"""Ветки комментариев в виде материализованного пути.
+
+Путь комментария - путь родителя плюс сегмент из собственного id
+фиксированной ширины, поэтому сортировка по path выдаёт ветки целиком
+и в порядке показа, а ветка (поддерево) - это диапазон
+[path, path + '~'). И то, и другое читается одним запросом по индексу
+(post, path) без рекурсии.
+
+Сегмент верхнего уровня - «перевёрнутый» id, чтобы новые ветки шли
+первыми; ответы внутри ветки идут по порядку создания.
+"""
+import string
+
+from django.conf import settings
+
+SEGMENT_WIDTH = 8
+DIGITS = string.digits + string.ascii_lowercase
+MAX_ID = len(DIGITS) ** SEGMENT_WIDTH - 1
+# Больше любого символа сегмента: path + END - верхняя граница ветки
+END = '~'
+BATCH_SIZE = 2000
+
+
+def segment(comment_id, top_level):
+    """Сегмент пути фиксированной ширины в base36."""
+    number = MAX_ID - comment_id if top_level else comment_id
+    digits = []
+    for _ in range(SEGMENT_WIDTH):
+        number, digit = divmod(number, len(DIGITS))
+        digits.append(DIGITS[digit])
+    return ''.join(reversed(digits))
+
+
+def make_path(comment_id, parent_path=''):
+    return parent_path + segment(comment_id, not parent_path)
+
+
+def depth_of(path):
+    return len(path) // SEGMENT_WIDTH - 1
+
+
+def reply_parent(parent):
+    """Комментарий, к которому на самом деле крепится ответ: ответы
+    глубже COMMENT_MAX_DEPTH становятся соседями родителя."""
+    while parent is not None and parent.depth >= settings.COMMENT_MAX_DEPTH:
+        parent = parent.parent
+    return parent
+
+
+def assign_path(comment):
+    """Записывает путь только что созданного комментария (id известен
+    лишь после INSERT)."""
+    parent_path = comment.parent.path if comment.parent_id else ''
+    comment.path = make_path(comment.id, parent_path)
+    comment.depth = depth_of(comment.path)
+    type(comment).objects.filter(pk=comment.pk).update(
+        path=comment.path, depth=comment.depth)
+
+
+def subtree(queryset, path):
+    """Комментарий с путём path и все ответы на него по порядку."""
+    return queryset.filter(path__gte=path, path__lt=path + END).order_by(
+        'path')
+
+
+def threads(queryset, roots):
+    """Ветки комментариев верхнего уровня roots (путей, идущих подряд)
+    вместе со всеми ответами одним диапазонным запросом."""
+    if not roots:
+        return []
+    return list(thread_range(queryset, roots[0], roots[-1]))
+
+
+def thread_range(queryset, first, last):
+    """Запрос веток от корня first до корня last включительно."""
+    return queryset.filter(path__gte=first, path__lt=last + END).order_by(
+        'path')
+
+
+def rebuild(apps=None):
+    """Заполняет пути комментариев, созданных в обход сигналов
+    (bulk_create, миграция). Родитель всегда старше ответа, поэтому
+    при обходе по id его путь уже известен."""
+    if apps is None:
+        from .models import Comment
+    else:
+        Comment = apps.get_model('posts', 'Comment')
+    pending = Comment.objects.filter(path='').order_by('id').values_list(
+        'id', 'parent_id', 'parent__path')
+    updated = 0
+    while True:
+        chunk = list(pending[:BATCH_SIZE])
+        if not chunk:
+            return updated
+        # Пути из прошлых порций уже в БД, из текущей - только здесь
+        paths = {}
+        comments = []
+        for comment_id, parent_id, parent_path in chunk:
+            if parent_id is not None:
+                parent_path = paths.get(parent_id, parent_path)
+            path = make_path(comment_id, parent_path or '')
+            paths[comment_id] = path
+            comments.append(Comment(id=comment_id, path=path,
+                                    depth=depth_of(path)))
+        Comment.objects.bulk_update(comments, ['path', 'depth'])
+        updated += len(comments)
@@ -0,0 +1,211 @@
+"""Заранее подготовленные миниатюры картинок постов.
+
+Декодирование и масштабирование картинки выполняет фоновый пул потоков
+сразу после сохранения поста, а не первый запрос страницы. Фоновая
+работа не обращается к БД: она только записывает файл миниатюры.
+Запись в хранилище ключей sorl-thumbnail делает запрос, который первым
+увидит готовый файл (см. cached_thumbnail), - это одна проверка
+существования файла. Пока миниатюры нет, шаблон показывает исходную
+картинку.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+
+from core import metrics, profiling
+
+from . import feed_cache
+
+logger = logging.getLogger(__name__)
+
+# Размеры, в которых шаблоны показывают картинки постов
+SIZES = (
+    ('200x200', {'crop': 'center'}),
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+# Картинки в очереди и картинки, миниатюры которых не удалось создать,
+# с моментом, после которого можно пробовать снова
+_pending = set()
+_failed = {}
+FAILED_LIMIT = 1000
+_pending_lock = threading.Lock()
+
+
+# Закрытые методы ThumbnailBackend, на которых построен
+# PregeneratingBackend: их нет в публичном API, поэтому версия
+# sorl-thumbnail закреплена в requirements.txt, а тест проверяет, что
+# методы на месте
+SORL_INTERNALS = ('_get_format', '_get_thumbnail_filename',
+                  '_create_thumbnail', '_create_alternative_resolutions')
+
+
+class PregeneratingBackend(ThumbnailBackend):
+    """Разделяет создание файла миниатюры и его регистрацию в хранилище
+    ключей sorl-thumbnail."""
+
+    def _prepare(self, file_, geometry_string, options):
+        source = ImageFile(file_)
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return source, ImageFile(name, default.storage)
+
+    def get_cached_thumbnail(self, file_, geometry_string, **options):
+        """Миниатюра из хранилища ключей или None. Файл, созданный
+        фоновой работой, регистрируется здесь же."""
+        source, thumbnail = self._prepare(file_, geometry_string, options)
+        cached = default.kvstore.get(thumbnail)
+        if cached:
+            return cached
+        if not thumbnail.exists():
+            return None
+        default.kvstore.get_or_set(source)
+        default.kvstore.set(thumbnail, source)
+        return thumbnail
+
+    def render(self, file_, geometry_string, **options):
+        """Создаёт файл миниатюры, не обращаясь к БД."""
+        source, thumbnail = self._prepare(file_, geometry_string, options)
+        if thumbnail.exists():
+            return thumbnail
+        source_image = default.engine.get_image(source)
+        try:
+            options['image_info'] = default.engine.get_image_info(
+                source_image)
+            source.set_size(default.engine.get_image_size(source_image))
+            self._create_thumbnail(source_image, geometry_string, options,
+                                   thumbnail)
+            self._create_alternative_resolutions(
+                source_image, geometry_string, options, thumbnail.name)
+        finally:
+            default.engine.cleanup(source_image)
+        return thumbnail
+
+
+backend = PregeneratingBackend()
+
+
+def cached_thumbnail(image, geometry_string, **options):
+    """Готовая миниатюра или None, если она ещё создаётся."""
+    if not image:
+        return None
+    with profiling.section(profiling.THUMBNAIL):
+        return backend.get_cached_thumbnail(image, geometry_string,
+                                            **options)
+
+
+def render(name):
+    """Создаёт файлы всех миниатюр картинки. Не обращается к БД, поэтому
+    безопасно выполняется в фоновых потоках и процессах."""
+    started = time.perf_counter()
+    try:
+        if not default.storage.exists(name):
+            return False
+        for geometry_string, options in SIZES:
+            backend.render(name, geometry_string, **options)
+    except Exception:
+        logger.exception('Не удалось создать миниатюру %s', name)
+        return False
+    metrics.observe('yatube_thumbnail_render_seconds',
+                    time.perf_counter() - started)
+    return True
+
+
+def _work(name, scopes):
+    rendered = False
+    try:
+        rendered = render(name)
+        if rendered:
+            # страницы, закэшированные с исходной картинкой, устарели
+            feed_cache.invalidate(*scopes)
+    finally:
+        with _pending_lock:
+            _pending.discard(name)
+            if not rendered:
+                _remember_failure(name)
+
+
+def _remember_failure(name):
+    """Вызывается под _pending_lock."""
+    now = time.monotonic()
+    if len(_failed) >= FAILED_LIMIT:
+        for expired in [key for key, retry_at in _failed.items()
+                        if retry_at <= now]:
+            del _failed[expired]
+    _failed[name] = now + settings.THUMBNAIL_RETRY_AFTER
+
+
+def _waiting(name):
+    """Миниатюры картинки уже создаются или недавно не получились.
+    Вызывается под _pending_lock."""
+    if name in _pending:
+        return True
+    retry_at = _failed.get(name)
+    if retry_at is None:
+        return False
+    if retry_at > time.monotonic():
+        return True
+    del _failed[name]
+    return False
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails',
+            )
+    return _executor
+
+
+def schedule(post, follow_scopes=True):
+    """Ставит картинку поста в очередь на создание миниатюр после
+    фиксации транзакции. С THUMBNAIL_ASYNC = False миниатюры создаются
+    сразу.
+
+    follow_scopes=False - не сбрасывать ленты подписчиков автора (это
+    запрос к Follow): так делает шаблон, в котором нашлась картинка без
+    миниатюры; в лентах подписок она до их обновления показывается
+    исходной.
+    """
+    name = post.image.name
+    if not name:
+        return
+    with _pending_lock:
+        if _waiting(name):
+            return
+        if not settings.THUMBNAIL_ASYNC:
+            _pending.add(name)
+    if not settings.THUMBNAIL_ASYNC:
+        with profiling.section(profiling.THUMBNAIL):
+            _work(name, ())
+        return
+    scopes = feed_cache.post_scopes(post, followers=follow_scopes)
+    transaction.on_commit(lambda: _submit(name, scopes))
+
+
+def _submit(name, scopes):
+    with _pending_lock:
+        if _waiting(name):
+            return
+        _pending.add(name)
+    get_executor().submit(_work, name, scopes)
@@ -0,0 +1,319 @@
+"""Потоковый импорт и экспорт постов в NDJSON и CSV.
+
+Запись - один пост: text, author (username), group (slug или пусто),
+pub_date (ISO 8601) и image (путь в хранилище). Импорт читает вход
+порциями по chunk_size записей: авторов и группы порции находит двумя
+запросами IN (...), а посты вставляет в транзакции одним executemany
+заранее собранного INSERT. bulk_create здесь не подходит: компиляция
+каждого значения в ORM занимает почти всё время импорта, тогда как
+executemany выполняет один подготовленный запрос в C. Сигналы при
+вставке не отправляются, ленты, счётчики и поисковый индекс
+пересобирает bulk.refresh_derived().
+Экспорт читает посты через .iterator(chunk_size), поэтому память не
+зависит от числа постов.
+"""
+import csv
+import json
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from datetime import timezone as dt_timezone
+from operator import itemgetter
+
+from django.conf import settings
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Group, Post, User
+
+FORMATS = ('ndjson', 'csv')
+FIELDS = ('text', 'author', 'group', 'pub_date', 'image')
+CHUNK_SIZE = 5000
+# Кэш страниц SQLite на время импорта
+IMPORT_CACHE_KIB = 128 * 1024
+# Порядок значений в кортежах, которые собирает Importer._post();
+# остальные поля поста получают значения по умолчанию
+IMPORTED_FIELDS = ('text', 'pub_date', 'image', 'author_id', 'group_id')
+
+
+class RecordError(ValueError):
+    """Запись, которую нельзя импортировать."""
+
+    def __init__(self, line, message):
+        super().__init__(f'Запись {line}: {message}')
+        self.line = line
+
+
+def read_records(stream, file_format):
+    """Записи входного потока по одной. Вместо строки NDJSON, которая
+    не разбирается, выдаётся RecordError: решение, пропустить её или
+    остановить импорт, принимает Importer."""
+    if file_format == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    number = 0
+    for line in stream:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            yield json.loads(line)
+        except ValueError as error:
+            yield RecordError(number, f'неверный JSON ({error})')
+
+
+def write_records(stream, records, file_format):
+    """Пишет записи в поток, возвращает их число."""
+    count = 0
+    if file_format == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(FIELDS)
+        for record in records:
+            writer.writerow(record)
+            count += 1
+        return count
+    dumps = json.JSONEncoder(ensure_ascii=False).encode
+    for record in records:
+        # Одна запись - один вызов write: строка целиком и перевод строки
+        stream.write(dumps(dict(zip(FIELDS, record))) + '\n')
+        count += 1
+    return count
+
+
+def export_records(queryset=None, chunk_size=CHUNK_SIZE):
+    """Кортежи полей FIELDS для постов queryset в порядке id."""
+    queryset = Post.objects.all() if queryset is None else queryset
+    rows = queryset.order_by('id').values_list(
+        'text', 'author__username', 'group__slug', 'pub_date', 'image')
+    for text, author, group, pub_date, image in rows.iterator(
+            chunk_size=chunk_size):
+        yield text, author, group or '', pub_date.isoformat(), image or ''
+
+
+def parse_date(value):
+    """datetime.fromisoformat написан на C и разбирает вывод экспорта
+    на порядок быстрее parse_datetime, который остаётся для прочих
+    допустимых в Django форм записи."""
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return parse_datetime(value)
+
+
+@contextmanager
+def sqlite_cache_size(kibibytes):
+    """Временно увеличивает кэш страниц соединения SQLite.
+
+    Посты вставляются в пять индексов вразнобой (по автору, группе,
+    дате); с кэшем по умолчанию в 2 МБ страницы индексов постоянно
+    вытесняются и перечитываются, и вставка замедляется вдвое.
+    """
+    if connection.vendor != 'sqlite':
+        yield
+        return
+    with connection.cursor() as cursor:
+        previous = cursor.execute('PRAGMA cache_size').fetchone()[0]
+        cursor.execute(f'PRAGMA cache_size = {-int(kibibytes)}')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA cache_size = {int(previous)}')
+
+
+@contextmanager
+def deferred_indexes(model):
+    """Снимает вторичные индексы модели на время блока и создаёт их
+    заново в конце.
+
+    Построить индекс по готовой таблице быстрее, чем обновлять его при
+    вставке каждой строки, когда индекс перестаёт помещаться в кэш
+    страниц: benchmark_transfer --posts 1000000 даёт около 30 тыс.
+    постов/с против 22-23 тыс. без снятия индексов, а на 100 тыс. постов
+    выигрыш теряется в разбросе замеров. Пока блок выполняется, запросы
+    по таблице идут без индексов, - это режим для загрузки большого
+    объёма в пустую или закрытую на обслуживание базу.
+    """
+    editor = connection.schema_editor()
+    statements = [str(statement)
+                  for statement in editor._model_indexes_sql(model)]
+    table = model._meta.db_table
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+        dropped = [
+            name for name, info in constraints.items()
+            if info['index'] and not info['unique']
+            and any(f'INDEX {quote(name)} ' in sql for sql in statements)
+        ]
+        for name in dropped:
+            cursor.execute(editor.sql_delete_index % {
+                'table': quote(table), 'name': quote(name)})
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                if any(f'INDEX {quote(name)} ' in sql for name in dropped):
+                    cursor.execute(sql)
+
+
+def _chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Importer:
+    """Импорт записей порциями.
+
+    Найденные id авторов и групп запоминаются между порциями, поэтому
+    каждый username и slug ищется в БД не больше одного раза.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, create_authors=False,
+                 create_groups=False, skip_invalid=False,
+                 defer_indexes=False):
+        self.chunk_size = chunk_size
+        self.create_authors = create_authors
+        self.create_groups = create_groups
+        self.skip_invalid = skip_invalid
+        self.defer_indexes = defer_indexes
+        self.authors = {}
+        self.groups = {}
+        self.imported = 0
+        self.skipped = 0
+        self.now = timezone.now()
+        # Даты хранятся в UTC: переводим в UTC сами через datetime.timezone
+        # (C), а не через pytz внутри adapt_datetimefield_value - это
+        # треть времени подготовки строки
+        self.utc_storage = (settings.USE_TZ
+                            and connection.timezone_name == 'UTC')
+        fields = [field for field in Post._meta.concrete_fields
+                  if not field.primary_key]
+        # Значения по умолчанию дописываются в конец кортежа _post(),
+        # а itemgetter (C) расставляет всё в порядке столбцов INSERT
+        defaults = [field for field in fields
+                    if field.attname not in IMPORTED_FIELDS]
+        self.defaults = tuple(
+            field.get_db_prep_save(field.get_default(), connection)
+            for field in defaults)
+        names = IMPORTED_FIELDS + tuple(field.attname for field in defaults)
+        self.arrange = itemgetter(*(names.index(field.attname)
+                                    for field in fields))
+        self.insert_sql = (
+            'INSERT INTO {} ({}) VALUES ({})'.format(
+                connection.ops.quote_name(Post._meta.db_table),
+                ', '.join(connection.ops.quote_name(field.column)
+                          for field in fields),
+                ', '.join(['%s'] * len(fields))))
+
+    def run(self, records, progress=None):
+        line = 0
+        with ExitStack() as stack:
+            stack.enter_context(sqlite_cache_size(IMPORT_CACHE_KIB))
+            if self.defer_indexes:
+                stack.enter_context(deferred_indexes(Post))
+            for chunk in _chunks(records, self.chunk_size):
+                self.import_chunk(chunk, line)
+                line += len(chunk)
+                if progress is not None:
+                    progress(self)
+        return self.imported
+
+    def _resolve(self, model, field, names, known, create):
+        missing = {name for name in names if name and name not in known}
+        if not missing:
+            return
+        known.update(model.objects.filter(
+            **{f'{field}__in': missing}).values_list(field, 'pk'))
+        missing -= known.keys()
+        if missing and create:
+            model.objects.bulk_create(
+                (self._new(model, name) for name in missing),
+                ignore_conflicts=True)
+            known.update(model.objects.filter(
+                **{f'{field}__in': missing}).values_list(field, 'pk'))
+
+    @staticmethod
+    def _new(model, name):
+        if model is User:
+            return User(username=name,
+                        password=f'{UNUSABLE_PASSWORD_PREFIX}import')
+        return Group(title=name, slug=name, description='')
+
+    def adapt_date(self, value):
+        if self.utc_storage:
+            value = value.astimezone(dt_timezone.utc).replace(tzinfo=None)
+        return connection.ops.adapt_datetimefield_value(value)
+
+    def _post(self, record, line):
+        text = record.get('text')
+        if not text:
+            raise RecordError(line, 'пустой текст')
+        author_id = self.authors.get(record.get('author'))
+        if author_id is None:
+            raise RecordError(
+                line, f'нет пользователя {record.get("author")!r}')
+        slug = record.get('group') or None
+        group_id = self.groups.get(slug) if slug else None
+        if slug and group_id is None:
+            raise RecordError(line, f'нет группы {slug!r}')
+        pub_date = self.now
+        if record.get('pub_date'):
+            pub_date = parse_date(record['pub_date'])
+            if pub_date is None:
+                raise RecordError(
+                    line, f'неверная дата {record["pub_date"]!r}')
+            if timezone.is_naive(pub_date):
+                pub_date = timezone.make_aware(pub_date)
+        return self.arrange((text, self.adapt_date(pub_date),
+                             record.get('image') or '', author_id,
+                             group_id) + self.defaults)
+
+    @staticmethod
+    def _check(record, line):
+        if isinstance(record, RecordError):
+            raise record
+        if not isinstance(record, dict):
+            raise RecordError(line, 'запись должна быть объектом')
+        for field in FIELDS:
+            if not isinstance(record.get(field) or '', str):
+                raise RecordError(line, f'поле {field} должно быть строкой')
+
+    def _invalid(self, error):
+        if not self.skip_invalid:
+            raise error
+        self.skipped += 1
+
+    def import_chunk(self, chunk, first_line=0):
+        records = []
+        for line, record in enumerate(chunk, start=first_line + 1):
+            try:
+                self._check(record, line)
+            except RecordError as error:
+                self._invalid(error)
+            else:
+                records.append((line, record))
+        self._resolve(User, 'username',
+                      {record.get('author') for _, record in records},
+                      self.authors, self.create_authors)
+        self._resolve(Group, 'slug',
+                      {record.get('group') for _, record in records},
+                      self.groups, self.create_groups)
+        rows = []
+        for line, record in records:
+            try:
+                rows.append(self._post(record, line))
+            except RecordError as error:
+                self._invalid(error)
+        if rows:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(self.insert_sql, rows)
+        self.imported += len(rows)
@@ -0,0 +1,234 @@
+"""Популярные посты и сообщества с затуханием по времени.
+
+Оценка - сумма весов событий (публикация, комментарий, новый подписчик
+автора), каждый из которых со временем теряет половину веса за
+TRENDING_HALF_LIFE секунд. Чтобы не пересчитывать все оценки при каждом
+событии, вес хранится приведённым к моменту TrendingClock.epoch:
+событие в момент t добавляет weight * 2 ** ((t - epoch) / half_life).
+Порядок по такой оценке совпадает с порядком по затухшей, поэтому
+ленту «Популярное» отдаёт один запрос по индексу (-score).
+
+Сигналы меняют оценки атомарным UPDATE ... SET score = score + x.
+Приведённые веса растут экспоненциально, поэтому команда
+decay_trending периодически переносит epoch на текущий момент,
+умножая все оценки на один множитель, и удаляет оценки ниже
+MIN_SCORE. Если команду давно не запускали, epoch переносит сам
+bump(), когда от epoch прошло больше REBASE_AFTER периодов.
+"""
+from datetime import timedelta
+
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+POST_WEIGHT = 1.0
+COMMENT_WEIGHT = 2.0
+FOLLOW_WEIGHT = 3.0
+# Новый подписчик поднимает посты автора не старше этого срока
+FOLLOW_WINDOW = timedelta(days=3)
+# Оценки ниже удаляются при затухании: пост с одной публикацией
+# без комментариев уходит из таблицы примерно через 7 периодов
+MIN_SCORE = 0.01
+BATCH_SIZE = 2000
+# Через столько периодов полураспада от epoch bump() сам вызывает
+# decay(): приведённый вес 2 ** 64 ещё далёк от переполнения float
+REBASE_AFTER = 64
+# Предел показателя в boost(): 2 ** 1024 уже не помещается в float
+MAX_EXPONENT = 512
+# Оценки считаются по событиям не старше стольких периодов
+# (более старые давно ниже MIN_SCORE)
+HORIZON = 20
+
+
+def _model(apps, name):
+    return apps.get_model('posts', name)
+
+
+def epoch(apps=global_apps):
+    TrendingClock = _model(apps, 'TrendingClock')
+    clock, _ = TrendingClock.objects.get_or_create(
+        pk=1, defaults={'epoch': timezone.now()})
+    return clock.epoch
+
+
+def boost(moment, since):
+    """Вес события в момент moment, приведённый к моменту since."""
+    exponent = (moment - since).total_seconds() / settings.TRENDING_HALF_LIFE
+    return 2 ** max(-MAX_EXPONENT, min(exponent, MAX_EXPONENT))
+
+
+def _add(model, field, ids, value):
+    """Прибавляет value к оценкам ids.
+
+    Недостающие строки сначала вставляются с нулём (INSERT OR IGNORE),
+    поэтому прибавка не теряется, даже если строку одновременно
+    создаёт другой запрос.
+    """
+    ids = set(ids)
+    if not ids:
+        return
+    model.objects.bulk_create([model(**{field: pk}) for pk in ids],
+                              ignore_conflicts=True)
+    model.objects.filter(**{f'{field}__in': ids}).update(
+        score=F('score') + value)
+
+
+def current_epoch(now=None):
+    """epoch, перенесённый на now, если он отстал больше чем на
+    REBASE_AFTER периодов."""
+    now = now or timezone.now()
+    clock = epoch()
+    if (now - clock).total_seconds() > (REBASE_AFTER
+                                        * settings.TRENDING_HALF_LIFE):
+        decay(now)
+        clock = now
+    return clock
+
+
+def bump(post_ids, group_ids, weight, moment=None):
+    value = weight * boost(moment or timezone.now(), current_epoch())
+    PostScore = _model(global_apps, 'PostScore')
+    GroupScore = _model(global_apps, 'GroupScore')
+    _add(PostScore, 'post_id', post_ids, value)
+    _add(GroupScore, 'group_id',
+         (pk for pk in group_ids if pk is not None), value)
+
+
+def post_published(post):
+    bump([post.id], [post.group_id], POST_WEIGHT, post.pub_date)
+
+
+def comment_added(comment):
+    Post = _model(global_apps, 'Post')
+    group_id = Post.objects.filter(pk=comment.post_id).values_list(
+        'group_id', flat=True).first()
+    bump([comment.post_id], [group_id], COMMENT_WEIGHT, comment.created)
+
+
+def author_followed(author_id):
+    """Новый подписчик поднимает недавние посты автора и их сообщества."""
+    Post = _model(global_apps, 'Post')
+    recent = list(Post.objects.filter(
+        author_id=author_id,
+        pub_date__gte=timezone.now() - FOLLOW_WINDOW,
+    ).values_list('id', 'group_id'))
+    if recent:
+        post_ids, group_ids = zip(*recent)
+        bump(post_ids, set(group_ids), FOLLOW_WEIGHT)
+
+
+def decay(now=None, apps=global_apps):
+    """Переносит epoch на момент now: умножает все оценки на
+    2 ** -((now - epoch) / half_life) и удаляет оценки ниже MIN_SCORE.
+
+    Возвращает словарь {модель: число удалённых строк}.
+    """
+    now = now or timezone.now()
+    TrendingClock = _model(apps, 'TrendingClock')
+    removed = {}
+    with transaction.atomic():
+        epoch(apps)
+        clock = TrendingClock.objects.select_for_update().get(pk=1)
+        factor = 1 / boost(now, clock.epoch)
+        for name in ('PostScore', 'GroupScore'):
+            scores = _model(apps, name).objects.all()
+            scores.update(score=F('score') * factor)
+            removed[name] = scores.filter(score__lt=MIN_SCORE).delete()[0]
+        clock.epoch = now
+        clock.save(update_fields=['epoch'])
+    return removed
+
+
+def _collect(posts, comments, since):
+    """Оценки по публикациям posts и комментариям comments, приведённые
+    к моменту since: ({id поста: оценка}, {id группы: оценка})."""
+    post_scores, group_scores = {}, {}
+
+    def add(post_id, group_id, value):
+        post_scores[post_id] = post_scores.get(post_id, 0) + value
+        if group_id is not None:
+            group_scores[group_id] = group_scores.get(group_id, 0) + value
+
+    rows = posts.values_list('id', 'group_id', 'pub_date')
+    for post_id, group_id, pub_date in rows.iterator():
+        add(post_id, group_id, POST_WEIGHT * boost(pub_date, since))
+    rows = comments.values_list('post_id', 'post__group_id', 'created')
+    for post_id, group_id, created in rows.iterator():
+        add(post_id, group_id, COMMENT_WEIGHT * boost(created, since))
+    return post_scores, group_scores
+
+
+def rebuild(apps=global_apps):
+    """Пересчитывает оценки по публикациям и комментариям за последние
+    HORIZON периодов полураспада.
+
+    Подписки не хранят дату, поэтому их вклад при пересчёте теряется.
+    Возвращает число постов с оценкой.
+    """
+    Post = _model(apps, 'Post')
+    Comment = _model(apps, 'Comment')
+    PostScore = _model(apps, 'PostScore')
+    GroupScore = _model(apps, 'GroupScore')
+    TrendingClock = _model(apps, 'TrendingClock')
+    now = timezone.now()
+    since = now - timedelta(seconds=HORIZON * settings.TRENDING_HALF_LIFE)
+    posts, groups = _collect(
+        Post.objects.filter(pub_date__gte=since),
+        Comment.objects.filter(created__gte=since, post__isnull=False), now)
+
+    with transaction.atomic():
+        TrendingClock.objects.update_or_create(
+            pk=1, defaults={'epoch': now})
+        PostScore.objects.all().delete()
+        GroupScore.objects.all().delete()
+        PostScore.objects.bulk_create(
+            (PostScore(post_id=pk, score=score)
+             for pk, score in posts.items() if score >= MIN_SCORE),
+            batch_size=BATCH_SIZE)
+        GroupScore.objects.bulk_create(
+            (GroupScore(group_id=pk, score=score)
+             for pk, score in groups.items() if score >= MIN_SCORE),
+            batch_size=BATCH_SIZE)
+    return len(posts)
+
+
+def score_unscored():
+    """Оценивает недавние посты, у которых ещё нет оценки (загруженные
+    в обход сигналов), по их публикации и комментариям. Остальные
+    оценки, в том числе вклад подписок, не меняются. Возвращает число
+    оценённых постов."""
+    Post = _model(global_apps, 'Post')
+    Comment = _model(global_apps, 'Comment')
+    PostScore = _model(global_apps, 'PostScore')
+    GroupScore = _model(global_apps, 'GroupScore')
+    clock = current_epoch()
+    since = timezone.now() - timedelta(
+        seconds=HORIZON * settings.TRENDING_HALF_LIFE)
+    unscored = Post.objects.filter(pub_date__gte=since, trend__isnull=True)
+    # Оба запроса выполняются до вставки оценок, которая меняет unscored
+    posts, groups = _collect(
+        unscored, Comment.objects.filter(post__in=unscored), clock)
+    with transaction.atomic():
+        PostScore.objects.bulk_create(
+            (PostScore(post_id=pk, score=score)
+             for pk, score in posts.items() if score >= MIN_SCORE),
+            batch_size=BATCH_SIZE, ignore_conflicts=True)
+        for group_id, score in groups.items():
+            _add(GroupScore, 'group_id', [group_id], score)
+    return len(posts)
+
+
+def trending_posts():
+    """Оценки популярных постов вместе с постами: один запрос,
+    идущий по индексу (-score) без сортировки."""
+    PostScore = _model(global_apps, 'PostScore')
+    return PostScore.objects.select_related(
+        'post__author', 'post__group').order_by('-score', '-post_id')
+
+
+def trending_groups():
+    GroupScore = _model(global_apps, 'GroupScore')
+    return GroupScore.objects.select_related('group').order_by(
+        '-score', '-group_id')
@@ -0,0 +1,157 @@
+"""Обработка загружаемых картинок постов с ограниченным расходом памяти.
+
+Размеры картинки берутся из заголовка файла без декодирования пикселей,
+поэтому слишком большие загрузки отклоняются до того, как Pillow
+выделит под них память. JPEG декодируется сразу в уменьшенном масштабе
+(draft mode: масштабирование 1/2, 1/4, 1/8 выполняется декодером), так
+что в памяти не оказывается полноразмерная копия. Результат
+перекодируется без EXIF, XMP и комментариев и пишется во временный
+файл, который хранится в памяти, пока он небольшой, и уходит
+в хранилище частями.
+"""
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
+from django.template.defaultfilters import filesizeformat
+from PIL import Image
+
+# Форматы, в которых картинка сохраняется как есть; остальные
+# перекодируются в PNG
+OUTPUT_FORMATS = {
+    'JPEG': ('.jpg', 'image/jpeg'),
+    'PNG': ('.png', 'image/png'),
+    'GIF': ('.gif', 'image/gif'),
+    'WEBP': ('.webp', 'image/webp'),
+}
+FALLBACK_FORMAT = 'PNG'
+# MPO - JPEG с дополнительными кадрами (стерео, превью), так снимают
+# многие телефоны: сохраняется первый кадр как обычный JPEG
+STILL_FORMATS = {'MPO': 'JPEG'}
+# Сведения об анимации, которые переносятся в перекодированный файл
+ANIMATION_INFO = ('duration', 'loop', 'disposal', 'blend', 'background')
+# Всё остальное из image.info (EXIF, XMP, комментарии) отбрасывается:
+# запись GIF берёт сведения не только из параметров save(), но и оттуда
+KEPT_INFO = ('icc_profile', 'transparency') + ANIMATION_INFO
+PNG_MODES = {'1', 'L', 'LA', 'P', 'RGB', 'RGBA', 'I', 'I;16'}
+
+# Поворот по тегу EXIF Orientation: сам тег при сохранении отбрасывается
+ORIENTATION = 0x0112
+TRANSPOSE = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+
+
+def inspect(upload):
+    """Проверяет размер файла и картинки по заголовку, не декодируя её.
+
+    Возвращает (формат, (ширина, высота)).
+    """
+    if upload.size > settings.IMAGE_UPLOAD_MAX_SIZE:
+        raise ValidationError(
+            'Файл больше %(limit)s.', code='file_too_large',
+            params={'limit': filesizeformat(settings.IMAGE_UPLOAD_MAX_SIZE)},
+        )
+    upload.seek(0)
+    try:
+        # Image.open читает только заголовок
+        with Image.open(upload) as image:
+            image_format, size = image.format, image.size
+    except (OSError, Image.DecompressionBombError):
+        raise ValidationError('Не удалось прочитать картинку.',
+                              code='invalid_image')
+    width, height = size
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            'Картинка %(width)s×%(height)s больше допустимых '
+            '%(limit)g Мп.', code='image_too_large',
+            params={'width': width, 'height': height,
+                    'limit': settings.IMAGE_MAX_PIXELS / 10 ** 6},
+        )
+    return image_format, size
+
+
+def _save_options(image, image_format):
+    # Переносятся только сведения, нужные для правильного показа;
+    # EXIF, XMP и комментарии не передаются и не сохраняются.
+    options = {}
+    if 'icc_profile' in image.info:
+        options['icc_profile'] = image.info['icc_profile']
+    if image_format == 'JPEG':
+        options['quality'] = settings.IMAGE_JPEG_QUALITY
+    if 'transparency' in image.info and image_format in ('PNG', 'GIF'):
+        options['transparency'] = image.info['transparency']
+    if image_format == 'GIF':
+        # Переход к кадру заново читает его комментарий в image.info,
+        # пустой комментарий в параметрах save() не записывается
+        options['comment'] = b''
+    return options
+
+
+def _output(upload, image_format, save):
+    """Файл, в который save(output) записал перекодированную картинку."""
+    extension, content_type = OUTPUT_FORMATS[image_format]
+    output = tempfile.SpooledTemporaryFile(
+        max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    save(output)
+    size = output.tell()
+    output.seek(0)
+    name = os.path.splitext(os.path.basename(upload.name))[0] + extension
+    return UploadedFile(output, name=name, content_type=content_type,
+                        size=size)
+
+
+def _reencode_animation(upload, image, image_format):
+    if image_format not in OUTPUT_FORMATS:
+        image_format = FALLBACK_FORMAT
+    options = _save_options(image, image_format)
+    options.update((key, image.info[key]) for key in ANIMATION_INFO
+                   if key in image.info)
+    return _output(upload, image_format, lambda output: image.save(
+        output, image_format, save_all=True, **options))
+
+
+def process(upload):
+    """Уменьшает картинку до IMAGE_MAX_EDGE по большей стороне, убирает
+    метаданные и возвращает новый UploadedFile."""
+    image_format, (width, height) = inspect(upload)
+    max_edge = settings.IMAGE_MAX_EDGE
+    upload.seek(0)
+    with Image.open(upload) as image:
+        image.info = {key: image.info[key] for key in KEPT_INFO
+                      if key in image.info}
+        image_format = STILL_FORMATS.get(image_format, image_format)
+        if (getattr(image, 'is_animated', False)
+                and image.format not in STILL_FORMATS):
+            # Кадры не уменьшаются: перекодирование анимации только
+            # убирает из неё метаданные
+            if max(width, height) > max_edge:
+                raise ValidationError(
+                    'Анимированная картинка больше %(edge)s точек '
+                    'по стороне.', code='image_too_large',
+                    params={'edge': max_edge},
+                )
+            return _reencode_animation(upload, image, image_format)
+        orientation = image.getexif().get(ORIENTATION)
+        if image_format == 'JPEG':
+            image.draft(image.mode, (max_edge, max_edge))
+        # thumbnail() уменьшает на месте и сначала грубо сжимает
+        # картинку через reduce(), не создавая полноразмерных копий.
+        image.thumbnail((max_edge, max_edge))
+        if orientation in TRANSPOSE:
+            image = image.transpose(TRANSPOSE[orientation])
+        if image_format not in OUTPUT_FORMATS:
+            image_format = FALLBACK_FORMAT
+            if image.mode not in PNG_MODES:
+                image = image.convert(
+                    'RGBA' if 'A' in image.getbands() else 'RGB')
+        return _output(upload, image_format, lambda output: image.save(
+            output, image_format, **_save_options(image, image_format)))
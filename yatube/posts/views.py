@@ -2,66 +2,178 @@ from django.core.paginator import Paginator
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 
+from . import (feed_cache, recommendations, search, streaming, threads,
+               trending, write_behind)
+from .conditional import (conditional_page, group_validators,
+                          index_validators, post_detail_validators,
+                          profile_validators)
 from .models import Post, Group, User, Comment, Follow
 from .forms import PostForm, CommentForm
+from .feeds import follow_feed, group_feed, index_feed, profile_feed
+from .paginators import CursorPaginator, InvalidCursor
 from django.conf import settings
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
+from django.urls import reverse
+from django.utils.http import urlencode
 
 PAG_LIST = settings.PAG_NUM
 
 
 def page_objects(request, post_list):
+    """Страница ленты: по курсору (?cursor=) или по номеру (?page=).
+
+    Режим по умолчанию задаёт settings.PAGINATION_MODE, явный ?page=N
+    всегда обслуживается обычным Paginator.
+    """
+    cursor = request.GET.get('cursor')
+    use_cursor = (settings.PAGINATION_MODE == 'cursor'
+                  and 'page' not in request.GET)
+    if cursor is not None or use_cursor:
+        ordering = post_list.query.order_by or ('-pub_date', '-id')
+        return CursorPaginator(post_list, PAG_LIST,
+                               ordering).get_page(cursor)
     paginator = Paginator(post_list, PAG_LIST)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     return page_obj
 
 
+@conditional_page(index_validators)
 def index(request):
-    post_list = Post.objects.all()
+    post_list = index_feed()
     page_obj = page_objects(request, post_list)
     context = {
         'page_obj': page_obj,
+        'feed_cache_key': feed_cache.make_key('index', request, 'all'),
+    }
+    return streaming.render(request, 'posts/index.html', context)
+
+
+def post_search(request):
+    query = request.GET.get('q', '').strip()
+    post_list = search.search(
+        Post.objects.select_related('author', 'group'), query)
+    page_obj = page_objects(request, post_list)
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+        'page_query': urlencode({'q': query}) + '&',
+    }
+    return render(request, 'posts/search.html', context)
+
+
+def trending_index(request):
+    """Популярные посты и сообщества: по запросу к таблицам оценок,
+    без агрегатов по комментариям."""
+    posts = trending.trending_posts()[:settings.TRENDING_POSTS_SHOWN]
+    groups = trending.trending_groups()[:settings.TRENDING_GROUPS_SHOWN]
+    context = {
+        'posts': [score.post for score in posts],
+        'groups': [score.group for score in groups],
     }
-    return render(request, 'posts/index.html', context)
+    return render(request, 'posts/trending.html', context)
 
 
+@conditional_page(group_validators)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
+    post_list = group_feed(group)
     page_obj = page_objects(request, post_list)
     context = {
         'group': group,
         'page_obj': page_obj,
+        'feed_cache_key': feed_cache.make_key(
+            'group_list', request, f'group:{group.id}'),
     }
-    return render(request, 'posts/group_list.html', context)
+    return streaming.render(request, 'posts/group_list.html', context)
 
 
+@conditional_page(profile_validators)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts.all()
+    author = get_object_or_404(User.objects.select_related('stats'),
+                               username=username)
+    post_list = profile_feed(author)
     page_obj = page_objects(request, post_list)
     context = {
         'author': author,
         'page_obj': page_obj,
+        'feed_cache_key': feed_cache.make_key(
+            'profile', request, f'author:{author.id}'),
     }
-    return render(request, 'posts/profile.html', context)
+    if author == request.user:
+        context['suggestions'] = recommendations.for_user(request.user)
+    return streaming.render(request, 'posts/profile.html', context)
 
 
+@conditional_page(post_detail_validators)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), id=post_id)
     form = CommentForm(request.POST or None)
-    comments = Comment.objects.filter(post=post)
     context = {
         'post': post,
         'form': form,
-        'comments': comments,
+        # Сервер отрисовывает только первую страницу комментариев,
+        # следующие подгружаются через post_comments
+        'comments': comment_page(post.id),
+        # Ссылки «Ответить» есть только у вошедших: им свой фрагмент
+        'comments_cache_key': feed_cache.make_key(
+            'post_detail:user' if request.user.is_authenticated
+            else 'post_detail', request, f'post:{post.id}'),
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+def comment_page(post_id, cursor=None):
+    """Страница веток комментариев поста.
+
+    Курсор листает комментарии верхнего уровня по пути, затем их ветки
+    вместе с ответами и авторами читаются одним запросом по диапазону
+    путей (см. posts.threads).
+    """
+    roots = Comment.objects.filter(post_id=post_id, depth=0).values('path')
+    page = CursorPaginator(roots, settings.COMMENTS_PER_PAGE,
+                           ('path',)).page(cursor)
+    page.object_list = threads.threads(
+        Comment.objects.select_related('author').filter(post_id=post_id),
+        [root['path'] for root in page.object_list])
+    return page
+
+
+@conditional_page(post_detail_validators)
+def post_comments(request, post_id):
+    """Следующая страница комментариев: HTML-фрагмент для кнопки
+    «Показать ещё» или JSON (?format=json)."""
+    if not Post.objects.filter(id=post_id).exists():
+        raise Http404
+    try:
+        page = comment_page(post_id, request.GET.get('cursor') or None)
+    except InvalidCursor:
+        return HttpResponseBadRequest('Неверный курсор.')
+    if request.GET.get('format') != 'json':
+        return render(request, 'posts/includes/comment_page.html',
+                      {'page': page, 'post_id': post_id})
+    next_url = None
+    if page.has_next():
+        next_url = '{}?{}'.format(
+            reverse('posts:comments', args=[post_id]),
+            urlencode({'format': 'json', 'cursor': page.next_cursor}))
+    return JsonResponse({
+        'comments': [{
+            'id': comment.id,
+            'author': comment.author.username,
+            'text': comment.text,
+            'created': comment.created.isoformat(),
+            'parent': comment.parent_id,
+            'depth': comment.depth,
+        } for comment in page],
+        'next': next_url,
+    }, json_dumps_params={'ensure_ascii': False})
+
+
 @login_required
 def post_create(request):
-    form = PostForm(request.POST or None)
+    form = PostForm(request.POST or None, files=request.FILES or None)
     if form.is_valid():
         form = form.save(commit=False)
         form.author = request.user
@@ -96,34 +208,49 @@ def post_edit(request, post_id):
 @login_required
 def add_comment(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
-    form = CommentForm(request.POST or None)
+    parent = None
+    parent_id = request.POST.get('parent', '')
+    if parent_id:
+        if not parent_id.isdigit():
+            raise Http404
+        parent = get_object_or_404(Comment, pk=parent_id, post=post)
+    form = CommentForm(request.POST or None, parent=parent)
     if form.is_valid():
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        if not write_behind.enqueue(comment):
+            comment.save()
     return redirect('posts:post_detail', post_id=post_id)
 
 
 @login_required
 def follow_index(request):
     template = 'posts/follow.html'
-    post_list = Post.objects.filter(author__following__user=request.user)
+    post_list = follow_feed(request.user)
     page_obj = page_objects(request, post_list)
-    context = {'page_obj': page_obj}
-    return render(request, template, context)
+    context = {
+        'page_obj': page_obj,
+        'feed_cache_key': feed_cache.make_key(
+            'follow_index', request, f'follow:{request.user.id}'),
+        'suggestions': recommendations.for_user(request.user),
+    }
+    return streaming.render(request, template, context)
 
 
 @login_required
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if author != request.user:
-        Follow.objects.get_or_create(user=request.user, author=author)
+        follow = Follow(user=request.user, author=author)
+        if not write_behind.enqueue(follow):
+            Follow.objects.get_or_create(user=request.user, author=author)
 
     return redirect('posts:profile', username=username)
 
 
 @login_required
 def profile_unfollow(request, username):
-    Follow.objects.filter(author__username=username).delete()
+    Follow.objects.filter(user=request.user,
+                          author__username=username).delete()
     return redirect('posts:profile', username=username)
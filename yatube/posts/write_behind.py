@@ -0,0 +1,297 @@
+"""Отложенная запись комментариев и подписок (write-behind).
+
+Каждый add_comment и profile_follow фиксирует свою транзакцию, а SQLite
+выполняет фиксации строго по одной: при всплеске комментариев к
+популярному посту запросы стоят в очереди за fsync и обработчиками
+сигналов (счётчики, ленты подписчиков, пути веток, оценки). С
+WRITE_BEHIND_ENABLED представление фиксирует одну короткую вставку
+строки PendingWrite - запись переживёт падение процесса, - а фоновый
+поток сохраняет накопленное одной транзакцией через bulk_create раз в
+WRITE_BEHIND_INTERVAL секунд или по WRITE_BEHIND_BATCH_SIZE записей.
+Фиксация на запрос при этом остаётся: из запроса уходят обработчики
+сигналов, индексы комментариев и записи в ленты, а не сама фиксация.
+Строки, оставшиеся от завершившихся процессов, поток подбирает раз
+в WRITE_BEHIND_POLL секунд.
+
+bulk_create не отправляет сигналы, поэтому после вставки сохранённые
+строки читаются одним запросом и для каждой отправляются pre_save и
+post_save: пути веток, счётчики, ленты, оценки и поколения кэша
+обновляются теми же обработчиками, что и при обычном save().
+
+Пачку забирает тот, кто первым удалил её строки из PendingWrite в той
+же транзакции, что и сохранение, поэтому каждая запись сохраняется
+один раз, даже если очередь разбирают несколько процессов.
+
+Читать свои записи: WriteBehindMiddleware перед запросом пользователя
+проверяет, есть ли в PendingWrite его записи (от любого процесса), и
+сохраняет их сам, не дольше WRITE_BEHIND_WAIT секунд. Записи других
+пользователей остаются фоновому потоку. Так же
+упорядочены подписка и следующая за ней отписка: отписка выполняется
+после сохранения подписки.
+"""
+import atexit
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from itertools import groupby
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import (IntegrityError, OperationalError, connection,
+                       transaction)
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Comment, Follow, PendingWrite
+
+logger = logging.getLogger(__name__)
+
+# Поле с id пользователя, который сделал запись
+OWNERS = {Comment: 'author_id', Follow: 'user_id'}
+# Поля, которые представления заполняют до сохранения
+FIELDS = {Comment: ('post_id', 'author_id', 'parent_id', 'text'),
+          Follow: ('user_id', 'author_id')}
+MODELS = {model._meta.model_name: model for model in FIELDS}
+# Пауза перед новой попыткой, пока очередь сохраняет другой процесс
+RETRY_DELAY = 0.01
+
+
+def owner(instance):
+    return getattr(instance, OWNERS[type(instance)])
+
+
+def _unsaved_follows(follows):
+    """Подписки без повторов внутри пачки и уже сохранённых."""
+    unique = OrderedDict(((follow.user_id, follow.author_id), follow)
+                         for follow in follows)
+    existing = set(Follow.objects.filter(
+        user_id__in={user_id for user_id, _ in unique}).values_list(
+        'user_id', 'author_id'))
+    return [follow for pair, follow in unique.items()
+            if pair not in existing]
+
+
+def save_batch(model, objects):
+    """Вставляет objects одним bulk_create и отправляет сигналы
+    сохранения для вставленных строк. Вызывается в транзакции."""
+    if model is Follow:
+        objects = _unsaved_follows(objects)
+    if not objects:
+        return 0
+    last_id = model.objects.order_by('-id').values_list(
+        'id', flat=True).first() or 0
+    for instance in objects:
+        pre_save.send(sender=model, instance=instance, raw=False,
+                      using=connection.alias, update_fields=None)
+    model.objects.bulk_create(objects)
+    # В SQLite bulk_create не возвращает id: новые строки - это строки
+    # авторов пачки с id больше прежнего наибольшего (запись в БД
+    # в транзакции идёт одна)
+    saved = model.objects.filter(
+        id__gt=last_id,
+        **{f'{OWNERS[model]}__in': {owner(obj) for obj in objects}},
+    ).order_by('id')
+    count = 0
+    for instance in saved:
+        post_save.send(sender=model, instance=instance, created=True,
+                       raw=False, using=connection.alias,
+                       update_fields=None)
+        count += 1
+    return count
+
+
+def _instance(row):
+    model = MODELS[row.model]
+    return model(**json.loads(row.data))
+
+
+def _save_rows(rows):
+    """Одной транзакцией удаляет rows из очереди и сохраняет их записи
+    в исходном порядке. Если часть строк уже забрал другой процесс,
+    ничего не сохраняет и возвращает 0."""
+    with transaction.atomic():
+        # Удаление - первая запись транзакции: она ждёт, пока другой
+        # процесс зафиксирует свою пачку, и видит её результат
+        claimed, _ = PendingWrite.objects.filter(
+            id__in=[row.id for row in rows]).delete()
+        if claimed != len(rows):
+            transaction.set_rollback(True)
+            return 0
+        saved = 0
+        for model, objects in groupby(map(_instance, rows), key=type):
+            saved += save_batch(model, list(objects))
+        return saved
+
+
+def drain(limit=None, user_id=None):
+    """Сохраняет до limit самых старых отложенных записей (по умолчанию
+    WRITE_BEHIND_BATCH_SIZE), с user_id - только записи пользователя.
+    Возвращает число сохранённых записей.
+
+    OperationalError (БД занята другим процессом) не перехватывается:
+    пачка остаётся в очереди до следующей попытки.
+    """
+    rows = PendingWrite.objects.order_by('id')
+    if user_id is not None:
+        rows = rows.filter(user_id=user_id)
+    rows = list(rows[:limit or settings.WRITE_BEHIND_BATCH_SIZE])
+    if not rows:
+        return 0
+    try:
+        return _save_rows(rows)
+    except IntegrityError:
+        logger.warning('Пачка из %s записей не сохранилась, '
+                       'сохраняем по одной', len(rows), exc_info=True)
+    saved = 0
+    for row in rows:
+        try:
+            saved += _save_rows([row])
+        except IntegrityError:
+            # Например, пост удалён: запись больше не сохранить
+            logger.exception('Отложенная запись %s %s отброшена',
+                             row.model, row.data)
+            PendingWrite.objects.filter(id=row.id).delete()
+    return saved
+
+
+def drain_all():
+    while drain():
+        pass
+
+
+class Flusher:
+    """Фоновый поток процесса, разбирающий очередь PendingWrite."""
+
+    def __init__(self, interval, batch_size):
+        self.interval = interval
+        self.batch_size = batch_size
+        # Записи, добавленные этим процессом с прошлого разбора
+        self._added = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def added(self):
+        with self._condition:
+            self._added += 1
+            self._start()
+            self._condition.notify_all()
+
+    def _start(self):
+        if self._thread is None and not self._stopping:
+            self._thread = threading.Thread(
+                target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                with self._condition:
+                    self._condition.wait_for(
+                        lambda: self._added or self._stopping,
+                        settings.WRITE_BEHIND_POLL)
+                    if self._stopping:
+                        return
+                    # Первая запись пришла: ждём остальные не дольше
+                    # interval или до полной пачки
+                    self._condition.wait_for(
+                        lambda: (self._stopping
+                                 or self._added >= self.batch_size),
+                        self.interval)
+                    self._added = 0
+                try:
+                    drain_all()
+                except OperationalError:
+                    # Очередь разбирает другой процесс
+                    time.sleep(RETRY_DELAY)
+                    with self._condition:
+                        self._added += 1
+                except Exception:
+                    logger.exception('Ошибка отложенной записи')
+        finally:
+            connection.close()
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def start():
+    """Запускает фоновый разбор очереди в этом процессе."""
+    global _flusher
+    if settings.WRITE_BEHIND_INTERVAL is None:
+        return None
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = Flusher(settings.WRITE_BEHIND_INTERVAL,
+                               settings.WRITE_BEHIND_BATCH_SIZE)
+            _flusher._start()
+    return _flusher
+
+
+def enqueue(instance):
+    """Фиксирует несохранённый комментарий или подписку в очереди.
+    Возвращает False, если отложенная запись выключена и instance
+    нужно сохранить как обычно."""
+    if not settings.WRITE_BEHIND_ENABLED:
+        return False
+    model = type(instance)
+    PendingWrite.objects.create(
+        user_id=owner(instance), model=model._meta.model_name,
+        data=json.dumps({name: getattr(instance, name)
+                         for name in FIELDS[model]}))
+    flusher = start()
+    if flusher is not None:
+        flusher.added()
+    elif PendingWrite.objects.count() >= settings.WRITE_BEHIND_BATCH_SIZE:
+        # Без потока пачку сохраняет запрос, который её заполнил
+        drain_all()
+    return True
+
+
+def wait_for(user_id):
+    """Возвращается, когда записи пользователя сохранены (или прошло
+    WRITE_BEHIND_WAIT секунд)."""
+    deadline = time.monotonic() + settings.WRITE_BEHIND_WAIT
+    pending = PendingWrite.objects.filter(user_id=user_id)
+    while True:
+        try:
+            if not pending.exists():
+                return
+            if time.monotonic() >= deadline:
+                break
+            drain(user_id=user_id)
+        except OperationalError:
+            # Очередь сохраняет другой поток или процесс
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(RETRY_DELAY)
+    logger.warning('Записи пользователя %s не сохранены за %s с',
+                   user_id, settings.WRITE_BEHIND_WAIT)
+
+
+@atexit.register
+def shutdown():
+    """Останавливает фоновый поток. Несохранённые записи остаются
+    в PendingWrite и будут сохранены любым процессом."""
+    global _flusher
+    with _flusher_lock:
+        flusher, _flusher = _flusher, None
+    if flusher is not None:
+        flusher.stop()
+
+
+@receiver(setting_changed)
+def reset_flusher(setting, **kwargs):
+    if setting.startswith('WRITE_BEHIND_'):
+        shutdown()
@@ -0,0 +1,24 @@
+"""
+ASGI config for yatube project.
+
+It exposes the ASGI callable as a module-level variable named
+``application``: Django views run in a thread pool (see core.asgi) and
+the live event streams are served under LIVE_URL on the same loop.
+
+    uvicorn yatube.asgi:application
+"""
+
+import os
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+
+wsgi_application = get_wsgi_application()
+
+from core.asgi import ASGIHandler  # noqa: E402
+from live.sse import LiveEventsApp  # noqa: E402
+
+application = ASGIHandler(wsgi_application,
+                          mounts={settings.LIVE_URL: LiveEventsApp()})
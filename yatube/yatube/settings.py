@@ -40,6 +40,8 @@ INSTALLED_APPS = [
     'core.apps.CoreConfig',
     'users.apps.UsersConfig',
     'posts.apps.PostsConfig',
+    'api.apps.ApiConfig',
+    'live.apps.LiveConfig',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -55,8 +57,12 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'posts.middleware.WriteBehindMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.QueryBudgetMiddleware',
+    'core.middleware.ProfilingMiddleware',
+    'core.middleware.MetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
@@ -92,6 +98,49 @@ DATABASES = {
     }
 }
 
+# Режим SQLite для продакшена (core.db): прагмы SQLITE_PRAGMAS у каждого
+# нового соединения (WAL, synchronous, кэш, mmap), постоянные соединения
+# на SQLITE_CONN_MAX_AGE секунд и ожидание блокировки до
+# SQLITE_BUSY_TIMEOUT секунд вместо ошибки «database is locked».
+# Чтение лент уходит на реплики SQLITE_READ_REPLICAS (ReadReplicaRouter).
+# По умолчанию реплика - тот же файл, открытый только для чтения;
+# отдельная копия (sqlite3 .backup, Litestream) разгружает диск
+# основной БД, но отстаёт от неё на время копирования. Включается
+# переменной окружения SQLITE_PRODUCTION=1.
+SQLITE_PRODUCTION = os.environ.get('SQLITE_PRODUCTION', '').lower() in (
+    '1', 'true', 'yes')
+SQLITE_CONN_MAX_AGE = 10 * 60
+SQLITE_BUSY_TIMEOUT = 5
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    # в КиБ, если отрицательный
+    'cache_size': -64 * 1024,
+    'mmap_size': 256 * 2 ** 20,
+    'temp_store': 'MEMORY',
+}
+SQLITE_READ_REPLICAS = [DATABASES['default']['NAME']]
+# Псевдонимы реплик в DATABASES, заполняются ниже
+DATABASE_READ_REPLICAS = []
+
+if SQLITE_PRODUCTION:
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': SQLITE_CONN_MAX_AGE,
+        'OPTIONS': {'timeout': SQLITE_BUSY_TIMEOUT},
+    })
+    for number, path in enumerate(SQLITE_READ_REPLICAS):
+        alias = f'replica{number}'
+        DATABASES[alias] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': f'file:{path}?mode=ro',
+            'CONN_MAX_AGE': SQLITE_CONN_MAX_AGE,
+            'OPTIONS': {'timeout': SQLITE_BUSY_TIMEOUT},
+            # В тестах реплика - то же соединение, что и default
+            'TEST': {'MIRROR': 'default'},
+        }
+        DATABASE_READ_REPLICAS.append(alias)
+    DATABASE_ROUTERS = ['core.db.ReadReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -141,6 +190,147 @@ EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 PAG_NUM = 10
+# веток комментариев на странице поста и в каждой подгружаемой порции
+COMMENTS_PER_PAGE = 20
+# наибольшая глубина ответов: ответ на комментарий этой глубины
+# становится ответом на его родителя
+COMMENT_MAX_DEPTH = 4
+# 'page' - нумерованные страницы (?page=N), 'cursor' - поиск по ключу
+# (pub_date, id) без COUNT(*) и OFFSET; ?page=N работает в обоих режимах
+PAGINATION_MODE = 'page'
+# сколько последних постов автора добавлять в ленту при подписке
+# (None - все)
+FEED_BACKFILL_LIMIT = None
+# сколько лучших авторов хранить в рекомендациях пользователя и сколько
+# из них показывать в блоке «Кого почитать»
+RECOMMENDATIONS_TOP_K = 50
+RECOMMENDATIONS_SHOWN = 5
+# период полураспада оценок популярности в секундах и сколько постов
+# и сообществ показывать на странице «Популярное» (см. posts.trending)
+TRENDING_HALF_LIFE = 24 * 60 * 60
+TRENDING_POSTS_SHOWN = 20
+TRENDING_GROUPS_SHOWN = 5
+
+# Отложенная запись комментариев и подписок (posts.write_behind):
+# add_comment и profile_follow фиксируют проверенные записи в таблице
+# PendingWrite, фоновый поток сохраняет их одной транзакцией раз
+# в WRITE_BEHIND_INTERVAL секунд или по WRITE_BEHIND_BATCH_SIZE записей
+# (None вместо интервала - без потока, пачку сохраняет заполнивший её
+# запрос), а записи завершившихся процессов подбирает раз
+# в WRITE_BEHIND_POLL секунд. Запрос автора ждёт сохранения своих
+# записей не дольше WRITE_BEHIND_WAIT секунд.
+WRITE_BEHIND_ENABLED = False
+WRITE_BEHIND_INTERVAL = 0.005
+WRITE_BEHIND_BATCH_SIZE = 100
+WRITE_BEHIND_WAIT = 1.0
+WRITE_BEHIND_POLL = 5.0
+
+# Живые обновления (приложение live): о новых постах и комментариях
+# сообщают Server-Sent Events. Потоки отдаёт отдельный ASGI-процесс
+# (uvicorn live.asgi:application), которому прокси передаёт запросы
+# с префиксом LIVE_URL. События других процессов он читает из таблицы
+# LiveEvent раз в LIVE_POLL_INTERVAL секунд и хранит их
+# LIVE_EVENT_TTL секунд - столько клиент может догонять пропущенное
+# по Last-Event-ID. Соединение, в очереди которого накопилось
+# LIVE_QUEUE_SIZE непрочитанных событий, закрывается.
+LIVE_EVENTS_ENABLED = False
+LIVE_URL = '/live/'
+LIVE_POLL_INTERVAL = 0.5
+LIVE_HEARTBEAT = 15
+LIVE_EVENT_TTL = 10 * 60
+LIVE_QUEUE_SIZE = 100
+
+# Запуск под ASGI (uvicorn yatube.asgi:application, см. core.asgi):
+# представления выполняются в пуле из ASGI_THREADS потоков, а ответы
+# медленным клиентам отправляет цикл событий. Поток представления ждёт
+# клиента, только когда тот отстал больше чем на ASGI_RESPONSE_BUFFER
+# байт потокового ответа. Тело запроса больше DATA_UPLOAD_MAX_MEMORY_SIZE
+# (для multipart - плюс IMAGE_UPLOAD_MAX_SIZE на файл картинки) получает
+# ответ 413, не дочитываясь.
+ASGI_THREADS = 16
+ASGI_RESPONSE_BUFFER = 2 ** 20
+
+# Потоковая отрисовка лент (posts.streaming): шапка страницы уходит
+# клиенту сразу, посты - по STREAMING_CHUNK_SIZE штук по мере
+# отрисовки. Middleware core учитывают и запросы при отдаче тела.
+STREAMING_RENDER = False
+STREAMING_CHUNK_SIZE = 5
+
+# Максимум SQL-запросов на запрос к представлению (None - не проверять).
+# При превышении QueryBudgetMiddleware пишет в лог core.query_budget,
+# а с QUERY_BUDGET_RAISE = True выбрасывает исключение.
+QUERY_BUDGET = None
+QUERY_BUDGET_RAISE = False
+
+# max-age для анонимных ответов index, group_posts, profile и
+# post_detail: столько секунд прокси отдаёт копию без проверки,
+# затем сверяет ETag (0 - сверять каждый раз).
+PUBLIC_PAGE_MAX_AGE = 0
+
+# ETag и 304 для страниц лент и JSON API (posts.conditional). None -
+# только если кэш FEED_CACHE_ALIAS общий для процессов: с LocMemCache
+# поколения, сдвинутые одним воркером, не видны другим. True можно
+# указать для сервера из одного процесса.
+CONDITIONAL_GET = None
+
+# Наибольший размер страницы JSON API (?limit=)
+API_MAX_PAGE_SIZE = 100
+
+# Кэш фрагментов лент (posts.feed_cache): псевдоним из CACHES и время
+# жизни фрагмента. Устаревание определяется поколениями, которые
+# сдвигают сигналы, поэтому TTL только ограничивает занимаемую память.
+# С несколькими воркерами укажите 'shared', чтобы инвалидация
+# доходила до всех процессов.
+FEED_CACHE_ALIAS = 'default'
+FEED_CACHE_TIMEOUT = 60 * 60
+
+# Миниатюры картинок постов создаются фоновым пулом потоков после
+# сохранения поста (posts.thumbnails). False - создавать сразу в запросе.
+# Картинку, миниатюру которой создать не удалось, страницы не ставят в
+# очередь снова THUMBNAIL_RETRY_AFTER секунд.
+THUMBNAIL_ASYNC = True
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_RETRY_AFTER = 10 * 60
+
+# Загрузка картинок постов (posts.uploads): размер файла в байтах,
+# число пикселей по заголовку, большая сторона после уменьшения.
+IMAGE_UPLOAD_MAX_SIZE = 20 * 2 ** 20
+IMAGE_MAX_PIXELS = 50 * 10 ** 6
+IMAGE_MAX_EDGE = 2048
+IMAGE_JPEG_QUALITY = 85
+
+# Поиск по постам (posts.search): None - FTS5, если миграция создала
+# таблицу posts_post_fts, иначе обратный индекс SearchTerm;
+# 'fts5' или 'terms' - выбрать явно.
+SEARCH_BACKEND = None
+
+# Профилирование запросов (core.profiling): разбивка времени
+# представлений на SQL, шаблоны, кэш и миниатюры. Статистика доступна
+# персоналу на /core/profiling/ и раз в PROFILING_FLUSH_INTERVAL секунд
+# пишется в PROFILING_DIR/profiling.jsonl. PROFILING_SAMPLE_RATE - доля
+# запросов, профилируемых cProfile (файлы в PROFILING_DIR/profiles/).
+PROFILING_ENABLED = False
+PROFILING_SAMPLE_RATE = 0.0
+PROFILING_DIR = os.path.join(BASE_DIR, 'profiling')
+PROFILING_FLUSH_INTERVAL = 60
+PROFILING_FILE_MAX_BYTES = 10 * 2 ** 20
+
+# Метрики Prometheus на /metrics (core.metrics). С несколькими
+# процессами укажите в METRICS_DIR общий каталог: каждый процесс раз
+# в METRICS_FLUSH_INTERVAL секунд сохраняет туда свои значения, а
+# снимки старше METRICS_STALE_AFTER секунд считаются оставшимися от
+# завершившихся процессов и удаляются.
+# /metrics доступен персоналу и сборщику с заголовком
+# Authorization: Bearer <METRICS_TOKEN>. METRICS_ALLOWED_IPS открывает
+# его без авторизации; за прокси на том же хосте REMOTE_ADDR всегда
+# 127.0.0.1, поэтому по умолчанию список пуст.
+METRICS_ENABLED = True
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 5
+METRICS_STALE_AFTER = 5 * 60
+METRICS_NAMESPACES = ('posts', 'users', 'about', 'api')
+METRICS_TOKEN = None
+METRICS_ALLOWED_IPS = ()
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
@@ -150,5 +340,15 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+    },
+    # Общий для всех воркеров хоста кэш без внешних сервисов
+    'shared': {
+        'BACKEND': 'core.cache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'MAX_SIZE': 64 * 2 ** 20,
+        },
+    },
 }